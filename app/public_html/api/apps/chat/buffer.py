@@ -0,0 +1,219 @@
+"""
+Write-behind persistence for chat text messages (CHAT_WRITE_BEHIND).
+
+`store_message()` is used by ChatConsumer and ChatRoomViewSet.send_message.
+By default it inserts the message and bumps the room's updated_at right away.
+In write-behind mode a text message is only queued, and `store_message()`
+returns a temporary id ("tmp-<hex>") that is broadcast in place of the real
+one. A daemon thread writes the queue every CHAT_FLUSH_INTERVAL seconds with
+`bulk_create` in batches of CHAT_FLUSH_BATCH, updates each room's updated_at
+once per batch, and then sends
+
+    {"type": "chat_message_saved", "temp_id": ..., "message_id": ...}
+
+to the room group so clients can swap in the real id. On databases that do
+not return ids from bulk inserts (MySQL) the ids are looked up with one query
+per batch. Messages with files are always written immediately.
+
+- Bounded memory: once CHAT_BUFFER_SIZE messages are pending, the next
+  `store_message()` flushes inline in the caller instead of growing the queue.
+- Ordering: created_at is the time the message was accepted, not the time it
+  was written, and chat messages are ordered by it. A text message queued
+  before an attachment therefore still sorts first, whichever process wrote
+  it. Ids only follow write order.
+- Failures: a failed batch goes back to the head of the queue. After
+  CHAT_FLUSH_MAX_ATTEMPTS failures its messages are written one at a time,
+  and the ones that still fail are logged with their content and dropped, so
+  one bad message cannot stop persistence.
+- Shutdown: the queue is flushed at interpreter exit. A hard kill (SIGKILL,
+  OOM) loses what was still pending, which is why the mode is opt-in.
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+
+from apps.users.broadcast import broadcast
+
+logger = logging.getLogger(__name__)
+
+
+class ChatMessageBuffer:
+    """FIFO of (temp id, unsaved ChatMessage) written in batches by a daemon thread."""
+
+    def __init__(self, interval, max_pending=5000, batch_size=500, max_attempts=3):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # Consecutive failed writes of the batch at the head of the queue
+        self._failures = 0
+        self._lock = threading.Lock()
+        # فقط یک نویسنده در هر لحظه، تا ترتیب پیام‌ها حفظ شود
+        self._flush_lock = threading.Lock()
+        self._pending = deque()
+        self._thread = None
+
+    def add(self, message):
+        """Queue an unsaved message; returns its temporary id."""
+        if self.pending() >= self.max_pending:
+            # Backpressure: write what is queued before accepting more
+            self.flush()
+        temp_id = f'tmp-{uuid.uuid4().hex}'
+        with self._lock:
+            self._pending.append((temp_id, message))
+        if self.interval > 0:
+            self._ensure_flusher()
+        else:
+            self.flush()
+        return temp_id
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write everything queued so far, in order; returns the number of messages written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    count = min(self.batch_size, len(self._pending))
+                    batch = [self._pending.popleft() for _ in range(count)]
+                if not batch:
+                    return written
+                if self._failures >= self.max_attempts:
+                    written += self._write_one_by_one(batch)
+                    self._failures = 0
+                    continue
+                try:
+                    self._write(batch)
+                except Exception:
+                    # Put the batch back at the head; the next flush retries it
+                    self._failures += 1
+                    for _, message in batch:
+                        message.pk = None
+                    with self._lock:
+                        self._pending.extendleft(reversed(batch))
+                    raise
+                self._failures = 0
+                written += len(batch)
+
+    def _write_one_by_one(self, batch):
+        """Write a repeatedly failing batch message by message, dropping the ones that fail."""
+        written = 0
+        for temp_id, message in batch:
+            try:
+                self._write([(temp_id, message)])
+            except Exception:
+                logger.exception(
+                    'Dropped chat message %s of room %s after %s failed writes: sender=%s at=%s message=%r',
+                    temp_id, message.room_id, self.max_attempts, message.sender_id,
+                    message.created_at.isoformat(), message.message,
+                )
+                message.pk = None
+            else:
+                written += 1
+        return written
+
+    def _write(self, batch):
+        from .models import ChatMessage, ChatRoom
+
+        messages = [message for _, message in batch]
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create(messages)
+                if any(message.pk is None for message in messages):
+                    _fill_missing_ids(messages)
+                last_message = {message.room_id: message.created_at for message in messages}
+                for room_id, created_at in last_message.items():
+                    ChatRoom.objects.filter(pk=room_id, updated_at__lt=created_at).update(updated_at=created_at)
+        except IntegrityError:
+            # A room was deleted after its messages were queued; drop those and retry once
+            rooms = set(ChatRoom.objects.filter(
+                pk__in={message.room_id for message in messages},
+            ).values_list('pk', flat=True))
+            kept = [(temp_id, message) for temp_id, message in batch if message.room_id in rooms]
+            if len(kept) == len(batch):
+                raise
+            logger.warning('Dropped %s queued chat messages of deleted rooms', len(batch) - len(kept))
+            for _, message in kept:
+                message.pk = None
+            if kept:
+                self._write(kept)
+            return
+
+        for temp_id, message in batch:
+            broadcast(f'chat_room_{message.room_id}', {
+                'type': 'chat_message_saved',
+                'temp_id': temp_id,
+                'message_id': message.pk,
+            })
+
+    def _ensure_flusher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-flusher', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing chat messages failed')
+            finally:
+                connections.close_all()
+
+
+def _fill_missing_ids(messages):
+    """Set the ids bulk_create could not return, matching rows on room, sender and accept time."""
+    from .models import ChatMessage
+
+    rows = ChatMessage.objects.filter(
+        room_id__in={message.room_id for message in messages},
+        created_at__gte=min(message.created_at for message in messages),
+        created_at__lte=max(message.created_at for message in messages),
+    ).order_by('id').values_list('id', 'room_id', 'sender_id', 'created_at')
+    ids = {}
+    for pk, *key in rows:
+        ids.setdefault(tuple(key), deque()).append(pk)
+    for message in messages:
+        candidates = ids.get((message.room_id, message.sender_id, message.created_at))
+        if candidates:
+            message.pk = candidates.popleft()
+
+
+buffer = ChatMessageBuffer(
+    settings.CHAT_FLUSH_INTERVAL, settings.CHAT_BUFFER_SIZE, settings.CHAT_FLUSH_BATCH,
+    settings.CHAT_FLUSH_MAX_ATTEMPTS,
+)
+
+
+def store_message(message):
+    """
+    Persist a new, unsaved ChatMessage and bump its room's updated_at.
+
+    Returns the id to broadcast: the real id, or a temporary one when the
+    message was queued in write-behind mode.
+    """
+    from .models import ChatRoom
+
+    # created_at (the accept time) is already set, so queued text messages keep
+    # their place before a later attachment that is written right away
+    if settings.CHAT_WRITE_BEHIND and not (message.image or message.audio or message.file):
+        return buffer.add(message)
+    message.save()
+    ChatRoom.objects.filter(
+        pk=message.room_id, updated_at__lt=message.created_at,
+    ).update(updated_at=message.created_at)
+    return message.pk
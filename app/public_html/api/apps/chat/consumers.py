@@ -1,73 +1,95 @@
 # مسیر: backend/apps/chat/consumers.py
 import json
+import logging
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.db import DatabaseError, IntegrityError
+from .buffer import store_message
 from .models import ChatRoom, ChatMessage
 
+logger = logging.getLogger(__name__)
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Chat room socket.
+
+    The room and the sender's permission are resolved once in connect(). Each
+    message then costs one thread-pool hop: the insert plus an update of the
+    room's updated_at, or only queueing it in write-behind mode (apps.chat.buffer).
+    """
+
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_room_{self.room_id}'
         self.user = self.scope.get('user')
-        
-        # بررسی وجود اتاق چت
-        room_exists = await self.check_room_exists()
-        if not room_exists:
+
+        # بررسی وجود اتاق چت و دسترسی ارسال، فقط یک بار
+        room_owner = await self.load_room()
+        if room_owner is False:
             await self.close()
             return
-        
+        self.sender_type = None
+        self.sender_name = None
+        if self.user and self.user.is_authenticated:
+            if self.user.is_staff or room_owner == self.user.id:
+                self.sender_type = 'admin' if self.user.is_staff else 'user'
+                self.sender_name = self.user.full_name or self.user.mobile
+
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        
+
         await self.accept()
-        print(f"✅ Chat WebSocket connected to room {self.room_id}")
-    
+        logger.debug('Chat WebSocket connected to room %s', self.room_id)
+
     async def disconnect(self, close_code):
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-        print(f"🔌 Chat WebSocket disconnected from room {self.room_id}")
-    
+        logger.debug('Chat WebSocket disconnected from room %s', self.room_id)
+
     @database_sync_to_async
-    def check_room_exists(self):
-        try:
-            ChatRoom.objects.get(id=self.room_id)
-            return True
-        except ChatRoom.DoesNotExist:
+    def load_room(self):
+        """The room owner's id (None for guest rooms), or False if the room does not exist."""
+        if not str(self.room_id).isdigit():
             return False
-    
+        owner = ChatRoom.objects.filter(pk=self.room_id).values_list('user_id', flat=True)
+        return next(iter(owner), False)
+
     async def receive(self, text_data):
         try:
             text_data_json = json.loads(text_data)
             message = text_data_json.get('message', '').strip()
-            
-            if not message:
+
+            if not message or self.sender_type is None:
                 return
-            
+
             # Save message to database
-            chat_message = await self.save_message(message)
-            
-            if chat_message:
+            saved = await self.save_message(message)
+
+            if saved:
+                message_id, chat_message = saved
                 # Send message to room group
                 await self.channel_layer.group_send(
                     self.room_group_name,
                     {
                         'type': 'chat_message',
-                        'message_id': chat_message.id,
+                        'message_id': message_id,
                         'message': chat_message.message,
                         'sender_type': chat_message.sender_type,
-                        'sender_name': await self.get_sender_name(chat_message),
+                        'sender_name': self.sender_name,
                         'created_at': chat_message.created_at.isoformat(),
                     }
                 )
         except json.JSONDecodeError:
             pass
-    
+
     async def chat_message(self, event):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
@@ -78,36 +100,25 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'sender_name': event['sender_name'],
             'created_at': event['created_at'],
         }))
-    
+
+    async def chat_message_saved(self, event):
+        # شناسه‌ی واقعی پیامی که با شناسه‌ی موقت ارسال شده بود
+        await self.send(text_data=json.dumps(event))
+
     @database_sync_to_async
     def save_message(self, message):
+        """(id to broadcast, message); the id is temporary in write-behind mode."""
+        chat_message = ChatMessage(
+            room_id=self.room_id,
+            sender_id=self.user.id,
+            sender_type=self.sender_type,
+            message=message
+        )
         try:
-            room = ChatRoom.objects.get(id=self.room_id)
-            
-            # Check if user has permission to send message in this room
-            if self.user and self.user.is_authenticated:
-                if not self.user.is_staff and room.user != self.user:
-                    return None
-                
-                sender_type = 'admin' if self.user.is_staff else 'user'
-                
-                chat_message = ChatMessage.objects.create(
-                    room=room,
-                    sender=self.user,
-                    sender_type=sender_type,
-                    message=message
-                )
-                
-                # Update room timestamp
-                room.save()
-                
-                return chat_message
-        except ChatRoom.DoesNotExist:
-            pass
-        return None
-    
-    @database_sync_to_async
-    def get_sender_name(self, message):
-        if message.sender:
-            return message.sender.full_name or message.sender.mobile
-        return "مهمان"
\ No newline at end of file
+            return store_message(chat_message), chat_message
+        except IntegrityError:
+            # اتاق پس از اتصال حذف شده است
+            return None
+        except DatabaseError:
+            logger.exception('Saving chat message in room %s failed', self.room_id)
+            return None
@@ -0,0 +1,64 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import override_settings
+
+from apps.chat.buffer import buffer, store_message
+from apps.chat.models import ChatMessage, ChatRoom
+
+
+class Command(BaseCommand):
+    help = 'Measure sustained chat message throughput with direct inserts and with write-behind.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5, help='Duration of each measurement.')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent senders.')
+        parser.add_argument('--rooms', type=int, default=10, help='Sample rooms the messages are spread over.')
+
+    def handle(self, *args, **options):
+        # Sample rooms are guest rooms; they and their messages are deleted at the end
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(guest_phone=f'bench-{uuid.uuid4().hex[:8]}') for _ in range(options['rooms'])
+        ])
+        room_ids = [room.pk for room in ChatRoom.objects.filter(guest_phone__in=[r.guest_phone for r in rooms])]
+        try:
+            for label, write_behind in (('direct', False), ('write-behind', True)):
+                with override_settings(CHAT_WRITE_BEHIND=write_behind):
+                    self.measure(label, room_ids, options['seconds'], options['threads'])
+        finally:
+            buffer.flush()
+            ChatRoom.objects.filter(pk__in=room_ids).delete()
+
+    def measure(self, label, room_ids, seconds, threads):
+        deadline = time.monotonic() + seconds
+
+        def send(worker):
+            sent = 0
+            try:
+                while time.monotonic() < deadline:
+                    store_message(ChatMessage(
+                        room_id=room_ids[(worker + sent) % len(room_ids)],
+                        sender_type='user',
+                        message=f'load test {worker}-{sent}',
+                    ))
+                    sent += 1
+            finally:
+                connections.close_all()
+            return sent
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            total = sum(pool.map(send, range(threads)))
+        accepted = time.perf_counter() - started
+        # Write-behind is only done once the queue is on disk
+        buffer.flush()
+        persisted = time.perf_counter() - started
+        stored = ChatMessage.objects.filter(room_id__in=room_ids).count()
+        self.stdout.write(
+            f'{label}: {total / accepted:.0f} msg/s accepted, {total / persisted:.0f} msg/s persisted '
+            f'({total} messages, {threads} threads, {stored} stored in sample rooms)'
+        )
+        ChatMessage.objects.filter(room_id__in=room_ids).delete()
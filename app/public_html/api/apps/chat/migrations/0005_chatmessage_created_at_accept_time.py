@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-17 23:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chatmessage_audio_chatmessage_file_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='تاریخ ارسال'),
+        ),
+    ]
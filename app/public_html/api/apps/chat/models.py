@@ -87,7 +87,8 @@ class ChatMessage(models.Model):
     file_size = models.PositiveIntegerField(null=True, blank=True, verbose_name='اندازه فایل')
     
     is_read = models.BooleanField(default=False, verbose_name='خوانده شده')
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ارسال')
+    # زمان پذیرش پیام؛ در ذخیره‌ی تأخیری (apps.chat.buffer) پیش از نوشتن در دیتابیس تعیین می‌شود
+    created_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name='تاریخ ارسال')
     
     class Meta:
         verbose_name = 'پیام چت'
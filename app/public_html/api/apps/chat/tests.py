@@ -0,0 +1,191 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from apps.users.middleware import ScopeUser
+from . import buffer as buffer_module
+from .buffer import ChatMessageBuffer
+from .models import ChatMessage, ChatRoom
+from .routing import websocket_urlpatterns
+
+
+def scope_user(user):
+    return ScopeUser(user.id, user.mobile, user.full_name, user.is_staff, user.is_superuser)
+
+
+class ChatConsumerTests(TransactionTestCase):
+    """Room and permissions are resolved at connect; a message is one insert plus one update."""
+
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create_user(mobile='09120000011', password='pass', full_name='Owner')
+        self.other = User.objects.create_user(mobile='09120000012', password='pass')
+        self.room = ChatRoom.objects.create(user=self.owner)
+
+    def run_session(self, user, room_id, steps):
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{room_id}/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            try:
+                await steps(communicator, connected)
+            finally:
+                await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_owner_message_is_saved_and_broadcast(self):
+        async def steps(communicator, connected):
+            self.assertTrue(connected)
+            await communicator.send_json_to({'message': ' hello '})
+            event = await communicator.receive_json_from()
+            self.assertEqual((event['message'], event['sender_type'], event['sender_name']), ('hello', 'user', 'Owner'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.run_session(scope_user(self.owner), self.room.id, steps)
+        # room lookup on connect, then the insert and the updated_at update
+        self.assertEqual(len(queries), 3)
+        message = ChatMessage.objects.get()
+        self.assertEqual((message.sender_id, message.room_id), (self.owner.id, self.room.id))
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.updated_at, message.created_at)
+
+    def test_non_member_cannot_send(self):
+        async def steps(communicator, connected):
+            self.assertTrue(connected)
+            await communicator.send_json_to({'message': 'hi'})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+
+        self.run_session(scope_user(self.other), self.room.id, steps)
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_missing_room_is_rejected(self):
+        async def steps(communicator, connected):
+            self.assertFalse(connected)
+
+        self.run_session(scope_user(self.owner), self.room.id + 100, steps)
+
+
+class ChatMessageBufferTests(TestCase):
+    """Write-behind messages are written in order, in bounded batches."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(mobile='09120000013', password='pass')
+        self.rooms = [ChatRoom.objects.create(user=self.user), ChatRoom.objects.create(guest_phone='09120000014')]
+        # A long interval keeps the flusher thread out of the way; tests flush explicitly
+        self.buffer = ChatMessageBuffer(interval=3600, max_pending=3, batch_size=2)
+        patcher = mock.patch.object(buffer_module, 'broadcast')
+        self.broadcast = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Nothing may be left for the atexit flush once the test database is gone
+        self.addCleanup(self.buffer.flush)
+
+    def message(self, room, text):
+        return ChatMessage(room_id=room.pk, sender_type='user', message=text)
+
+    def test_flush_writes_in_order_and_reports_real_ids(self):
+        temp_ids = [self.buffer.add(self.message(self.rooms[i % 2], str(i))) for i in range(3)]
+        self.assertFalse(ChatMessage.objects.exists())
+        self.assertTrue(all(temp_id.startswith('tmp-') for temp_id in temp_ids))
+
+        self.assertEqual(self.buffer.flush(), 3)
+        stored = list(ChatMessage.objects.order_by('id').values_list('id', 'message'))
+        self.assertEqual([text for _, text in stored], ['0', '1', '2'])
+        saved = [call.args[1] for call in self.broadcast.call_args_list]
+        self.assertEqual([(e['temp_id'], e['message_id']) for e in saved], list(zip(temp_ids, [pk for pk, _ in stored])))
+        self.rooms[0].refresh_from_db()
+        self.assertEqual(self.rooms[0].updated_at, ChatMessage.objects.get(message='2').created_at)
+
+    def test_full_buffer_flushes_inline(self):
+        for i in range(3):
+            self.buffer.add(self.message(self.rooms[0], str(i)))
+        self.buffer.add(self.message(self.rooms[0], '3'))
+        self.assertEqual(ChatMessage.objects.count(), 3)
+        self.assertEqual(self.buffer.pending(), 1)
+
+    def test_failed_batch_is_kept_at_the_head(self):
+        for i in range(3):
+            self.buffer.add(self.message(self.rooms[0], str(i)))
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.pending(), 3)
+        self.buffer.flush()
+        self.assertEqual(list(ChatMessage.objects.order_by('id').values_list('message', flat=True)), ['0', '1', '2'])
+
+    @override_settings(CHAT_WRITE_BEHIND=True)
+    def test_queued_text_sorts_before_a_later_attachment(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media_root), mock.patch.object(buffer_module, 'buffer', self.buffer):
+            buffer_module.store_message(self.message(self.rooms[0], 'text'))
+            attachment = ChatMessage(
+                room_id=self.rooms[0].pk, sender_type='user', message_type='file',
+                file=SimpleUploadedFile('a.txt', b'data'), message='file',
+            )
+            buffer_module.store_message(attachment)
+            self.assertEqual(self.buffer.pending(), 1)
+            self.buffer.flush()
+        self.assertEqual(list(self.rooms[0].messages.values_list('message', flat=True)), ['text', 'file'])
+        self.rooms[0].refresh_from_db()
+        self.assertEqual(self.rooms[0].updated_at, attachment.created_at)
+
+    def test_ids_are_looked_up_when_bulk_insert_returns_none(self):
+        bulk_create = ChatMessage.objects.bulk_create
+
+        def without_ids(messages):
+            bulk_create(messages)
+            for message in messages:
+                message.pk = None
+            return messages
+
+        temp_ids = [self.buffer.add(self.message(self.rooms[i % 2], str(i))) for i in range(2)]
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=without_ids):
+            self.buffer.flush()
+        saved = {call.args[1]['temp_id']: call.args[1]['message_id'] for call in self.broadcast.call_args_list}
+        self.assertEqual(
+            [ChatMessage.objects.get(pk=saved[temp_id]).message for temp_id in temp_ids], ['0', '1'],
+        )
+
+    def test_message_that_keeps_failing_is_dropped(self):
+        bulk_create = ChatMessage.objects.bulk_create
+
+        def reject_bad(messages):
+            if any(message.message == 'bad' for message in messages):
+                raise ValueError('bad message')
+            return bulk_create(messages)
+
+        for text in ('0', 'bad', '2'):
+            self.buffer.add(self.message(self.rooms[0], text))
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', side_effect=reject_bad):
+            for _ in range(self.buffer.max_attempts):
+                with self.assertRaises(ValueError):
+                    self.buffer.flush()
+            with self.assertLogs('apps.chat.buffer', 'ERROR'):
+                self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(list(ChatMessage.objects.values_list('message', flat=True)), ['0', '2'])
+
+    @override_settings(CHAT_WRITE_BEHIND=True)
+    def test_view_returns_temporary_id(self):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch.object(buffer_module, 'buffer', self.buffer), mock.patch('apps.chat.views.send_chat_message_update') as send:
+            response = client.post(f'/api/chat/rooms/{self.rooms[0].pk}/send_message/', {'message': 'hi'})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['id'].startswith('tmp-'))
+        self.assertEqual(send.call_args.args[2], response.data['id'])
+        self.assertFalse(ChatMessage.objects.exists())
+        self.buffer.flush()
+        self.assertEqual(ChatMessage.objects.get().sender_id, self.user.pk)
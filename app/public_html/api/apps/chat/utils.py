@@ -1,10 +1,8 @@
 # مسیر: backend/apps/chat/utils.py
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from apps.users.broadcast import broadcast
 
-def send_chat_message_update(room, message):
-    """ارسال بروزرسانی پیام چت از طریق WebSocket"""
-    channel_layer = get_channel_layer()
+def send_chat_message_update(room, message, message_id=None):
+    """ارسال بروزرسانی پیام چت از طریق WebSocket (message_id: شناسه‌ی موقت در حالت ذخیره‌ی تأخیری)"""
     
     # ارسال به گروه اتاق چت
     room_group_name = f"chat_room_{room.id}"
@@ -18,11 +16,11 @@ def send_chat_message_update(room, message):
     elif hasattr(room, 'guest_phone') and room.guest_phone:
         sender_name = f"مهمان {room.guest_phone}"
     
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         room_group_name,
         {
             "type": "chat_message",
-            "message_id": message.id,
+            "message_id": message_id or message.id,
             "message": message.message,
             "sender_type": message.sender_type,
             "sender_name": sender_name,
@@ -32,7 +30,7 @@ def send_chat_message_update(room, message):
     
     # ارسال به ادمین‌ها برای اطلاع از پیام جدید
     if message.sender_type == 'user':
-        async_to_sync(channel_layer.group_send)(
+        broadcast(
             "admin_notifications",
             {
                 "type": "new_chat_message",
@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from django.db.models import Q
 from django.utils import timezone
 from .models import ChatRoom, ChatMessage, AdminOnlineStatus
+from .buffer import store_message
 from .serializers import ChatRoomSerializer, ChatMessageSerializer, AdminOnlineStatusSerializer, GuestChatSerializer
 from .utils import send_chat_message_update
 
@@ -108,17 +109,17 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             message_data['file_size'] = file_obj.size
             message_data['message'] = message_text or f'فایل {file_obj.name} ارسال شد'
         
-        message = ChatMessage.objects.create(**message_data)
-        
-        # بروزرسانی زمان اتاق چت
-        room.updated_at = timezone.now()
-        room.save()
+        # ذخیره‌ی پیام و بروزرسانی زمان اتاق چت (در حالت ذخیره‌ی تأخیری فقط در صف قرار می‌گیرد)
+        message = ChatMessage(**message_data)
+        message_id = store_message(message)
         
         # ارسال به WebSocket
-        send_chat_message_update(room, message)
+        send_chat_message_update(room, message, message_id)
         
         serializer = ChatMessageSerializer(message, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        data = serializer.data
+        data['id'] = message_id
+        return Response(data, status=status.HTTP_201_CREATED)
 
 class AdminOnlineStatusViewSet(viewsets.ReadOnlyModelViewSet):
     """مشاهده وضعیت آنلاین ادمین‌ها"""
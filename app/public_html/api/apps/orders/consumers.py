@@ -1,10 +1,27 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+# ادمین‌ها همه‌ی سفارش‌ها را می‌گیرند و هر کاربر فقط سفارش‌های خودش را
+ADMIN_ORDERS_GROUP = 'admin_orders'
+
+
+def user_orders_group(user_id):
+    return f"user_{user_id}_orders"
+
+
+def orders_group_for(user):
+    """The single order stream a user listens to."""
+    return ADMIN_ORDERS_GROUP if user.is_staff else user_orders_group(user.id)
+
+
 class OrderConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.room_group_name = 'orders'
-        
+        self.user = self.scope.get('user')
+        if not self.user or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.room_group_name = orders_group_for(self.user)
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -13,6 +30,8 @@ class OrderConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'room_group_name'):
+            return
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
@@ -0,0 +1,41 @@
+"""
+Purchase entitlements.
+
+The set of product IDs a user may download (items of their PAID or SENT
+orders) is computed with one `values_list` query. It is not cached across
+requests: a per-process cache would let other workers keep serving a stale set
+after a payment or refund. Callers that check many products in one request
+(ProductSerializer) memoize the set for that request.
+"""
+
+
+def entitled_statuses():
+    from .models import Order
+
+    return (Order.Status.PAID, Order.Status.SENT)
+
+
+def get_purchased_product_ids(user):
+    """Return a frozenset of product IDs the user has paid for."""
+    if user is None or not user.is_authenticated:
+        return frozenset()
+
+    from .models import OrderItem
+
+    return frozenset(
+        OrderItem.objects
+        .filter(order__user_id=user.pk, order__status__in=entitled_statuses())
+        .values_list('product_id', flat=True)
+        .distinct()
+    )
+
+
+def has_purchased(user, product_id):
+    if user is None or not user.is_authenticated:
+        return False
+
+    from .models import OrderItem
+
+    return OrderItem.objects.filter(
+        order__user_id=user.pk, order__status__in=entitled_statuses(), product_id=product_id,
+    ).exists()
@@ -0,0 +1,227 @@
+"""
+Bulk invoice export for admins.
+
+An export job renders the invoices of many orders and writes them into a
+single file under INVOICE_EXPORT_DIR. This directory is private and sits
+outside MEDIA_ROOT. The output is either a ZIP of per-order PDFs or one merged
+PDF.
+
+Both formats render each order through invoices.render_invoice on a process
+pool. Each worker registers the fonts once in its initializer. Invoices that
+are already cached are reused. A ZIP gets every PDF copied in from storage in
+blocks, so a ZIP of any size is written with bounded memory. A merged PDF
+gets each invoice's pages appended with pypdf as soon as that invoice is
+ready. pypdf can only write the document once it is complete, so the whole
+merged PDF is held in memory until the end. It is therefore limited to
+INVOICE_EXPORT_MERGED_MAX_ORDERS orders; larger exports have to use the ZIP
+format. Fonts and images that repeat across invoices are stored once.
+
+Job state is an InvoiceExport row, so a status poll can reach any worker.
+Progress updates only write the `done` column. Jobs and their files expire
+after JOB_TIMEOUT; expired ones are removed when the next export starts.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .invoices import invoice_storage
+
+logger = logging.getLogger(__name__)
+
+FORMAT_ZIP = 'zip'
+FORMAT_PDF = 'pdf'
+FORMATS = (FORMAT_ZIP, FORMAT_PDF)
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+JOB_TIMEOUT = 60 * 60 * 24
+
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+
+def _expiry_cutoff():
+    return timezone.now() - timedelta(seconds=JOB_TIMEOUT)
+
+
+def get_job(job_id):
+    """The InvoiceExport of `job_id` (without its order ids), or None if unknown or expired."""
+    from .models import InvoiceExport
+
+    return (
+        InvoiceExport.objects.defer('order_ids')
+        .filter(pk=job_id, created_at__gte=_expiry_cutoff())
+        .first()
+    )
+
+
+def _update_job(job_id, **changes):
+    from .models import InvoiceExport
+
+    InvoiceExport.objects.filter(pk=job_id).update(**changes)
+
+
+def export_path(job_id, fmt):
+    return os.path.join(settings.INVOICE_EXPORT_DIR, f'invoices-{job_id}.{fmt}')
+
+
+def create_export_job(order_ids, fmt=FORMAT_ZIP):
+    """Register a job for `order_ids` and return its id; run it with run_export_job."""
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown export format: {fmt}')
+    if fmt == FORMAT_PDF and len(order_ids) > settings.INVOICE_EXPORT_MERGED_MAX_ORDERS:
+        raise ValueError(
+            f'a merged PDF is limited to {settings.INVOICE_EXPORT_MERGED_MAX_ORDERS} orders'
+        )
+    from .models import InvoiceExport
+
+    job = InvoiceExport.objects.create(
+        id=uuid.uuid4().hex, status=STATUS_PENDING, format=fmt,
+        order_ids=list(order_ids), total=len(order_ids),
+    )
+    return job.id
+
+
+def remove_expired_exports():
+    """Delete jobs older than JOB_TIMEOUT and export files (including leftovers) as old."""
+    from .models import InvoiceExport
+
+    InvoiceExport.objects.filter(created_at__lt=_expiry_cutoff()).delete()
+    try:
+        entries = list(os.scandir(settings.INVOICE_EXPORT_DIR))
+    except FileNotFoundError:
+        return
+    cutoff = time.time() - JOB_TIMEOUT
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def _init_worker():
+    # Spawned workers start with a bare interpreter
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+    from .pdf_generator import register_persian_fonts
+    register_persian_fonts()
+
+
+def _render_one(order_id):
+    from .invoices import render_invoice
+
+    return render_invoice(order_id)
+
+
+def _process_pool():
+    processes = settings.INVOICE_EXPORT_PROCESSES
+    if processes <= 0:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+    )
+
+
+def _rendered(order_ids, pool):
+    """(order id, invoice storage name) pairs, in order, as the renders finish."""
+    if pool is None:
+        names = map(_render_one, order_ids)
+    else:
+        names = pool.map(_render_one, order_ids, chunksize=4)
+    return zip(order_ids, names)
+
+
+def _write_zip(job_id, order_ids, path, pool):
+    storage = invoice_storage()
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for done, (order_id, name) in enumerate(_rendered(order_ids, pool), start=1):
+            with storage.open(name, 'rb') as source, archive.open(f'order-{order_id}.pdf', 'w') as target:
+                shutil.copyfileobj(source, target, 64 * 1024)
+            _update_job(job_id, done=done)
+
+
+def _write_merged(job_id, order_ids, path, pool):
+    from pypdf import PdfReader, PdfWriter
+
+    storage = invoice_storage()
+    writer = PdfWriter()
+    for done, (_, name) in enumerate(_rendered(order_ids, pool), start=1):
+        with storage.open(name, 'rb') as source:
+            # add_page copies the page's objects, so the source can be closed afterwards
+            for page in PdfReader(source).pages:
+                writer.add_page(page)
+        _update_job(job_id, done=done)
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    with open(path, 'wb') as output:
+        writer.write(output)
+
+
+def run_export_job(job_id):
+    """Render the job's invoices into its export file, reporting progress as it goes."""
+    from .models import InvoiceExport
+
+    job = InvoiceExport.objects.filter(pk=job_id).first()
+    if job is None:
+        return None
+    os.makedirs(settings.INVOICE_EXPORT_DIR, exist_ok=True)
+    path = export_path(job_id, job.format)
+    partial_path = f'{path}.part'
+    _update_job(job_id, status=STATUS_RUNNING)
+
+    pool = _process_pool()
+    try:
+        writer = _write_zip if job.format == FORMAT_ZIP else _write_merged
+        writer(job_id, job.order_ids, partial_path, pool)
+        os.replace(partial_path, path)
+    except Exception as exc:
+        logger.exception('Invoice export %s failed', job_id)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        _update_job(job_id, status=STATUS_FAILED, error=str(exc))
+    else:
+        _update_job(job_id, status=STATUS_DONE)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return get_job(job_id)
+
+
+def _run_in_background(job_id):
+    try:
+        run_export_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def start_export_job(order_ids, fmt=FORMAT_ZIP):
+    """Create a job and run it on a background thread; returns the job id."""
+    global _job_executor
+    remove_expired_exports()
+    job_id = create_export_job(order_ids, fmt)
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='invoice-export')
+    _job_executor.submit(_run_in_background, job_id)
+    return job_id
@@ -0,0 +1,151 @@
+"""
+Pre-rendered PDF invoices.
+
+An invoice is rendered once, on a small background thread pool, and stored as
+`order-<id>/<fingerprint>.pdf` under INVOICE_DIR. This directory is private and
+sits outside MEDIA_ROOT, because invoices carry customer names, mobiles and
+amounts. The fingerprint is a hash of every order field the invoice prints
+(status, items, customer, notes...), so a change to the order produces a new
+name and the old file is stale; it is removed after the new one is stored.
+download_pdf serves the stored file and only schedules a render when it is
+missing.
+
+With INVOICE_RENDER_BACKGROUND off (tests), nothing is rendered ahead of time
+and download_pdf renders the missing invoice in the request.
+"""
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+
+def invoice_storage():
+    """Private storage of rendered invoices (INVOICE_DIR)."""
+    return FileSystemStorage(location=settings.INVOICE_DIR)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.INVOICE_RENDER_WORKERS,
+                thread_name_prefix='invoice-render',
+            )
+        return _executor
+
+
+def _invoice_queryset():
+    from .models import Order
+
+    return Order.objects.select_related('user').prefetch_related('items__product')
+
+
+def load_order(order_id):
+    """Fetch an order with everything its invoice prints."""
+    return _invoice_queryset().get(pk=order_id)
+
+
+def load_orders(order_ids):
+    """Fetch several orders for their invoices, in the order of `order_ids`."""
+    orders = _invoice_queryset().in_bulk(order_ids)
+    return [orders[pk] for pk in order_ids if pk in orders]
+
+
+def invoice_fingerprint(order):
+    """Short hash of the order state that appears on the invoice."""
+    state = {
+        'id': order.id,
+        'status': order.status,
+        'total_price': order.total_price,
+        'created_at': order.created_at.isoformat() if order.created_at else None,
+        'admin_notes': order.admin_notes or '',
+        'customer': [order.user.full_name, order.user.mobile] if order.user_id else None,
+        'items': [
+            [item.product_id, item.product.title if item.product else None, item.quantity, item.price]
+            for item in sorted(order.items.all(), key=lambda item: item.pk)
+        ],
+    }
+    payload = json.dumps(state, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()[:20]
+
+
+def _order_dir(order_id):
+    return f'order-{order_id}'
+
+
+def invoice_name(order):
+    return f'{_order_dir(order.id)}/{invoice_fingerprint(order)}.pdf'
+
+
+def get_cached_invoice(order):
+    """Storage name of the up-to-date invoice of `order`, or None if it is not rendered yet."""
+    name = invoice_name(order)
+    return name if invoice_storage().exists(name) else None
+
+
+def _remove_stale_invoices(storage, order_id, current_name):
+    # Only this order's directory is listed, which holds one or two files
+    directory = _order_dir(order_id)
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        name = f'{directory}/{filename}'
+        if name != current_name:
+            storage.delete(name)
+
+
+def render_invoice(order_id):
+    """Render and store the invoice of an order unless it is already up to date."""
+    from .pdf_generator import build_order_pdf
+
+    storage = invoice_storage()
+    order = load_order(order_id)
+    name = invoice_name(order)
+    if storage.exists(name):
+        return name
+
+    buffer = BytesIO()
+    build_order_pdf(order, buffer)
+    # A concurrent render of the same state may have won; both files are identical
+    if not storage.exists(name):
+        storage.save(name, ContentFile(buffer.getvalue()))
+    _remove_stale_invoices(storage, order.id, name)
+    return name
+
+
+def _render_in_background(order_id):
+    try:
+        render_invoice(order_id)
+    except Exception:
+        logger.exception('Rendering invoice of order %s failed', order_id)
+    finally:
+        with _executor_lock:
+            _pending.discard(order_id)
+        connections.close_all()
+
+
+def schedule_invoice_render(order_id):
+    """Queue a background render; repeated calls for the same order are coalesced."""
+    if not settings.INVOICE_RENDER_BACKGROUND:
+        return
+    with _executor_lock:
+        if order_id in _pending:
+            return
+        _pending.add(order_id)
+    _get_executor().submit(_render_in_background, order_id)
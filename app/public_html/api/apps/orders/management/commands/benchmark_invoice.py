@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+
+import arabic_reshaper
+from bidi.algorithm import get_display
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from PIL import Image as PILImage
+from reportlab.lib.units import cm
+from reportlab.platypus import Image
+
+from apps.orders import pdf_generator
+from apps.orders.invoices import load_order
+from apps.orders.models import Order, OrderItem
+from apps.products.models import Category, Product
+
+# One image per order line, as on a real invoice
+SAMPLE_IMAGE = 'products/benchmark-{}.jpg'
+
+
+def legacy_persian_text(text):
+    """persian_text before memoization: reshape and reorder on every call."""
+    if not text:
+        return ""
+    text = str(text)
+    if text.isascii():
+        return text
+    try:
+        return get_display(arabic_reshaper.reshape(text))
+    except Exception:
+        return text
+
+
+def legacy_format_persian_number(num):
+    if num is None:
+        return legacy_persian_text("۰")
+    persian_digits = '۰۱۲۳۴۵۶۷۸۹'
+    result = ""
+    for char in str(int(num)):
+        result += persian_digits[int(char)] if char in '0123456789' else char
+    return result
+
+
+def legacy_format_persian_price(price):
+    if not price:
+        return legacy_format_persian_number(0)
+    persian_digits = '۰۱۲۳۴۵۶۷۸۹'
+    result = ""
+    for char in f"{int(price):,}":
+        result += persian_digits[int(char)] if char in '0123456789' else char
+    return result
+
+
+def legacy_get_product_image(product):
+    """get_product_image before the thumbnail cache: decode and resize on every call."""
+    try:
+        if product.main_image:
+            image_path = os.path.join(settings.MEDIA_ROOT, str(product.main_image))
+            if os.path.exists(image_path):
+                img = PILImage.open(image_path)
+                img = img.resize((40, 40), PILImage.Resampling.LANCZOS)
+                img_buffer = BytesIO()
+                img.save(img_buffer, format='PNG')
+                img_buffer.seek(0)
+                return Image(img_buffer, width=1*cm, height=1*cm)
+    except Exception:
+        pass
+    return None
+
+
+LEGACY_FUNCTIONS = {
+    'persian_text': legacy_persian_text,
+    'format_persian_number': legacy_format_persian_number,
+    'format_persian_price': legacy_format_persian_price,
+    'get_product_image': legacy_get_product_image,
+}
+
+
+@contextmanager
+def legacy_rendering():
+    """Swap pdf_generator's text and image helpers for their pre-cache versions."""
+    current = {name: getattr(pdf_generator, name) for name in LEGACY_FUNCTIONS}
+    for name, function in LEGACY_FUNCTIONS.items():
+        setattr(pdf_generator, name, function)
+    try:
+        yield
+    finally:
+        for name, function in current.items():
+            setattr(pdf_generator, name, function)
+
+
+class Command(BaseCommand):
+    help = 'Compare the old and the cached invoice rendering paths on a sample order.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=50, help='Order lines on the sample invoice.')
+        parser.add_argument('--runs', type=int, default=5, help='Renders per measurement.')
+        parser.add_argument('--image-size', type=int, default=1200, help='Edge of the sample product image in pixels.')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp(prefix='benchmark-invoice-')
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                self.create_sample_images(media_root, options['lines'], options['image_size'])
+                # Sample data only lives inside this transaction and is rolled back
+                with transaction.atomic():
+                    order = load_order(self.create_sample_order(options['lines']).pk)
+                    # Font registration and reportlab's first-use setup happen once per
+                    # process; one untimed render keeps them out of both paths
+                    self.render(order)
+                    self.compare(order, options['runs'])
+                    transaction.set_rollback(True)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def compare(self, order, runs):
+        products = [item.product for item in order.items.all()]
+
+        with legacy_rendering():
+            self.measure('old invoice', runs, lambda: self.render(order))
+            self.measure('old product images', runs, lambda: self.load_images(products))
+
+        pdf_generator._shape.cache_clear()
+        self.measure('new invoice (cold shaping cache)', 1, lambda: self.render(order))
+        self.measure('new invoice (warm)', runs, lambda: self.render(order))
+        info = pdf_generator._shape.cache_info()
+        self.stdout.write(f'shaping cache: {info.hits} hits, {info.misses} misses, {info.currsize} entries')
+
+        # Nothing earlier may have left thumbnails behind for the cold run
+        shutil.rmtree(os.path.join(settings.MEDIA_ROOT, pdf_generator.THUMBNAIL_CACHE_DIR), ignore_errors=True)
+        self.measure('new product images (cold thumbnail cache)', 1, lambda: self.load_images(products))
+        self.measure('new product images (warm)', runs, lambda: self.load_images(products))
+
+    def render(self, order):
+        buffer = BytesIO()
+        pdf_generator.build_order_pdf(order, buffer)
+        return f'{buffer.tell() / 1024:.0f} KiB PDF'
+
+    def load_images(self, products):
+        images = [pdf_generator.get_product_image(product) for product in products]
+        if any(image is None for image in images):
+            raise RuntimeError('The sample product image could not be loaded')
+        return f'{len(images)} images'
+
+    def measure(self, label, runs, step):
+        tracemalloc.start()
+        started = time.perf_counter()
+        for _ in range(runs):
+            result = step()
+        elapsed = (time.perf_counter() - started) / runs
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f'{label}: {elapsed * 1000:.1f} ms/run, peak {peak / 1024:.0f} KiB, '
+            f'{result} ({runs} run{"s" if runs > 1 else ""})'
+        )
+
+    def create_sample_images(self, media_root, count, size):
+        os.makedirs(os.path.join(media_root, os.path.dirname(SAMPLE_IMAGE)), exist_ok=True)
+        # A gradient, so the JPEG has real content to decode
+        gradient = PILImage.linear_gradient('L').resize((size, size))
+        for i in range(count):
+            image = PILImage.merge('RGB', (gradient, gradient.rotate(90 + i), gradient.rotate(180)))
+            image.save(os.path.join(media_root, SAMPLE_IMAGE.format(i)), quality=90)
+
+    def create_sample_order(self, lines):
+        # Unique values, so the sample rows never clash with real ones
+        suffix = uuid.uuid4().hex[:8]
+        User = get_user_model()
+        user = User.objects.create_user(
+            mobile=f'09{uuid.uuid4().int % 10 ** 9:09d}', password=None, full_name='مشتری نمونه',
+        )
+        category = Category.objects.create(name='بنچمارک', slug=f'benchmark-invoice-{suffix}')
+        order = Order.objects.create(user=user, status=Order.Status.PAID, admin_notes='اطلاعات تحویل اکانت')
+        products = Product.objects.bulk_create([
+            Product(
+                category=category, title=f'اکانت پریمیوم شماره {i}', slug=f'benchmark-invoice-{suffix}-{i}',
+                description='-', price=150000 + i * 1000, main_image=SAMPLE_IMAGE.format(i),
+            )
+            for i in range(lines)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1 + i % 3, price=product.price)
+            for i, product in enumerate(products)
+        ])
+        order.total_price = sum(p.price * (1 + i % 3) for i, p in enumerate(products))
+        order.save(update_fields=['total_price'])
+        return order
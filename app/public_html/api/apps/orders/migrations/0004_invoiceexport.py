@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-17 23:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_payment_method'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceExport',
+            fields=[
+                ('id', models.CharField(editable=False, max_length=32, primary_key=True, serialize=False)),
+                ('format', models.CharField(max_length=3, verbose_name='فرمت')),
+                ('status', models.CharField(default='pending', max_length=10, verbose_name='وضعیت')),
+                ('order_ids', models.JSONField(default=list, verbose_name='سفارش\u200cها')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='تعداد کل')),
+                ('done', models.PositiveIntegerField(default=0, verbose_name='انجام شده')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='خطا')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='تاریخ ایجاد')),
+            ],
+        ),
+    ]
@@ -32,6 +32,14 @@ class Order(models.Model):
     # توضیحات ادمین برای سفارش
     admin_notes = models.TextField('توضیحات ادمین', blank=True, null=True, help_text='توضیحات اکانت و اطلاعات تحویل')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # وضعیت و مبلغ بارگذاری‌شده برای بروزرسانی آمار روزانه (apps.users.metrics)
+        if 'status' in instance.__dict__ and 'total_price' in instance.__dict__:
+            instance._metrics_snapshot = (instance.status, instance.total_price)
+        return instance
+
     def __str__(self):
         return f"سفارش {self.id} - {self.user.mobile}"
 
@@ -43,4 +51,19 @@ class OrderItem(models.Model):
     price = models.PositiveBigIntegerField('قیمت واحد در لحظه خرید')
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.title}"
\ No newline at end of file
+        return f"{self.quantity} x {self.product.title}"
+
+
+class InvoiceExport(models.Model):
+    """Admin bulk invoice export job; progress is read by every worker (apps.orders.exports)."""
+    id = models.CharField(primary_key=True, max_length=32, editable=False)
+    format = models.CharField('فرمت', max_length=3)
+    status = models.CharField('وضعیت', max_length=10, default='pending')
+    order_ids = models.JSONField('سفارش‌ها', default=list)
+    total = models.PositiveIntegerField('تعداد کل', default=0)
+    done = models.PositiveIntegerField('انجام شده', default=0)
+    error = models.TextField('خطا', blank=True, null=True)
+    created_at = models.DateTimeField('تاریخ ایجاد', auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"خروجی فاکتور {self.id[:8]} ({self.done}/{self.total})"
@@ -0,0 +1,113 @@
+"""
+Wallet payments.
+
+The order row is locked with select_for_update, and balance and stock are
+deducted with conditional F() updates (`wallet_balance >= total`,
+`stock >= quantity`). Two parallel requests can therefore neither spend the same
+balance twice nor sell more than is in stock. Every deduction is recorded as a
+'purchase' WalletTransaction, and websocket updates (the wallet balance and a
+coalesced stock diff per product) are only sent once the transaction has
+committed.
+"""
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+
+from apps.products.events import queue_product_event
+from apps.products.models import Product
+from apps.users.models import WalletTransaction
+from .models import Order
+
+
+class PaymentError(Exception):
+    """A payment that was refused; nothing has been deducted."""
+
+    def __init__(self, message, **details):
+        super().__init__(message)
+        self.message = message
+        self.details = details
+
+
+class OrderNotPayable(PaymentError):
+    pass
+
+
+class InsufficientBalance(PaymentError):
+    pass
+
+
+class OutOfStock(PaymentError):
+    pass
+
+
+def _broadcast_wallet(user):
+    from apps.users.utils import send_wallet_update
+
+    send_wallet_update(user)
+
+
+def pay_with_wallet(order_id, user):
+    """
+    Pay a PENDING order of `user` from the wallet.
+
+    Returns the paid order and sets `user.wallet_balance` to the new balance.
+    Raises a PaymentError subclass when the order cannot be paid.
+    """
+    User = get_user_model()
+
+    with transaction.atomic():
+        try:
+            order = Order.objects.select_for_update().get(pk=order_id, user_id=user.pk)
+        except Order.DoesNotExist:
+            raise OrderNotPayable('سفارش یافت نشد')
+        # The order_update broadcast reads the user; reuse the one we already have
+        order.user = user
+        if order.status != Order.Status.PENDING:
+            raise OrderNotPayable('این سفارش قبلاً پرداخت شده است')
+
+        quantities = Counter()
+        for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+            quantities[product_id] += quantity
+
+        # Lock products in a stable order so concurrent payments cannot deadlock
+        list(Product.objects.select_for_update().filter(id__in=quantities).order_by('id').values_list('id'))
+        for product_id in sorted(quantities):
+            quantity = quantities[product_id]
+            updated = Product.objects.filter(pk=product_id, stock__gte=quantity).update(stock=F('stock') - quantity)
+            if not updated:
+                raise OutOfStock('موجودی محصول کافی نیست', product_id=product_id)
+
+        total = order.total_price
+        # برای محصولات رایگان، چیزی از کیف پول کسر نمی‌شود
+        if total > 0:
+            updated = User.objects.filter(pk=user.pk, wallet_balance__gte=total).update(
+                wallet_balance=F('wallet_balance') - total
+            )
+            if not updated:
+                balance = User.objects.values_list('wallet_balance', flat=True).get(pk=user.pk)
+                raise InsufficientBalance(
+                    'موجودی کیف پول کافی نیست',
+                    wallet_balance=balance,
+                    required_amount=total,
+                    shortage=total - balance,
+                )
+            WalletTransaction.objects.create(
+                user_id=user.pk,
+                amount=total,
+                transaction_type='purchase',
+                description=f'پرداخت سفارش {order.id}',
+            )
+
+        order.status = Order.Status.PAID
+        order.payment_method = Order.PaymentMethod.WALLET
+        order.save(update_fields=['status', 'payment_method'])
+
+        user.wallet_balance = User.objects.values_list('wallet_balance', flat=True).get(pk=user.pk)
+        transaction.on_commit(lambda: _broadcast_wallet(user))
+        # Stock changes go out as one compact product_update per product after commit
+        for product_id, stock in Product.objects.filter(id__in=quantities).values_list('id', 'stock'):
+            queue_product_event(product_id, 'updated', {'stock': stock})
+
+    return order
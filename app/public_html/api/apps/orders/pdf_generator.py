@@ -7,12 +7,12 @@ from reportlab.lib.enums import TA_RIGHT, TA_CENTER, TA_LEFT
 from reportlab.lib import colors
 from reportlab.lib.units import cm
 import jdatetime
-from django.http import HttpResponse
 from django.conf import settings
 from pathlib import Path
 import os
 from PIL import Image as PILImage
-from io import BytesIO
+from functools import lru_cache
+import hashlib
 import arabic_reshaper
 from bidi.algorithm import get_display
 import sys
@@ -47,6 +47,22 @@ def register_persian_fonts():
     except Exception as e:
         return False
 
+# متن‌های ثابت فاکتور (برچسب‌ها، نام محصولات، واحد پول) بارها تکرار می‌شوند
+SHAPED_TEXT_CACHE_SIZE = 4096
+
+_PERSIAN_DIGITS = str.maketrans('0123456789', '۰۱۲۳۴۵۶۷۸۹')
+
+THUMBNAIL_SIZE = (40, 40)
+THUMBNAIL_CACHE_DIR = 'cache/pdf-thumbnails'
+
+@lru_cache(maxsize=SHAPED_TEXT_CACHE_SIZE)
+def _shape(text):
+    try:
+        reshaped = arabic_reshaper.reshape(text)
+        return get_display(reshaped)
+    except Exception:
+        return text
+
 def persian_text(text):
     """Convert Persian/Arabic text to proper display form for PDF"""
     if not text:
@@ -56,49 +72,41 @@ def persian_text(text):
     if text.isascii():
         return text
     
-    try:
-        reshaped = arabic_reshaper.reshape(text)
-        bidi_text = get_display(reshaped)
-        return bidi_text
-    except Exception:
-        return text
+    return _shape(text)
 
 def format_persian_number(num):
     """Convert number to Persian digits"""
     if num is None:
         return persian_text("۰")
     
-    persian_digits = '۰۱۲۳۴۵۶۷۸۹'
-    english_digits = '0123456789'
-    
-    num_str = str(int(num))
-    result = ""
-    for char in num_str:
-        if char in english_digits:
-            result += persian_digits[int(char)]
-        else:
-            result += char
-    
-    return result
+    return str(int(num)).translate(_PERSIAN_DIGITS)
 
 def format_persian_price(price):
     """Format price with Persian digits and thousand separators"""
     if not price:
         return format_persian_number(0)
     
-    persian_digits = '۰۱۲۳۴۵۶۷۸۹'
-    english_digits = '0123456789'
-    
-    formatted_price = f"{int(price):,}"
-    
-    result = ""
-    for char in formatted_price:
-        if char in english_digits:
-            result += persian_digits[int(char)]
-        else:
-            result += char
-    
-    return result
+    return f"{int(price):,}".translate(_PERSIAN_DIGITS)
+
+def get_thumbnail_path(image_path):
+    """
+    Return a 40x40 PNG thumbnail of `image_path`, creating it on first use.
+
+    Thumbnails live under MEDIA_ROOT/cache/pdf-thumbnails and are named after
+    the source path and mtime, so a replaced image gets a fresh thumbnail.
+    """
+    mtime = os.stat(image_path).st_mtime_ns
+    key = hashlib.sha1(f'{image_path}:{mtime}'.encode('utf-8')).hexdigest()
+    thumbnail = Path(settings.MEDIA_ROOT) / THUMBNAIL_CACHE_DIR / f'{key}.png'
+    if not thumbnail.exists():
+        thumbnail.parent.mkdir(parents=True, exist_ok=True)
+        with PILImage.open(image_path) as img:
+            img.draft('RGB', THUMBNAIL_SIZE)
+            resized = img.resize(THUMBNAIL_SIZE, PILImage.Resampling.LANCZOS)
+        tmp_path = thumbnail.with_suffix(f'.{os.getpid()}.tmp')
+        resized.save(tmp_path, format='PNG')
+        os.replace(tmp_path, thumbnail)
+    return thumbnail
 
 def get_product_image(product):
     try:
@@ -106,37 +114,31 @@ def get_product_image(product):
             image_path = os.path.join(settings.MEDIA_ROOT, str(product.main_image))
             
             if os.path.exists(image_path):
-                img = PILImage.open(image_path)
-                img = img.resize((40, 40), PILImage.Resampling.LANCZOS)
-                
-                img_buffer = BytesIO()
-                img.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-                
-                return Image(img_buffer, width=1*cm, height=1*cm)
+                return Image(str(get_thumbnail_path(image_path)), width=1*cm, height=1*cm)
     except Exception as e:
         pass
     
     return None
 
-def generate_order_pdf(order):
+def _invoice_document(output):
     if not register_persian_fonts():
         raise Exception("خطا در بارگذاری فونت‌های فارسی")
     
-
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="order-{order.id}.pdf"'
-    
-    doc = SimpleDocTemplate(
-        response,
+    return SimpleDocTemplate(
+        output,
         pagesize=A4,
         rightMargin=1.5*cm,
         leftMargin=1.5*cm,
         topMargin=1.5*cm,
         bottomMargin=1.5*cm
     )
-    
+
+def build_order_pdf(order, output):
+    """Lay out the invoice of `order` and write the PDF into the file-like `output`."""
+    doc = _invoice_document(output)
+    doc.build(invoice_elements(order, invoice_styles()))
+
+def invoice_styles():
     styles = StyleSheet1()
     
     styles.add(ParagraphStyle(
@@ -187,7 +189,10 @@ def generate_order_pdf(order):
         spaceAfter=4,
         textColor=colors.HexColor('#64748b')
     ))
-    
+    return styles
+
+def invoice_elements(order, styles):
+    """Flowables of a single order's invoice."""
     elements = []
     
     header_data = [[
@@ -424,7 +429,4 @@ def generate_order_pdf(order):
     elements.append(Paragraph(persian_text('با تشکر از خرید شما'), styles['Center']))
     elements.append(Paragraph(persian_text('مرکز تک - فروشگاه اکانت‌های پریمیوم هوش مصنوعی'), styles['SubTitle']))
     elements.append(Paragraph('support@markaztech.com', styles['SubTitle']))
-    
-    doc.build(elements)
-    
-    return response
+    return elements
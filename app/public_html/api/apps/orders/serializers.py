@@ -1,5 +1,6 @@
 # مسیر: backend/apps/orders/serializers.py
 from rest_framework import serializers
+from django.db import transaction
 import os
 from .models import Order, OrderItem
 from apps.products.models import Product
@@ -78,33 +79,55 @@ class OrderSerializer(serializers.ModelSerializer):
             'mobile': 'نامشخص',
         } 
 
+    def validate_cart_items(self, value):
+        """
+        Resolve cart lines against the products with a single query.
+
+        Lines of the same product are merged; missing, inactive or out of stock
+        products reject the whole cart before anything is written.
+        """
+        quantities = {}
+        for item_data in value:
+            try:
+                product_id = int(item_data['product_id'])
+                quantity = int(item_data.get('quantity', 1))
+            except (KeyError, TypeError, ValueError):
+                raise serializers.ValidationError("اقلام سبد خرید نامعتبر است.")
+            if quantity < 1:
+                raise serializers.ValidationError("تعداد هر محصول باید حداقل ۱ باشد.")
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+        products = Product.objects.in_bulk(list(quantities))
+        errors = []
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None or not product.is_active:
+                errors.append(f"محصول {product_id} موجود نیست.")
+            elif product.stock < quantity:
+                errors.append(f"موجودی «{product.title}» کافی نیست.")
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return [(products[product_id], quantity) for product_id, quantity in quantities.items()]
+
     def create(self, validated_data):
         """Create order with items from cart_items data."""
         cart_items = validated_data.pop('cart_items', [])
-        order = Order.objects.create(**validated_data)
-        
+
+        lines = []
         total_price = 0
-        
-        for item_data in cart_items:
-            try:
-                product = Product.objects.get(id=item_data['product_id'])
-                quantity = item_data.get('quantity', 1)
-                price = product.discount_price if product.discount_price is not None else product.price
-                
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=quantity,
-                    price=price
-                )
-                
-                total_price += price * quantity
-                
-            except Product.DoesNotExist:
-                continue
-        
-        order.total_price = total_price
-        order.save()
+        for product, quantity in cart_items:
+            price = product.discount_price if product.discount_price is not None else product.price
+            lines.append((product, quantity, price))
+            total_price += price * quantity
+
+        # سفارش یک بار با مبلغ نهایی ثبت می‌شود تا سیگنال فقط یک بار اجرا شود
+        with transaction.atomic():
+            order = Order.objects.create(total_price=total_price, **validated_data)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=quantity, price=price)
+                for product, quantity, price in lines
+            ])
         
         return order
 
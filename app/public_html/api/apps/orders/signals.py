@@ -1,26 +1,38 @@
+import logging
+
 from django.db.models.signals import post_save, post_delete
+from django.db import transaction
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Order
+from apps.users import metrics
+from apps.users.broadcast import broadcast
+from .consumers import ADMIN_ORDERS_GROUP, user_orders_group
+from .models import Order, OrderItem
+from .invoices import schedule_invoice_render
+from config.tracing import trace
+
+logger = logging.getLogger(__name__)
+
 
 def get_order_data(order):
-    # لاگ برای عیب‌یابی
-    print(f"DEBUG: get_order_data for order {order.id}")
-    print(f"DEBUG: Available attributes: {dir(order)}")
-    
+    """
+    Websocket payload of an order.
+
+    Uses `order.user` as already loaded (select_related or assigned by the
+    caller); it is only fetched when it is not cached on the instance.
+    """
     payment_receipt_url = None
     try:
-        if hasattr(order, 'payment_receipt') and order.payment_receipt:
+        if order.payment_receipt:
             payment_receipt_url = order.payment_receipt.url
-    except Exception as e:
-        print(f"DEBUG: Error accessing payment_receipt: {e}")
+    except Exception:
+        logger.debug('Order %s has no usable payment receipt URL', order.pk, exc_info=True)
 
+    user = order.user if order.user_id else None
     return {
         'id': order.id,
-        'user_id': order.user.id if order.user else None,
-        'user_name': order.user.full_name if order.user and order.user.full_name else 'نامشخص',
-        'user_mobile': order.user.mobile if order.user and order.user.mobile else 'نامشخص',
+        'user_id': order.user_id,
+        'user_name': user.full_name if user and user.full_name else 'نامشخص',
+        'user_mobile': user.mobile if user and user.mobile else 'نامشخص',
         'total_price': order.total_price,
         'status': order.status,
         'created_at': order.created_at.isoformat() if order.created_at else None,
@@ -28,29 +40,56 @@ def get_order_data(order):
         'payment_receipt': payment_receipt_url,
     }
 
+def broadcast_order_event(order, message):
+    """
+    Send one prebuilt message to the order owner's stream and the admin stream.
+
+    The message is built now but only sent once the surrounding transaction
+    commits, and never if it rolls back.
+    """
+    groups = [ADMIN_ORDERS_GROUP]
+    if order.user_id:
+        groups.insert(0, user_orders_group(order.user_id))
+
+    def send():
+        for group in groups:
+            broadcast(group, message)
+
+    transaction.on_commit(send)
+
+
 @receiver(post_save, sender=Order)
 def order_saved(sender, instance, created, **kwargs):
-    channel_layer = get_channel_layer()
-    
     action = 'created' if created else 'updated'
-    
-    async_to_sync(channel_layer.group_send)(
-        'orders',
-        {
+
+    with trace(logger, 'order_update broadcast', order_id=instance.pk, action=action):
+        broadcast_order_event(instance, {
             'type': 'order_update',
             'action': action,
             'order': get_order_data(instance)
-        }
-    )
+        })
 
 @receiver(post_delete, sender=Order)
 def order_deleted(sender, instance, **kwargs):
-    channel_layer = get_channel_layer()
-    
-    async_to_sync(channel_layer.group_send)(
-        'orders',
-        {
-            'type': 'order_delete',
-            'order_id': instance.id
-        }
-    )
\ No newline at end of file
+    broadcast_order_event(instance, {
+        'type': 'order_delete',
+        'order_id': instance.id
+    })
+
+@receiver(post_save, sender=Order)
+def order_invoice_saved(sender, instance, **kwargs):
+    """Pre-render the invoice of a paid order; a changed order gets a new file."""
+    if instance.status == Order.Status.PAID:
+        order_id = instance.pk
+        transaction.on_commit(lambda: schedule_invoice_render(order_id))
+
+
+@receiver(post_save, sender=Order)
+def order_metrics_saved(sender, instance, created, **kwargs):
+    """Keep the admin dashboard's daily order and sales rollups current."""
+    metrics.order_changed(instance, created)
+
+
+@receiver(post_delete, sender=Order)
+def order_metrics_deleted(sender, instance, **kwargs):
+    metrics.order_removed(instance)
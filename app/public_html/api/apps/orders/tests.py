@@ -1,3 +1,681 @@
-from django.test import TestCase
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import io
+import logging
+import os
+from io import BytesIO
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, connections, OperationalError, transaction
+from django.db.models.signals import post_save
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from unittest import mock
+
+from apps.products.models import Category, Product, ProductDownload
+from apps.users.models import WalletTransaction
+from . import exports, invoices, payments, pdf_generator
+from .entitlements import get_purchased_product_ids, has_purchased
+from .consumers import ADMIN_ORDERS_GROUP, OrderConsumer
+from .models import InvoiceExport, Order, OrderItem
+
+User = get_user_model()
+
+
+class EntitlementTests(TestCase):
+    """Purchased-product checks read the orders directly, so every worker sees payments at once."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(mobile='09121111111', password='pass')
+        category = Category.objects.create(name='نرم‌افزار', slug='software')
+        self.product = Product.objects.create(
+            category=category, title='آنتی‌ویروس', slug='antivirus', description='-',
+            price=1000, main_image='products/test.png', product_type='file',
+        )
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1, price=1000)
+
+    def test_set_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_purchased_product_ids(self.user), frozenset())
+
+    def test_paying_and_cancelling_apply_immediately(self):
+        self.assertFalse(has_purchased(self.user, self.product.id))
+        Order.objects.filter(pk=self.order.pk).update(status=Order.Status.PAID)
+        self.assertTrue(has_purchased(self.user, self.product.id))
+        self.assertEqual(get_purchased_product_ids(self.user), frozenset({self.product.id}))
+
+        Order.objects.filter(pk=self.order.pk).update(status=Order.Status.CANCELED)
+        self.assertFalse(has_purchased(self.user, self.product.id))
+
+
+class DownloadCounterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(mobile='09122222222', password='pass')
+        category = Category.objects.create(name='کتاب', slug='books')
+        self.product = Product.objects.create(
+            category=category, title='کتاب', slug='book', description='-',
+            price=1000, main_image='products/test.png', product_type='file',
+        )
+
+    def test_record_creates_then_increments(self):
+        ProductDownload.record(self.user, self.product)
+        with self.assertNumQueries(1):
+            ProductDownload.record(self.user, self.product)
+        record = ProductDownload.objects.get()
+        self.assertEqual(record.download_count, 2)
+        self.assertIsNotNone(record.first_download_at)
+        self.assertGreaterEqual(record.last_download_at, record.first_download_at)
+
+
+@override_settings(INVOICE_RENDER_BACKGROUND=False)
+class WalletPaymentTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.user = User.objects.create_user(mobile='09123333333', password='pass')
+        self.user.wallet_balance = 5000
+        self.user.save()
+        category = Category.objects.create(name='اکانت', slug='accounts')
+        self.product = Product.objects.create(
+            category=category, title='اکانت', slug='account', description='-',
+            price=2000, main_image='products/test.png', stock=3,
+        )
+
+    def create_order(self, quantity=1):
+        order = Order.objects.create(user=self.user, total_price=2000 * quantity)
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price=2000)
+        return order
+
+    def test_payment_deducts_and_records_ledger(self):
+        order = self.create_order()
+        with self.captureOnCommitCallbacks() as callbacks:
+            payments.pay_with_wallet(order.pk, self.user)
+
+        self.assertEqual(self.user.wallet_balance, 3000)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.PAID)
+        ledger = WalletTransaction.objects.get()
+        self.assertEqual((ledger.transaction_type, ledger.amount), ('purchase', 2000))
+        # Websocket fan-out waits for the commit
+        self.assertTrue(callbacks)
+
+    def test_order_broadcast_waits_for_commit(self):
+        order = self.create_order()
+        with mock.patch('apps.orders.signals.broadcast') as broadcast:
+            with self.captureOnCommitCallbacks() as callbacks:
+                payments.pay_with_wallet(order.pk, self.user)
+                self.assertFalse(broadcast.called)
+            self.assertFalse(broadcast.called)
+            for callback in callbacks:
+                callback()
+        sent = [call.args[1] for call in broadcast.call_args_list]
+        self.assertTrue(sent)
+        self.assertEqual(sent[0]['order']['status'], Order.Status.PAID)
+
+    def test_rolled_back_order_is_not_broadcast(self):
+        with mock.patch('apps.orders.signals.broadcast') as broadcast:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError):
+                    with transaction.atomic():
+                        self.create_order()
+                        raise RuntimeError
+        self.assertFalse(broadcast.called)
+
+    def test_refused_payment_changes_nothing(self):
+        order = self.create_order(quantity=3)
+        with self.assertRaises(payments.InsufficientBalance) as ctx:
+            payments.pay_with_wallet(order.pk, self.user)
+        self.assertEqual(ctx.exception.details['shortage'], 1000)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertFalse(WalletTransaction.objects.exists())
+
+    def test_paid_order_cannot_be_paid_again(self):
+        order = self.create_order()
+        payments.pay_with_wallet(order.pk, self.user)
+        with self.assertRaises(payments.OrderNotPayable):
+            payments.pay_with_wallet(order.pk, self.user)
+
+    def test_view_reports_shortage(self):
+        order = self.create_order(quantity=3)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(f'/api/orders/{order.pk}/pay_with_wallet/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['required_amount'], 6000)
+
+
+class ConcurrentWalletPaymentTests(TransactionTestCase):
+    """Fire parallel payments and check that money and stock stay consistent."""
+
+    workers = 8
+    initial_balance = 5000
+    initial_stock = 3
+
+    def setUp(self):
+        # Invoice rendering threads would outlive the test's database
+        patcher = mock.patch('apps.orders.signals.schedule_invoice_render')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(mobile='09124444444', password='pass')
+        User.objects.filter(pk=self.user.pk).update(wallet_balance=self.initial_balance)
+        category = Category.objects.create(name='اکانت', slug='accounts')
+        self.product = Product.objects.create(
+            category=category, title='اکانت', slug='account', description='-',
+            price=1000, main_image='products/test.png', stock=self.initial_stock,
+        )
+        self.orders = []
+        for _ in range(self.workers):
+            order = Order.objects.create(user=self.user, total_price=1000)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price=1000)
+            self.orders.append(order)
+
+    def pay(self, order, barrier):
+        user = User.objects.get(pk=self.user.pk)
+        barrier.wait()
+        try:
+            for attempt in range(20):
+                try:
+                    payments.pay_with_wallet(order.pk, user)
+                    return True
+                except payments.PaymentError:
+                    return False
+                except OperationalError:
+                    # SQLite refuses a concurrent writer instead of waiting; retry like a client would
+                    time.sleep(0.01 * (attempt + 1))
+            return False
+        finally:
+            connections.close_all()
+
+    def test_parallel_payments_keep_invariants(self):
+        barrier = threading.Barrier(self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(lambda order: self.pay(order, barrier), self.orders))
+
+        paid = Order.objects.filter(status=Order.Status.PAID).count()
+        balance = User.objects.values_list('wallet_balance', flat=True).get(pk=self.user.pk)
+        stock = Product.objects.values_list('stock', flat=True).get(pk=self.product.pk)
+        spent = sum(WalletTransaction.objects.filter(user=self.user).values_list('amount', flat=True))
+
+        self.assertEqual(paid, sum(results))
+        self.assertGreaterEqual(paid, 1)
+        self.assertLessEqual(paid, self.initial_stock)
+        self.assertGreaterEqual(balance, 0)
+        self.assertGreaterEqual(stock, 0)
+        self.assertEqual(stock, self.initial_stock - paid)
+        self.assertEqual(balance, self.initial_balance - 1000 * paid)
+        self.assertEqual(spent, 1000 * paid)
+
+
+class OrderCreationTests(TestCase):
+    """Cart ingestion writes the order once, whatever the number of lines."""
+    client_class = APIClient
+
+    def setUp(self):
+        self.user = User.objects.create_user(mobile='09125555555', password='pass')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='دوره', slug='courses')
+        self.products = [
+            Product.objects.create(
+                category=self.category, title=f'دوره {i}', slug=f'course-{i}', description='-',
+                price=1000, discount_price=800 if i % 2 else None,
+                main_image='products/test.png', stock=5,
+            )
+            for i in range(20)
+        ]
+
+    def post_cart(self, lines):
+        return self.client.post('/api/orders/', {'cart_items': lines}, format='json')
+
+    def test_large_cart_is_created_in_constant_queries(self):
+        saved = []
+        handler = lambda sender, instance, created, **kwargs: saved.append(created)
+        post_save.connect(handler, sender=Order)
+        self.addCleanup(post_save.disconnect, handler, sender=Order)
+
+        lines = [{'product_id': product.id, 'quantity': 2} for product in self.products]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_cart(lines)
+
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual(order.items.count(), 20)
+        self.assertEqual(order.total_price, 2 * (10 * 1000 + 10 * 800))
+        # Order is inserted (and broadcast) exactly once
+        self.assertEqual(saved, [True])
+        writes = [q for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 2)
+
+    def test_duplicate_lines_are_merged(self):
+        product = self.products[0]
+        response = self.post_cart([{'product_id': product.id}, {'product_id': product.id, 'quantity': 2}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(Order.objects.get().items.values_list('quantity', flat=True)), [3])
+
+    def test_invalid_cart_writes_nothing(self):
+        inactive = self.products[1]
+        inactive.is_active = False
+        inactive.save()
+        response = self.post_cart([
+            {'product_id': self.products[0].id, 'quantity': 6},
+            {'product_id': inactive.id},
+            {'product_id': 99999},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['cart_items']), 3)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderListTests(TestCase):
+    """Listing orders costs a fixed number of queries and no storage calls."""
+    client_class = APIClient
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(
+            MEDIA_ROOT=f'{cls.media_root}/media', INVOICE_DIR=f'{cls.media_root}/invoices',
+        )
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.admin = User.objects.create_user(mobile='09126666666', password='pass', is_staff=True)
+        category = Category.objects.create(name='فایل', slug='files')
+        self.product = Product.objects.create(
+            category=category, title='فایل', slug='file', description='-',
+            price=1000, main_image='products/test.png', product_type='file',
+        )
+        self.product.download_file.save('data.zip', ContentFile(b'x' * 2048))
+        self.client.force_authenticate(self.admin)
+
+    def create_orders(self, count, status=Order.Status.PENDING):
+        for i in range(count):
+            customer = User.objects.create_user(mobile=f'0913{Order.objects.count():07d}', password='pass')
+            order = Order.objects.create(user=customer, status=status, total_price=1000)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price=1000)
+
+    def list_orders(self, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/orders/', params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.data
+
+    def test_file_size_is_stored_on_upload(self):
+        self.assertEqual(self.product.download_file_size, 2048)
+        self.assertEqual(self.product.file_size, '2.0 KB')
+
+    def test_list_query_count_is_constant(self):
+        self.create_orders(2)
+        small, _ = self.list_orders()
+        self.create_orders(8)
+        with mock.patch.object(default_storage, 'size', side_effect=AssertionError('storage stat')):
+            large, data = self.list_orders()
+        self.assertEqual(len(data), 10)
+        self.assertEqual(data[0]['items'][0]['product']['file_size'], '2.0 KB')
+        self.assertEqual(small, large)
+
+    def test_pagination_is_opt_in(self):
+        self.create_orders(3)
+        _, data = self.list_orders({'page_size': 2})
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['results']), 2)
+
+    def test_status_and_date_filters(self):
+        self.create_orders(2)
+        self.create_orders(1, status=Order.Status.PAID)
+        _, data = self.list_orders({'status': 'paid'})
+        self.assertEqual(len(data), 1)
+
+        today = timezone.localdate(Order.objects.first().created_at).isoformat()
+        _, data = self.list_orders({'date_from': today, 'date_to': today})
+        self.assertEqual(len(data), 3)
+        _, data = self.list_orders({'date_from': '2000-01-01', 'date_to': '2000-01-02'})
+        self.assertEqual(data, [])
+
+        response = self.client.get('/api/orders/', {'date_from': '2024-13-40'})
+        self.assertEqual(response.status_code, 400)
+
+
+class InvoiceTests(TestCase):
+    """Invoices are rendered once per order state and served from storage."""
+    client_class = APIClient
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(
+            MEDIA_ROOT=f'{cls.media_root}/media', INVOICE_DIR=f'{cls.media_root}/invoices',
+        )
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user(mobile='09127777777', password='pass', full_name='مشتری')
+        category = Category.objects.create(name='اکانت', slug='accounts')
+        product = Product.objects.create(
+            category=category, title='اکانت', slug='account', description='-',
+            price=1000, main_image='products/test.png',
+        )
+        self.order = Order.objects.create(user=self.user, status=Order.Status.PAID, total_price=1000)
+        OrderItem.objects.create(order=self.order, product=product, quantity=1, price=1000)
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/orders/{self.order.pk}/download_pdf/'
+
+    def test_paid_order_schedules_render_after_commit(self):
+        with mock.patch('apps.orders.signals.schedule_invoice_render') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.order.save()
+        schedule.assert_called_once_with(self.order.pk)
+
+    def test_missing_invoice_is_queued(self):
+        with mock.patch.object(invoices, 'schedule_invoice_render') as schedule:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Retry-After'], '2')
+        schedule.assert_called_once_with(self.order.pk)
+
+    def test_rendered_invoice_is_served_and_replaced_on_change(self):
+        first = invoices.render_invoice(self.order.pk)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        # Rendering the same state again reuses the stored file
+        self.assertEqual(invoices.render_invoice(self.order.pk), first)
+
+        self.order.admin_notes = 'اطلاعات اکانت'
+        self.order.save()
+        self.assertIsNone(invoices.get_cached_invoice(invoices.load_order(self.order.pk)))
+        second = invoices.render_invoice(self.order.pk)
+        self.assertNotEqual(first, second)
+        self.assertFalse(invoices.invoice_storage().exists(first))
+        self.assertTrue(invoices.invoice_storage().exists(second))
+
+    def test_invoices_are_stored_outside_media_root(self):
+        name = invoices.render_invoice(self.order.pk)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'invoices', name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'media')))
+
+    @override_settings(INVOICE_RENDER_BACKGROUND=False)
+    def test_without_background_rendering_download_renders_inline(self):
+        with mock.patch.object(invoices, '_get_executor') as executor:
+            invoices.schedule_invoice_render(self.order.pk)
+            response = self.client.get(self.url)
+        executor.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+
+class PdfShapingTests(TestCase):
+
+    def test_digit_formatting(self):
+        self.assertEqual(pdf_generator.format_persian_number(1405), '۱۴۰۵')
+        self.assertEqual(pdf_generator.format_persian_price(1250000), '۱,۲۵۰,۰۰۰')
+        self.assertEqual(pdf_generator.format_persian_price(None), '۰')
+
+    def test_shaped_labels_are_memoized(self):
+        pdf_generator._shape.cache_clear()
+        first = pdf_generator.persian_text('تومان')
+        self.assertEqual(pdf_generator.persian_text('تومان'), first)
+        self.assertEqual(pdf_generator._shape.cache_info().hits, 1)
+
+    def test_thumbnail_is_cached_on_disk(self):
+        from PIL import Image as PILImage
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        source = f'{media_root}/photo.png'
+        PILImage.new('RGB', (400, 300), 'red').save(source)
+
+        with override_settings(MEDIA_ROOT=media_root):
+            thumbnail = pdf_generator.get_thumbnail_path(source)
+            with mock.patch.object(pdf_generator.PILImage, 'open') as pil_open:
+                self.assertEqual(pdf_generator.get_thumbnail_path(source), thumbnail)
+            pil_open.assert_not_called()
+        with PILImage.open(thumbnail) as img:
+            self.assertEqual(img.size, (40, 40))
+
+    def test_benchmark_compares_old_and_new_paths(self):
+        # The sample customer must not clash with a real account
+        User.objects.create_user(mobile='09000000000', password='pass')
+        out = io.StringIO()
+        call_command('benchmark_invoice', lines=3, runs=1, image_size=64, stdout=out)
+        report = out.getvalue()
+        for label in ('old invoice', 'old product images', 'new invoice (warm)', 'new product images (warm)'):
+            self.assertIn(label, report)
+        self.assertIn('3 images', report)
+        self.assertFalse(Order.objects.exists())
+
+
+class InvoiceExportTests(TestCase):
+    """Admin bulk export of invoices, run inline (no worker processes) in tests."""
+    client_class = APIClient
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=f'{tmp}/media', INVOICE_DIR=f'{tmp}/invoices', INVOICE_EXPORT_DIR=f'{tmp}/exports',
+            INVOICE_EXPORT_PROCESSES=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.admin = User.objects.create_user(mobile='09128888888', password='pass', is_staff=True)
+        category = Category.objects.create(name='اکانت', slug='accounts')
+        product = Product.objects.create(
+            category=category, title='اکانت', slug='account', description='-',
+            price=1000, main_image='products/test.png',
+        )
+        self.orders = []
+        for status in (Order.Status.PAID, Order.Status.PAID, Order.Status.PENDING):
+            order = Order.objects.create(user=self.admin, status=status, total_price=1000)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=1000)
+            self.orders.append(order)
+        self.client.force_authenticate(self.admin)
+
+    def run_inline(self, order_ids, fmt):
+        job_id = exports.create_export_job(order_ids, fmt)
+        exports.run_export_job(job_id)
+        return job_id
+
+    def export(self, **data):
+        with mock.patch.object(exports, 'start_export_job', side_effect=self.run_inline):
+            response = self.client.post('/api/orders/export_invoices/', data, format='json')
+        self.assertEqual(response.status_code, 202)
+        return response.data['job_id']
+
+    def test_zip_export(self):
+        job_id = self.export(status='PAID')
+        status_url = f'/api/orders/export_invoices/{job_id}/'
+        progress = self.client.get(status_url).data
+        self.assertEqual((progress['status'], progress['done'], progress['total']), ('done', 2, 2))
+
+        response = self.client.get(status_url, {'download': 1})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted(f'order-{order.pk}.pdf' for order in self.orders[:2]),
+        )
+        self.assertTrue(archive.read(archive.namelist()[0]).startswith(b'%PDF'))
+
+    def test_merged_pdf_export(self):
+        today = timezone.localdate().isoformat()
+        job_id = self.export(date_from=today, date_to=today, format='pdf')
+        response = self.client.get(f'/api/orders/export_invoices/{job_id}/', {'download': 1})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertEqual(len(re.findall(rb'/Type /Page\b(?!s)', content)), 3)
+
+    def test_progress_is_reported_per_invoice(self):
+        job_id = exports.create_export_job([order.pk for order in self.orders[:2]], 'pdf')
+        progress = []
+        update_job = exports._update_job
+
+        def record(job_id, **changes):
+            update_job(job_id, **changes)
+            if 'done' in changes:
+                progress.append(changes['done'])
+
+        with mock.patch.object(exports, '_update_job', side_effect=record):
+            exports.run_export_job(job_id)
+        self.assertEqual(progress, [1, 2])
+        self.assertEqual(InvoiceExport.objects.get(pk=job_id).status, 'done')
+
+    def test_expired_jobs_and_files_are_removed(self):
+        job_id = exports.create_export_job([self.orders[0].pk], 'zip')
+        exports.run_export_job(job_id)
+        path = exports.export_path(job_id, 'zip')
+        expired = timezone.now() - datetime.timedelta(seconds=exports.JOB_TIMEOUT + 60)
+        InvoiceExport.objects.filter(pk=job_id).update(created_at=expired)
+        os.utime(path, (expired.timestamp(), expired.timestamp()))
+
+        self.assertIsNone(exports.get_job(job_id))
+        exports.remove_expired_exports()
+        self.assertFalse(InvoiceExport.objects.filter(pk=job_id).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_missing_export_file_is_gone(self):
+        job_id = self.export(status='PAID')
+        os.remove(exports.export_path(job_id, 'zip'))
+
+        response = self.client.get(f'/api/orders/export_invoices/{job_id}/', {'download': 1})
+        self.assertEqual(response.status_code, 410)
+
+    @override_settings(INVOICE_EXPORT_MERGED_MAX_ORDERS=2)
+    def test_merged_pdf_is_capped(self):
+        response = self.client.post('/api/orders/export_invoices/', {
+            'date_from': timezone.localdate().isoformat(), 'format': 'pdf',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(ValueError):
+            exports.create_export_job([order.pk for order in self.orders], 'pdf')
+        # The ZIP format has no such limit
+        self.export(date_from=timezone.localdate().isoformat())
+
+    def test_export_requires_filter_and_admin(self):
+        response = self.client.post('/api/orders/export_invoices/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.client.force_authenticate(User.objects.create_user(mobile='09129999999', password='pass'))
+        response = self.client.post('/api/orders/export_invoices/', {'status': 'PAID'}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class OrderBroadcastPayloadTests(TestCase):
+    """The order_update payload is built from loaded data without debug output."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(mobile='09125555555', password='pass', full_name='خریدار')
+
+    def test_payload_uses_cached_user(self):
+        from .signals import get_order_data
+
+        order = Order.objects.create(user=self.user, total_price=1000)
+        order = Order.objects.select_related('user').get(pk=order.pk)
+        with self.assertNumQueries(0):
+            data = get_order_data(order)
+        self.assertEqual((data['user_id'], data['user_name']), (self.user.pk, 'خریدار'))
+
+    def test_save_does_not_write_to_stdout(self):
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            Order.objects.create(user=self.user, total_price=1000)
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_debug_records_are_sampled(self):
+        from config.tracing import SampledFilter
+
+        sampled = SampledFilter(rate=0)
+        debug = logging.LogRecord('apps.orders', logging.DEBUG, __file__, 1, 'x', None, None)
+        warning = logging.LogRecord('apps.orders', logging.WARNING, __file__, 1, 'x', None, None)
+        self.assertFalse(sampled.filter(debug))
+        self.assertTrue(sampled.filter(warning))
+
+
+class OrderStreamTests(TransactionTestCase):
+    """Order events go to the owner's stream and the admin stream only."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(mobile='09126666666', password='pass')
+        self.admin = User.objects.create_superuser(mobile='09126666667', password='pass')
+        patcher = mock.patch('apps.orders.signals.schedule_invoice_render')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_events_are_sent_to_owner_and_admin_groups(self):
+        with mock.patch('apps.orders.signals.broadcast') as broadcast:
+            order = Order.objects.create(user=self.owner, total_price=1000)
+        groups = [call.args[0] for call in broadcast.call_args_list]
+        self.assertEqual(groups, [f'user_{self.owner.id}_orders', ADMIN_ORDERS_GROUP])
+        # The payload is built once and shared by both sends
+        self.assertIs(broadcast.call_args_list[0].args[1], broadcast.call_args_list[1].args[1])
+        self.assertEqual(broadcast.call_args_list[0].args[1]['order']['id'], order.id)
+
+    def connect(self, user):
+        communicator = WebsocketCommunicator(OrderConsumer.as_asgi(), '/ws/orders/')
+        communicator.scope['user'] = user
+        return communicator
+
+    def test_anonymous_socket_is_closed(self):
+        async def run():
+            connected, _ = await self.connect(AnonymousUser()).connect()
+            return connected
+
+        self.assertFalse(async_to_sync(run)())
+
+    def test_users_only_hear_their_own_stream(self):
+        async def run():
+            layer = get_channel_layer()
+            owner, admin = self.connect(self.owner), self.connect(self.admin)
+            await owner.connect()
+            await admin.connect()
+            await layer.group_send(f'user_{self.owner.id}_orders', {'type': 'order_delete', 'order_id': 1})
+            await layer.group_send(ADMIN_ORDERS_GROUP, {'type': 'order_delete', 'order_id': 2})
+            received = (
+                await owner.receive_json_from(), await owner.receive_nothing(timeout=0.1),
+                await admin.receive_json_from(), await admin.receive_nothing(timeout=0.1),
+            )
+            await owner.disconnect()
+            await admin.disconnect()
+            return received
+
+        owner_message, owner_idle, admin_message, admin_idle = async_to_sync(run)()
+        self.assertEqual(owner_message['order_id'], 1)
+        self.assertEqual(admin_message['order_id'], 2)
+        self.assertTrue(owner_idle and admin_idle)
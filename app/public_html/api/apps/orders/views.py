@@ -1,27 +1,76 @@
 # مسیر: backend/apps/orders/views.py
+import logging
 
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import HttpResponse
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from django.utils.dateparse import parse_date
+from django.conf import settings
+from django.http import FileResponse
+from config.tracing import trace
 from .models import Order
 from .serializers import OrderSerializer, OrderReceiptSerializer
-from .pdf_generator import generate_order_pdf
+from . import exports, invoices, payments
+
+logger = logging.getLogger(__name__)
+
+
+class OrderPagination(PageNumberPagination):
+    """
+    Page-number pagination that is only applied when `page` or `page_size` is
+    requested, so existing clients that expect a plain list keep working.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def get_page_size(self, request):
+        if self.page_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().get_page_size(request)
+
 
 class OrderViewSet(viewsets.ModelViewSet):
     """ViewSet for managing orders with user-specific access control."""
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderPagination
 
     def get_queryset(self):
         """Return orders based on user role - all for admin, user-specific for customers."""
         user = self.request.user
-        # اگر کاربر ادمین است، همه سفارش‌ها را ببیند
-        if user.is_staff:
-            return Order.objects.all().order_by('-created_at')
-        # اگر کاربر عادی است، فقط سفارش‌های خود را ببیند
-        return Order.objects.filter(user=user).order_by('-created_at')
+        queryset = Order.objects.select_related('user').order_by('-created_at')
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.prefetch_related('items__product__category')
+        # اگر کاربر عادی است، فقط سفارش‌های خود را ببیند؛ ادمین همه سفارش‌ها را می‌بیند
+        if not user.is_staff:
+            queryset = queryset.filter(user=user)
+
+        if self.action == 'list':
+            queryset = self.filter_list(queryset, self.request.query_params)
+        return queryset
+
+    def filter_list(self, queryset, params):
+        """Apply status, date_from and date_to (YYYY-MM-DD) filters."""
+        status_param = params.get('status')
+        if status_param:
+            queryset = queryset.filter(status__in=status_param.upper().split(','))
+
+        for param, lookup in (('date_from', 'created_at__date__gte'), ('date_to', 'created_at__date__lte')):
+            value = params.get(param)
+            if not value:
+                continue
+            try:
+                date = parse_date(value)
+            except ValueError:
+                date = None
+            if date is None:
+                raise ValidationError({param: 'تاریخ باید به صورت YYYY-MM-DD باشد.'})
+            queryset = queryset.filter(**{lookup: date})
+        return queryset
 
     def perform_create(self, serializer):
         """Automatically assign the current user to the order."""
@@ -42,24 +91,19 @@ class OrderViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], serializer_class=OrderReceiptSerializer, parser_classes=[MultiPartParser, FormParser])
     def upload_receipt(self, request, pk=None):
         """Upload payment receipt for an order."""
-        print(f"DEBUG: Upload receipt called for order {pk}")
-        print(f"DEBUG: User: {request.user}")
-        print(f"DEBUG: Files: {request.FILES}")
-        print(f"DEBUG: Data: {request.data}")
-        
+        logger.debug('Receipt upload for order %s by user %s (files: %s)', pk, request.user.pk, request.FILES.keys())
+
         try:
             order = self.get_object()
-            print(f"DEBUG: Order found: {order}")
         except Order.DoesNotExist:
-            print("DEBUG: Order not found")
             return Response(
                 {'error': 'سفارش یافت نشد'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         
         # Ensure user can only upload receipt for their own orders
-        if order.user != request.user and not request.user.is_staff:
-            print(f"DEBUG: Permission denied. Order user: {order.user}, Request user: {request.user}")
+        if order.user_id != request.user.pk and not request.user.is_staff:
+            logger.info('User %s tried to upload a receipt for order %s of user %s', request.user.pk, order.pk, order.user_id)
             return Response(
                 {'error': 'شما فقط می‌توانید برای سفارش‌های خود فیش آپلود کنید'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -67,29 +111,25 @@ class OrderViewSet(viewsets.ModelViewSet):
         
         # Check if file is provided
         if 'payment_receipt' not in request.FILES:
-            print("DEBUG: No file provided")
             return Response(
                 {'error': 'فایل رسید پرداخت ارسال نشده است'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         serializer = self.get_serializer(order, data=request.data, partial=True)
-        print(f"DEBUG: Serializer valid: {serializer.is_valid()}")
-        if not serializer.is_valid():
-            print(f"DEBUG: Serializer errors: {serializer.errors}")
-        
         if serializer.is_valid():
-            serializer.save()
-            # Update status to pending after receipt upload
-            order.status = Order.Status.PENDING 
-            order.payment_method = Order.PaymentMethod.CARD
-            order.save()
-            print("DEBUG: Upload successful")
+            with trace(logger, 'receipt upload', order_id=order.pk):
+                serializer.save()
+                # Update status to pending after receipt upload
+                order.status = Order.Status.PENDING 
+                order.payment_method = Order.PaymentMethod.CARD
+                order.save()
             return Response({
                 'status': 'Receipt uploaded successfully',
                 'message': 'فیش پرداخت با موفقیت آپلود شد'
             }, status=status.HTTP_200_OK)
         
+        logger.debug('Receipt upload for order %s rejected: %s', order.pk, serializer.errors)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post'])
@@ -109,50 +149,11 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if order.status != Order.Status.PENDING:
-            return Response(
-                {'error': 'این سفارش قبلاً پرداخت شده است'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         user = request.user
-        
-        # برای محصولات رایگان، نیازی به چک موجودی نیست
-        if order.total_price > 0 and user.wallet_balance < order.total_price:
-            return Response(
-                {
-                    'error': 'موجودی کیف پول کافی نیست',
-                    'wallet_balance': user.wallet_balance,
-                    'required_amount': order.total_price,
-                    'shortage': order.total_price - user.wallet_balance
-                }, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        from django.db import transaction
-        from apps.users.utils import send_product_update
-        with transaction.atomic():
-            # فقط اگر مبلغ بیشتر از صفر باشد، از کیف پول کسر کن
-            if order.total_price > 0:
-                user.wallet_balance -= order.total_price
-                user.save()
-            
-            order.status = Order.Status.PAID
-            order.payment_method = Order.PaymentMethod.WALLET
-            order.save()
-            
-            # Decrease stock
-            for item in order.items.all():
-                if item.product.stock >= item.quantity:
-                    item.product.stock -= item.quantity
-                    item.product.save()
-                    send_product_update(item.product)
-                else:
-                    # In a real app, you'd handle this case (e.g., refund or error)
-                    # For now, we just set to 0
-                    item.product.stock = 0
-                    item.product.save()
-                    send_product_update(item.product)
+        try:
+            order = payments.pay_with_wallet(order.pk, user)
+        except payments.PaymentError as exc:
+            return Response({'error': exc.message, **exc.details}, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({
             'message': 'پرداخت با موفقیت انجام شد' if order.total_price > 0 else 'محصول رایگان با موفقیت دریافت شد',
@@ -187,12 +188,93 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # فاکتور از قبل (در پس‌زمینه) ساخته می‌شود؛ اگر هنوز آماده نیست در صف قرار می‌گیرد
+        order = invoices.load_order(order.pk)
+        name = invoices.get_cached_invoice(order)
+        if name is None and not settings.INVOICE_RENDER_BACKGROUND:
+            name = invoices.render_invoice(order.pk)
+        if name is None:
+            invoices.schedule_invoice_render(order.pk)
+            response = Response(
+                {'status': 'rendering', 'message': 'فاکتور در حال آماده‌سازی است، چند لحظه دیگر دوباره تلاش کنید.'},
+                status=status.HTTP_202_ACCEPTED
+            )
+            response['Retry-After'] = '2'
+            return response
+
         try:
-            # تولید PDF
-            return generate_order_pdf(order)
-        except Exception as e:
-            print(f"Error generating PDF: {e}")
+            return FileResponse(
+                invoices.invoice_storage().open(name, 'rb'),
+                as_attachment=True,
+                filename=f'order-{order.id}.pdf',
+                content_type='application/pdf'
+            )
+        except OSError:
             return Response(
                 {'error': 'خطا در تولید فایل PDF'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def export_invoices(self, request):
+        """Start a bulk invoice export (ZIP or merged PDF) for the filtered orders."""
+        export_format = request.data.get('format', exports.FORMAT_ZIP)
+        if export_format not in exports.FORMATS:
+            return Response({'error': 'فرمت خروجی باید zip یا pdf باشد.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = {key: request.data.get(key) for key in ('status', 'date_from', 'date_to')}
+        if not any(params.values()):
+            return Response(
+                {'error': 'حداقل یکی از فیلترهای وضعیت یا بازه تاریخ را مشخص کنید.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queryset = self.filter_list(Order.objects.order_by('created_at', 'id'), params)
+        order_ids = list(queryset.values_list('id', flat=True))
+        if not order_ids:
+            return Response({'error': 'سفارشی با این فیلترها یافت نشد.'}, status=status.HTTP_404_NOT_FOUND)
+        max_merged = settings.INVOICE_EXPORT_MERGED_MAX_ORDERS
+        if export_format == exports.FORMAT_PDF and len(order_ids) > max_merged:
+            return Response(
+                {'error': f'حداکثر {max_merged} سفارش در یک PDF ادغام می‌شود؛ برای تعداد بیشتر خروجی zip بگیرید.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        job_id = exports.start_export_job(order_ids, export_format)
+        return Response({'job_id': job_id, 'total': len(order_ids), 'status': exports.STATUS_PENDING},
+                        status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser],
+            url_path=r'export_invoices/(?P<job_id>[0-9a-f]{32})')
+    def export_status(self, request, job_id=None):
+        """Progress of an export job; ?download=1 returns the file once it is done."""
+        job = exports.get_job(job_id)
+        if job is None:
+            return Response({'error': 'خروجی یافت نشد.'}, status=status.HTTP_404_NOT_FOUND)
+
+        if request.query_params.get('download'):
+            if job.status != exports.STATUS_DONE:
+                return Response({'error': 'خروجی هنوز آماده نیست.'}, status=status.HTTP_409_CONFLICT)
+            content_type = 'application/zip' if job.format == exports.FORMAT_ZIP else 'application/pdf'
+            try:
+                export_file = open(exports.export_path(job_id, job.format), 'rb')
+            except FileNotFoundError:
+                # Pruned, or written on another server; the client has to start a new export
+                return Response(
+                    {'error': 'فایل خروجی دیگر در دسترس نیست؛ دوباره درخواست خروجی بدهید.'},
+                    status=status.HTTP_410_GONE
+                )
+            return FileResponse(
+                export_file,
+                as_attachment=True,
+                filename=f'invoices-{job_id[:8]}.{job.format}',
+                content_type=content_type
+            )
+
+        return Response({
+            'job_id': job_id,
+            'status': job.status,
+            'format': job.format,
+            'total': job.total,
+            'done': job.done,
+            'error': job.error,
+        })
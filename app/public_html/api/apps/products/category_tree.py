@@ -0,0 +1,154 @@
+"""
+Materialized category tree.
+
+All categories are loaded with a single query and kept in process memory with
+ancestor paths and descendant-ID sets precomputed. products.signals bumps a
+version number in the Django cache on Category save/delete. A process rebuilds
+its copy on the next access after the version changes.
+
+The version only reaches other processes when CACHES is shared (Redis,
+database...). With the default per-process LocMem cache only the process that
+saved the category sees the bump, so every copy is also rebuilt once it is
+older than CATEGORY_TREE_TTL seconds. Other workers therefore show a changed
+menu within that time.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+VERSION_CACHE_KEY = 'products:category_tree:version'
+
+_shared = {'version': None, 'tree': None, 'loaded_at': 0.0}
+_lock = threading.Lock()
+
+
+class CategoryTree:
+    """Immutable snapshot of the category hierarchy."""
+
+    def __init__(self, rows):
+        self.nodes = {row['id']: row for row in rows}
+        self.ids_by_slug = {row['slug']: row['id'] for row in rows}
+        self.children = {category_id: [] for category_id in self.nodes}
+        self.roots = []
+        for row in rows:
+            parent_id = row['parent_id']
+            if parent_id in self.nodes:
+                self.children[parent_id].append(row['id'])
+            else:
+                self.roots.append(row['id'])
+
+        self.ancestors = {category_id: self._walk_ancestors(category_id) for category_id in self.nodes}
+        self.descendants = {}
+        for category_id in self.nodes:
+            self._collect_descendants(category_id)
+
+    def _walk_ancestors(self, category_id):
+        # Root first, parent last; guarded against accidental cycles
+        path = []
+        seen = {category_id}
+        parent_id = self.nodes[category_id]['parent_id']
+        while parent_id in self.nodes and parent_id not in seen:
+            path.append(parent_id)
+            seen.add(parent_id)
+            parent_id = self.nodes[parent_id]['parent_id']
+        return path[::-1]
+
+    def _collect_descendants(self, category_id):
+        if category_id in self.descendants:
+            return self.descendants[category_id]
+        ids = {category_id}
+        stack = list(self.children[category_id])
+        while stack:
+            child_id = stack.pop()
+            if child_id not in ids:
+                ids.add(child_id)
+                stack.extend(self.children[child_id])
+        self.descendants[category_id] = frozenset(ids)
+        return self.descendants[category_id]
+
+    def id_for_slug(self, slug):
+        return self.ids_by_slug.get(slug)
+
+    def descendant_ids(self, category_id):
+        """IDs of the category and all of its sub-categories, at any depth."""
+        return self.descendants.get(category_id, frozenset())
+
+    def path_names(self, category_id):
+        """Names from the root down to (and including) the category."""
+        return [self.nodes[pk]['name'] for pk in self.ancestors[category_id] + [category_id]]
+
+    def root_ids(self, active_only=False):
+        if active_only:
+            return [pk for pk in self.roots if self.nodes[pk]['is_active']]
+        return list(self.roots)
+
+    def serialize(self, category_id, request=None):
+        """
+        Nested representation matching CategorySerializer's output, built
+        entirely from memory.
+        """
+        node = self.nodes[category_id]
+        parent = self.nodes.get(node['parent_id'])
+        icon = None
+        if node['icon']:
+            icon = default_storage.url(node['icon'])
+            if request is not None:
+                icon = request.build_absolute_uri(icon)
+        return {
+            'id': node['id'],
+            'name': node['name'],
+            'slug': node['slug'],
+            'icon': icon,
+            'parent': node['parent_id'],
+            'parent_name': parent['name'] if parent else None,
+            'children': [self.serialize(child_id, request) for child_id in self.children[category_id]],
+            'is_active': node['is_active'],
+        }
+
+
+def _load_tree():
+    from .models import Category
+
+    rows = list(Category.objects.order_by('id').values('id', 'name', 'slug', 'icon', 'parent_id', 'is_active'))
+    return CategoryTree(rows)
+
+
+def get_category_tree():
+    """Return the current tree, rebuilding it (one query) if it is stale or expired."""
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(VERSION_CACHE_KEY, version, None)
+        version = cache.get(VERSION_CACHE_KEY, version)
+
+    def is_current():
+        return (
+            _shared['tree'] is not None and _shared['version'] == version
+            and time.monotonic() - _shared['loaded_at'] < settings.CATEGORY_TREE_TTL
+        )
+
+    tree = _shared['tree']
+    if is_current():
+        return tree
+
+    with _lock:
+        if not is_current():
+            _shared['tree'] = _load_tree()
+            _shared['version'] = version
+            _shared['loaded_at'] = time.monotonic()
+        return _shared['tree']
+
+
+def invalidate_category_tree():
+    """
+    Mark the tree as stale: at once in this process and in processes sharing
+    the cache, within CATEGORY_TREE_TTL seconds in the others.
+    """
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+    with _lock:
+        _shared['tree'] = None
+        _shared['version'] = None
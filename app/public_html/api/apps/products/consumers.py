@@ -1,9 +1,8 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.db.models import Q
-from .models import Product
-from .serializers import ProductSerializer
+from .search import search_cache, search_hits
 
 class ProductConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -29,7 +28,9 @@ class ProductConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'product_update',
             'action': event['action'],
-            'product': event['product']
+            'product': event['product'],
+            # partial: فقط فیلدهای تغییرکرده ارسال شده‌اند
+            'partial': event.get('partial', False)
         }))
 
     async def product_delete(self, event):
@@ -39,15 +40,36 @@ class ProductConsumer(AsyncWebsocketConsumer):
         }))
 
 class SearchConsumer(AsyncWebsocketConsumer):
+    """
+    Live search box.
+
+    Only the latest query of a connection is served: a new message cancels the
+    pending search, and a short server-side debounce absorbs keystroke bursts
+    before anything hits the database. Results come from the shared
+    search_cache when possible.
+    """
+    debounce_seconds = 0.15
+
     async def connect(self):
+        self.search_task = None
         await self.accept()
 
     async def disconnect(self, close_code):
-        pass
+        self.cancel_search()
+
+    def cancel_search(self):
+        if self.search_task and not self.search_task.done():
+            self.search_task.cancel()
+        self.search_task = None
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        query = data.get('query', '')
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        query = str(data.get('query', '')).strip()
+
+        self.cancel_search()
         
         if len(query) < 2:
             await self.send(text_data=json.dumps({
@@ -56,24 +78,30 @@ class SearchConsumer(AsyncWebsocketConsumer):
             }))
             return
 
-        results = await self.perform_search(query)
-        await self.send(text_data=json.dumps({
-            'type': 'search_results',
-            'results': results,
-            'query': query
-        }))
+        self.search_task = asyncio.ensure_future(self.run_search(query))
+
+    async def run_search(self, query):
+        try:
+            await asyncio.sleep(self.debounce_seconds)
+            results = search_cache.get(query)
+            if results is None:
+                results = await self.perform_search(query)
+            await self.send(text_data=json.dumps({
+                'type': 'search_results',
+                'results': results,
+                'query': query
+            }))
+        except asyncio.CancelledError:
+            # Superseded by a newer query
+            pass
 
     @database_sync_to_async
     def perform_search(self, query):
-        products = Product.objects.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query),
-            is_active=True
-        ).order_by('-created_at')[:10]
-        
-        serializer = ProductSerializer(products, many=True)
-        return serializer.data
+        # Cached here so a search that finishes after being superseded
+        # still warms the cache for the next keystroke
+        results = search_hits(query)
+        search_cache.set(query, results)
+        return results
 
 class ProductCommentsConsumer(AsyncWebsocketConsumer):
     async def connect(self):
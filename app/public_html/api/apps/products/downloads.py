@@ -0,0 +1,164 @@
+"""
+Serving purchased product files.
+
+Files are streamed in fixed-size blocks instead of being read into worker
+memory, single byte ranges are honoured (206 / 416) so interrupted downloads
+can resume, and ETag / Last-Modified allow conditional requests. When
+PRODUCT_DOWNLOAD_SENDFILE is set, the response only carries an
+X-Accel-Redirect (nginx) or X-Sendfile (Apache) header and the front web server
+sends the bytes itself.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+CHUNK_SIZE = 64 * 1024
+
+SENDFILE_X_ACCEL = 'x-accel-redirect'
+SENDFILE_X_SENDFILE = 'x-sendfile'
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _file_stat(field_file):
+    """Return (size, mtime timestamp) of a stored file."""
+    storage = field_file.storage
+    size = storage.size(field_file.name)
+    try:
+        mtime = storage.get_modified_time(field_file.name).timestamp()
+    except (NotImplementedError, AttributeError):
+        mtime = None
+    return size, mtime
+
+
+def _etag(size, mtime):
+    return '"%x-%x"' % (int(mtime or 0), size)
+
+
+def _content_disposition(filename):
+    try:
+        filename.encode('ascii')
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range `Range` header.
+
+    Returns (start, end) inclusive, None when the header should be ignored
+    (absent, malformed or multi-range) and raises ValueError when the range
+    cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('range not satisfiable')
+    return start, min(end, size - 1)
+
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and mtime is not None and int(mtime) <= since
+
+
+def _iter_range(file_obj, start, length):
+    try:
+        file_obj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file_obj.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file_obj.close()
+
+
+def _sendfile_response(field_file, mode):
+    response = HttpResponse()
+    if mode == SENDFILE_X_ACCEL:
+        prefix = settings.PRODUCT_DOWNLOAD_ACCEL_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = quote(f'{prefix}/{field_file.name}')
+    else:
+        response['X-Sendfile'] = field_file.path
+    # Let the front server decide the type from the file itself
+    del response['Content-Type']
+    return response
+
+
+def serve_file(request, field_file, filename=None):
+    """Build the download response for a FieldFile."""
+    filename = filename or os.path.basename(field_file.name)
+    size, mtime = _file_stat(field_file)
+    etag = _etag(size, mtime)
+    last_modified = http_date(mtime) if mtime is not None else None
+
+    not_modified = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(mtime) if mtime is not None else None,
+    )
+    if not_modified is not None:
+        return not_modified
+
+    mode = (getattr(settings, 'PRODUCT_DOWNLOAD_SENDFILE', '') or '').lower()
+    if mode in (SENDFILE_X_ACCEL, SENDFILE_X_SENDFILE):
+        response = _sendfile_response(field_file, mode)
+    else:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range and not _if_range_matches(request, etag, mtime):
+            byte_range = None
+
+        file_obj = field_file.storage.open(field_file.name, 'rb')
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = StreamingHttpResponse(
+                _iter_range(file_obj, start, length), status=206, content_type=content_type
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(length)
+        else:
+            response = FileResponse(file_obj, as_attachment=True, filename=filename)
+            response.block_size = CHUNK_SIZE
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = _content_disposition(filename)
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = last_modified
+    return response
@@ -0,0 +1,202 @@
+"""
+Coalesced product broadcasts.
+
+Product changes are collected in a per-transaction buffer instead of being
+sent to the 'products' group on every save(). When the transaction commits,
+each product gets at most one message:
+
+- product_delete for products that were deleted or deactivated;
+- the full payload for new or re-activated products, loaded with one query;
+- otherwise a partial product_update carrying `id`, `is_active` and only the
+  fields that changed.
+
+Each savepoint level of a transaction has its own buffer, keyed on the
+savepoint ids and registered with transaction.on_commit from inside that
+level. When a savepoint rolls back, Django discards that registration, and the
+buffer's events go with it. On commit the buffers of every surviving level are
+merged, so a product still gets a single message.
+
+Outside a transaction events are sent immediately, as on_commit does.
+"""
+import threading
+import weakref
+from functools import partial
+
+from django.db import connection, transaction
+
+from apps.users.broadcast import broadcast
+
+PRODUCTS_GROUP = 'products'
+
+# Fields clients render from product_update messages
+BROADCAST_FIELDS = (
+    'title', 'slug', 'price', 'discount_price', 'is_active', 'main_image', 'category_id',
+    'delivery_time', 'description', 'stock', 'product_type', 'show_in_hero',
+)
+
+_local = threading.local()
+
+
+def snapshot(product):
+    """Broadcast field values of a product as stored in the database."""
+    values = {field: product.__dict__.get(field) for field in BROADCAST_FIELDS}
+    # FieldFile objects change in place on upload; keep the stored name
+    values['main_image'] = getattr(values['main_image'], 'name', values['main_image'])
+    return values
+
+
+def changed_fields(product):
+    """Fields of `product` that differ from its last loaded or saved state."""
+    loaded = getattr(product, '_broadcast_snapshot', None)
+    current = snapshot(product)
+    if loaded is None:
+        return current
+    return {field: value for field, value in current.items() if loaded[field] != value}
+
+
+def _category_payload(category_id):
+    from .category_tree import get_category_tree
+
+    node = get_category_tree().nodes.get(category_id)
+    return {
+        'id': category_id,
+        'name': node['name'] if node else None,
+        'slug': node['slug'] if node else None,
+    }
+
+
+def _diff_payload(product_id, changes):
+    from .signals import image_url
+
+    payload = {'id': product_id, 'is_active': True}
+    for field, value in changes.items():
+        if field == 'category_id':
+            payload['category'] = _category_payload(value)
+        elif field == 'main_image':
+            payload['main_image'] = image_url(value)
+        else:
+            payload[field] = value
+    return payload
+
+
+class ProductEventBuffer:
+    """Pending product events of one savepoint level, keyed by product id."""
+
+    def __init__(self):
+        self.events = {}
+        self._callback = None
+
+    def add(self, product_id, action, changes=None):
+        event = self.events.setdefault(product_id, {'action': None, 'changes': {}})
+        if action == 'deleted' or event['action'] == 'deleted':
+            event['action'] = 'deleted'
+        elif action == 'created' or event['action'] == 'created':
+            event['action'] = 'created'
+        elif action == 'full' or event['action'] == 'full':
+            event['action'] = 'full'
+        else:
+            event['action'] = 'updated'
+        event['changes'].update(changes or {})
+
+    def merge(self, other):
+        for product_id, event in other.events.items():
+            self.add(product_id, event['action'], event['changes'])
+
+    def register(self):
+        """Queue the flush on the current atomic level; Django drops it if that level rolls back."""
+        callback = partial(_flush_transaction, self)
+        # Only the on_commit queue holds the callback, so it dies with the registration
+        self._callback = weakref.ref(callback)
+        transaction.on_commit(callback)
+
+    def is_pending(self):
+        """True while the on_commit registration is queued (not rolled back, not yet run)."""
+        return self._callback is not None and self._callback() is not None
+
+    def messages(self):
+        from .models import Product
+        from .signals import get_product_data
+
+        needs_full = []
+        messages = []
+        for product_id, event in self.events.items():
+            changes = event['changes']
+            if event['action'] == 'deleted' or changes.get('is_active') is False:
+                messages.append({'type': 'product_delete', 'product_id': product_id})
+            elif event['action'] in ('created', 'full') or changes.get('is_active') is True:
+                needs_full.append(product_id)
+            elif changes:
+                messages.append({
+                    'type': 'product_update',
+                    'action': 'updated',
+                    'partial': True,
+                    'product': _diff_payload(product_id, changes),
+                })
+
+        if needs_full:
+            products = Product.objects.select_related('category').in_bulk(needs_full)
+            for product_id in needs_full:
+                product = products.get(product_id)
+                if product is None or not product.is_active:
+                    continue
+                messages.append({
+                    'type': 'product_update',
+                    'action': 'created' if self.events[product_id]['action'] == 'created' else 'updated',
+                    'product': get_product_data(product),
+                })
+        return messages
+
+    def send(self):
+        messages = self.messages()
+        self.events = {}
+        for message in messages:
+            broadcast(PRODUCTS_GROUP, message)
+
+
+def _level_key():
+    # savepoint=False blocks add None; they roll back only together with their parent
+    return tuple(sid for sid in connection.savepoint_ids if sid)
+
+
+def _level_buffer():
+    """The buffer of the current savepoint level, registering a new one if needed."""
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    key = _level_key()
+    buffer = buffers.get(key)
+    if buffer is None or not buffer.is_pending():
+        buffer = ProductEventBuffer()
+        buffer.register()
+        buffers[key] = buffer
+    return buffer
+
+
+def _flush_transaction(buffer):
+    """on_commit callback: send the merged events of every level that was committed."""
+    buffers = getattr(_local, 'buffers', {})
+    if not any(pending is buffer for pending in buffers.values()):
+        # Already sent by the callback of another level of this transaction
+        return
+    _local.buffers = {}
+    merged = ProductEventBuffer()
+    for pending in buffers.values():
+        # Buffers of rolled back savepoints lost their registration
+        if pending.is_pending():
+            merged.merge(pending)
+    merged.send()
+
+
+def queue_product_event(product_id, action='updated', changes=None):
+    """
+    Record a product change for broadcasting after commit.
+
+    `action` is 'created', 'updated', 'full' (send the whole product) or
+    'deleted'; `changes` maps broadcast fields to their new values.
+    """
+    if not connection.in_atomic_block:
+        buffer = ProductEventBuffer()
+        buffer.add(product_id, action, changes)
+        buffer.send()
+        return
+    _level_buffer().add(product_id, action, changes)
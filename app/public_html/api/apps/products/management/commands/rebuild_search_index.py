@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.products.models import Product, ProductSearchToken
+from apps.products.search import index_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search token index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per INSERT.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        products = Product.objects.select_related('category').order_by('id').iterator(chunk_size=500)
+
+        with transaction.atomic():
+            ProductSearchToken.objects.all().delete()
+            total = index_products(products, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {Product.objects.count()} products ({total} tokens).'
+        ))
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.11 on 2026-10-17 22:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_download_file_product_product_type_and_more'),
+    ]
+
+    # The index of existing products is filled by `manage.py rebuild_search_index`,
+    # not here, so this migration does not depend on the current tokenizer
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(db_index=True, max_length=64, verbose_name='توکن')),
+                ('weight', models.PositiveSmallIntegerField(default=1, verbose_name='وزن')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='products.product', verbose_name='محصول')),
+            ],
+            options={
+                'verbose_name': 'توکن جستجو',
+                'verbose_name_plural': 'توکن\u200cهای جستجو',
+                'unique_together': {('product', 'token')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.11 on 2026-10-17 22:48
+
+from django.db import migrations, models
+
+
+def store_download_file_sizes(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    for product in Product.objects.exclude(download_file='').exclude(download_file=None).iterator():
+        try:
+            size = product.download_file.size
+        except OSError:
+            continue
+        Product.objects.filter(pk=product.pk).update(download_file_size=size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_productsearchtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='download_file_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True, verbose_name='حجم فایل (بایت)'),
+        ),
+        migrations.RunPython(store_download_file_sizes, migrations.RunPython.noop),
+    ]
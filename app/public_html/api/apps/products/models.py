@@ -1,5 +1,7 @@
 import os
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 
@@ -19,6 +21,14 @@ class Category(models.Model):
         verbose_name_plural = _('دسته بندی ها')
 
     def __str__(self):
+        from .category_tree import get_category_tree
+        tree = get_category_tree()
+        if self.parent_id is None:
+            return self.name
+        if self.parent_id in tree.nodes:
+            # Parent path from the in-memory tree, own name from the instance
+            return ' > '.join(tree.path_names(self.parent_id) + [self.name])
+
         full_path = [self.name]
         k = self.parent
         while k is not None:
@@ -44,6 +54,8 @@ class Product(models.Model):
     product_type = models.CharField(_('نوع محصول'), max_length=20, choices=PRODUCT_TYPES, default='account')
     download_file = models.FileField(_('فایل دانلود'), upload_to='products/files/', null=True, blank=True, 
                                    help_text=_('فایل قابل دانلود برای مشتریان (فقط برای محصولات فایل)'))
+    # حجم فایل هنگام آپلود ذخیره می‌شود تا نمایش آن نیازی به دسترسی به فایل نداشته باشد
+    download_file_size = models.PositiveBigIntegerField(_('حجم فایل (بایت)'), null=True, blank=True, editable=False)
     
     price = models.PositiveIntegerField(_('قیمت اصلی (تومان)'))
     discount_price = models.PositiveIntegerField(_('قیمت با تخفیف'), null=True, blank=True)
@@ -64,6 +76,25 @@ class Product(models.Model):
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        from .events import snapshot
+
+        instance = super().from_db(db, field_names, values)
+        # مقادیر بارگذاری‌شده تا سیگنال فقط فیلدهای تغییرکرده را پخش کند
+        instance._broadcast_snapshot = snapshot(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self.download_file:
+            self.download_file_size = None
+        elif not self.download_file._committed or self.download_file_size is None:
+            try:
+                self.download_file_size = self.download_file.size
+            except OSError:
+                self.download_file_size = None
+        super().save(*args, **kwargs)
     
     @property
     def file_type(self):
@@ -78,7 +109,9 @@ class Product(models.Model):
         """Get file size in human readable format."""
         if self.download_file:
             try:
-                size = self.download_file.size
+                size = self.download_file_size
+                if size is None:
+                    size = self.download_file.size
                 for unit in ['B', 'KB', 'MB', 'GB']:
                     if size < 1024.0:
                         return f"{size:.1f} {unit}"
@@ -137,3 +170,39 @@ class ProductDownload(models.Model):
 
     def __str__(self):
         return f"{self.user} - {self.product.title} ({self.download_count} دانلود)"
+
+    @classmethod
+    def record(cls, user, product):
+        """
+        Count one download atomically.
+
+        The counter is bumped in the database with F(), so concurrent downloads
+        never overwrite each other; the row is only inserted on the first
+        download, and a racing insert falls back to the update.
+        """
+        now = timezone.now()
+        counters = {'download_count': F('download_count') + 1, 'last_download_at': now}
+        if cls.objects.filter(user=user, product=product).update(**counters):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    user=user, product=product, download_count=1,
+                    first_download_at=now, last_download_at=now,
+                )
+        except IntegrityError:
+            cls.objects.filter(user=user, product=product).update(**counters)
+
+class ProductSearchToken(models.Model):
+    """Normalized search token of a product (see apps.products.search)."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_tokens', verbose_name=_('محصول'))
+    token = models.CharField(_('توکن'), max_length=64, db_index=True)
+    weight = models.PositiveSmallIntegerField(_('وزن'), default=1)
+
+    class Meta:
+        verbose_name = _('توکن جستجو')
+        verbose_name_plural = _('توکن‌های جستجو')
+        unique_together = ('product', 'token')
+
+    def __str__(self):
+        return f"{self.token} ({self.product_id})"
@@ -0,0 +1,271 @@
+"""
+Product search index.
+
+Products are tokenized into ProductSearchToken rows (one row per product and
+normalized token) so search becomes an indexed prefix lookup on a narrow table
+instead of `icontains` scans over title, description and the category JOIN.
+The index is kept up to date from products.signals and can be rebuilt in bulk
+with `python manage.py rebuild_search_index`. The migration that creates the
+table leaves it empty, so run that command once after migrating a database
+that already has products, and again whenever tokenize() changes.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Q, Sum, When
+
+# Field weights used for ranking: a hit in the title beats one in the description
+TITLE_WEIGHT = 10
+CATEGORY_WEIGHT = 4
+DESCRIPTION_WEIGHT = 1
+
+# Limits that keep the index and the ranking query bounded
+MAX_TOKEN_LENGTH = 64
+MAX_DESCRIPTION_TOKENS = 200
+MAX_QUERY_TERMS = 5
+MAX_RESULTS = 200
+
+# Websocket search hits served from SearchResultCache
+SEARCH_HITS_LIMIT = 10
+SEARCH_CACHE_TTL = 60
+SEARCH_CACHE_SIZE = 512
+
+ZWNJ = '\u200c'
+
+# Arabic letters folded to their Persian forms, Persian/Arabic-Indic digits to ASCII
+_CHAR_MAP = str.maketrans({
+    'ي': 'ی',
+    'ى': 'ی',
+    'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    **{c: str(i) for i, c in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{c: str(i) for i, c in enumerate('٠١٢٣٤٥٦٧٨٩')},
+})
+
+# Diacritics (harakat) and tatweel carry no meaning for matching
+_STRIP_RE = re.compile('[\u064b-\u065f\u0670\u0640]')
+_WORD_RE = re.compile(r'[\w' + ZWNJ + r']+')
+
+
+def normalize_text(text):
+    """Fold Persian/Arabic variants, digits and case so equal words compare equal."""
+    if not text:
+        return ''
+    text = _STRIP_RE.sub('', str(text).translate(_CHAR_MAP))
+    return text.lower()
+
+
+def tokenize(text):
+    """
+    Split text into normalized tokens.
+
+    Words written with a zero-width non-joiner (e.g. «می‌شود») are indexed both
+    joined («میشود») and as their parts («می», «شود»), so every common way of
+    typing them matches.
+    """
+    tokens = []
+    for word in _WORD_RE.findall(normalize_text(text)):
+        parts = [part for part in word.split(ZWNJ) if part]
+        if not parts:
+            continue
+        if len(parts) > 1:
+            tokens.append(''.join(parts))
+        tokens.extend(parts)
+    return [token[:MAX_TOKEN_LENGTH] for token in tokens]
+
+
+def _unique(tokens, limit=None):
+    seen = dict.fromkeys(tokens)
+    result = list(seen)
+    return result[:limit] if limit else result
+
+
+def build_product_tokens(product):
+    """Return a {token: weight} mapping for a product."""
+    weights = {}
+
+    def add(tokens, weight):
+        for token in tokens:
+            weights[token] = weights.get(token, 0) + weight
+
+    add(_unique(tokenize(product.title)), TITLE_WEIGHT)
+    if product.category_id:
+        add(_unique(tokenize(product.category.name)), CATEGORY_WEIGHT)
+    add(_unique(tokenize(product.description), MAX_DESCRIPTION_TOKENS), DESCRIPTION_WEIGHT)
+    return weights
+
+
+def build_token_rows(product):
+    from .models import ProductSearchToken
+
+    return [
+        ProductSearchToken(product_id=product.id, token=token, weight=weight)
+        for token, weight in build_product_tokens(product).items()
+    ]
+
+
+def index_product(product):
+    """Replace the index rows of a single product."""
+    from .models import ProductSearchToken
+
+    rows = build_token_rows(product)
+    with transaction.atomic():
+        ProductSearchToken.objects.filter(product_id=product.id).delete()
+        ProductSearchToken.objects.bulk_create(rows)
+
+
+def index_products(products, batch_size=1000):
+    """Index an iterable of products, writing rows in batches. Returns the row count."""
+    from .models import ProductSearchToken
+
+    rows = []
+    total = 0
+    for product in products:
+        rows.extend(build_token_rows(product))
+        if len(rows) >= batch_size:
+            ProductSearchToken.objects.bulk_create(rows, batch_size=batch_size)
+            total += len(rows)
+            rows = []
+    if rows:
+        ProductSearchToken.objects.bulk_create(rows, batch_size=batch_size)
+        total += len(rows)
+    return total
+
+
+def rank_product_ids(query, limit=MAX_RESULTS, products=None):
+    """
+    Return product IDs matching every query term as a prefix, best first.
+
+    Runs a single grouped query over the token table; it relies only on
+    `LIKE 'term%'`, so it behaves the same on MySQL and SQLite. `products`
+    (a Product queryset) restricts the candidates before the `limit` cut, so
+    inactive or filtered-out products cannot take the slots of valid hits.
+    """
+    from .models import ProductSearchToken
+
+    terms = _unique(tokenize(query), MAX_QUERY_TERMS)
+    if not terms:
+        return []
+
+    # Each term must hit at least one token of the product
+    matched = {
+        f'term_{i}': Max(Case(When(token__startswith=term, then=1), default=0, output_field=IntegerField()))
+        for i, term in enumerate(terms)
+    }
+    # Whole-word hits score double compared to prefix-only hits
+    score = Sum(Case(
+        When(token__in=terms, then=F('weight') * 2),
+        default=F('weight'),
+        output_field=IntegerField(),
+    ))
+
+    tokens = ProductSearchToken.objects.filter(reduce(or_, (Q(token__startswith=term) for term in terms)))
+    if products is not None:
+        tokens = tokens.filter(product__in=products.order_by().values('pk'))
+    rows = (
+        tokens
+        .values('product_id')
+        .annotate(score=score, **matched)
+        .filter(**{name: 1 for name in matched})
+        .order_by('-score', '-product_id')
+        .values_list('product_id', flat=True)[:limit]
+    )
+    return list(rows)
+
+
+def search_products(query, queryset):
+    """Filter `queryset` to products matching `query`, ordered by relevance."""
+    ids = rank_product_ids(query, products=queryset)
+    if not ids:
+        return queryset.none()
+    ranking = Case(*[When(id=pk, then=pos) for pos, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(id__in=ids).order_by(ranking)
+
+
+def search_hits(query, limit=SEARCH_HITS_LIMIT):
+    """
+    Return slim search-hit dicts for the live search box.
+
+    Reads only the columns the dropdown renders (one query with the category
+    JOIN) instead of running the full ProductSerializer per result.
+    """
+    from .models import Product
+
+    queryset = search_products(query, Product.objects.filter(is_active=True))
+    rows = queryset.values(
+        'id', 'title', 'slug', 'price', 'discount_price', 'main_image',
+        'category__name', 'category__slug',
+    )[:limit]
+    return [
+        {
+            'id': row['id'],
+            'title': row['title'],
+            'slug': row['slug'],
+            'price': row['price'],
+            'discount_price': row['discount_price'],
+            'main_image': default_storage.url(row['main_image']) if row['main_image'] else None,
+            'category_name': row['category__name'],
+            'category_slug': row['category__slug'],
+        }
+        for row in rows
+    ]
+
+
+def normalize_query(query):
+    """Cache key for a query: normalized text with collapsed whitespace."""
+    return ' '.join(normalize_text(query).split())
+
+
+class SearchResultCache:
+    """
+    Process-wide LRU cache of search hits with a TTL.
+
+    Shared by every SearchConsumer (they run on different threads through
+    database_sync_to_async, hence the lock) and cleared by products.signals
+    whenever a product or category changes.
+    """
+
+    def __init__(self, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, query, value):
+        key = normalize_query(query)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+search_cache = SearchResultCache()
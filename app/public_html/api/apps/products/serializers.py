@@ -5,6 +5,37 @@ from django.db.models import Q
 
 User = get_user_model()
 
+
+def visible_comments_filter(user):
+    """Return the Q filter for comments the given user is allowed to see."""
+    if user and user.is_authenticated:
+        if user.is_staff:
+            return Q()
+        return Q(is_approved=True) | Q(user=user)
+    return Q(is_approved=True)
+
+
+def build_comment_tree(comments):
+    """
+    Attach prefetched replies to their parents in memory.
+
+    Returns the root comments in their original order; every comment gets a
+    `_visible_replies` list ordered oldest first, which CommentSerializer uses
+    instead of querying `replies` again.
+    """
+    children = {}
+    for comment in comments:
+        comment._visible_replies = []
+        if comment.parent_id is not None:
+            children.setdefault(comment.parent_id, []).append(comment)
+
+    roots = []
+    for comment in comments:
+        if comment.parent_id is None:
+            roots.append(comment)
+        comment._visible_replies = sorted(children.get(comment.id, []), key=lambda c: (c.created_at, c.id))
+    return roots
+
 class CategorySerializer(serializers.ModelSerializer):
     """Serializer for Category model with nested children for mega menu."""
     children = serializers.SerializerMethodField()
@@ -16,9 +47,13 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'icon', 'parent', 'parent_name', 'children', 'is_active']
 
     def get_children(self, obj):
-        # Return children only if requested or limit depth
-        children = obj.children.all()
-        return CategorySerializer(children, many=True, context=self.context).data
+        # Served from the materialized tree instead of one query per node
+        from .category_tree import get_category_tree
+        tree = get_category_tree()
+        if obj.id not in tree.nodes:
+            return []
+        request = self.context.get('request')
+        return [tree.serialize(child_id, request) for child_id in tree.children[obj.id]]
 
     def to_internal_value(self, data):
         # Convert to mutable if it's a QueryDict
@@ -68,6 +103,11 @@ class CommentSerializer(serializers.ModelSerializer):
         return jalali_full_date(obj.created_at)
 
     def get_replies(self, obj):
+        # Replies already resolved by build_comment_tree (listing path)
+        prefetched = getattr(obj, '_visible_replies', None)
+        if prefetched is not None:
+            return CommentSerializer(prefetched, many=True, context=self.context).data
+
         request = self.context.get('request')
         user = request.user if request else None
         
@@ -86,6 +126,32 @@ class CommentSerializer(serializers.ModelSerializer):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
+class UserProductIdsMixin:
+    """Per-request sets of product IDs (favorites, purchases) shared by product serializers."""
+
+    def _get_request_user(self):
+        request = self.context.get('request')
+        return request.user if request else None
+
+    def _get_user_product_ids(self, key, loader):
+        """
+        Load a set of product IDs for the requesting user once per serializer
+        run. The set is memoized in the shared context, so a `many=True`
+        listing costs a single query instead of one per product.
+        """
+        if key not in self.context:
+            user = self._get_request_user()
+            self.context[key] = set(loader(user)) if user and user.is_authenticated else set()
+        return self.context[key]
+
+    def get_is_favorite(self, obj):
+        favorite_ids = self._get_user_product_ids(
+            'favorite_product_ids',
+            lambda user: Favorite.objects.filter(user=user).values_list('product_id', flat=True)
+        )
+        return obj.id in favorite_ids
+
+
 class FavoriteSerializer(serializers.ModelSerializer):
     """Serializer for user favorites."""
     product_details = serializers.SerializerMethodField()
@@ -109,7 +175,7 @@ class FavoriteSerializer(serializers.ModelSerializer):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(UserProductIdsMixin, serializers.ModelSerializer):
     """Serializer for Product model with category details and approved comments."""
     category = serializers.SerializerMethodField()
     category_slug = serializers.CharField(source='category.slug', read_only=True)
@@ -144,39 +210,42 @@ class ProductSerializer(serializers.ModelSerializer):
         return None
 
     def get_comments(self, obj):
+        # Comments prefetched by ProductViewSet (visible ones only, replies included)
+        prefetched = getattr(obj, 'visible_comments', None)
+        if prefetched is not None:
+            roots = build_comment_tree(prefetched)
+            return CommentSerializer(roots, many=True, context=self.context).data
+
         request = self.context.get('request')
         user = request.user if request else None
-        
-        # Determine which comments to show
-        if user and user.is_authenticated:
-            if user.is_staff:
-                comments = obj.comments.filter(parent__isnull=True)
-            else:
-                comments = obj.comments.filter(Q(is_approved=True) | Q(user=user), parent__isnull=True)
-        else:
-            comments = obj.comments.filter(is_approved=True, parent__isnull=True)
-            
+        comments = obj.comments.filter(visible_comments_filter(user), parent__isnull=True)
         return CommentSerializer(comments, many=True, context=self.context).data
 
-    def get_is_favorite(self, obj):
-        user = self.context.get('request').user if 'request' in self.context else None
-        if user and user.is_authenticated:
-            return Favorite.objects.filter(user=user, product=obj).exists()
-        return False
-    
     def get_can_download(self, obj):
         """Check if user can download this product file."""
-        user = self.context.get('request').user if 'request' in self.context else None
-        if not user or not user.is_authenticated or obj.product_type != 'file' or not obj.download_file:
+        if obj.product_type != 'file' or not obj.download_file:
             return False
-        
-        # Check if user has purchased this product
-        from apps.orders.models import Order, OrderItem
-        return OrderItem.objects.filter(
-            order__user=user,
-            order__status__in=[Order.Status.PAID, Order.Status.SENT],
-            product=obj
-        ).exists()
+
+        # Check if user has purchased this product (cached per user)
+        from apps.orders.entitlements import get_purchased_product_ids
+        purchased_ids = self._get_user_product_ids('purchased_product_ids', get_purchased_product_ids)
+        return obj.id in purchased_ids
+
+
+class ProductListSerializer(UserProductIdsMixin, serializers.ModelSerializer):
+    """Compact product card used for listings; full details come from ProductSerializer."""
+    category_slug = serializers.CharField(source='category.slug', read_only=True)
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    file_type = serializers.ReadOnlyField()
+    is_favorite = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'title', 'slug', 'price', 'discount_price', 'main_image',
+            'category_slug', 'category_name', 'stock', 'is_active',
+            'product_type', 'file_type', 'is_favorite'
+        ]
 
 
 class UpdateProductSerializer(serializers.ModelSerializer):
@@ -1,21 +1,27 @@
 from django.db.models.signals import post_save, post_delete
+from django.db import transaction
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Product
+from django.core.files.storage import default_storage
+from .models import Product, Category
+from .events import changed_fields, queue_product_event, snapshot
+from .search import index_product, index_products, search_cache
+from .category_tree import invalidate_category_tree
 
-def get_product_data(product):
+def image_url(image):
     from django.conf import settings
     
     # ساخت URL کامل برای تصویر
-    main_image_url = None
-    if product.main_image:
-        if product.main_image.url.startswith('http'):
-            main_image_url = product.main_image.url
-        else:
-            # اضافه کردن domain برای URL کامل
-            domain = getattr(settings, 'SITE_DOMAIN', 'http://localhost:8000')
-            main_image_url = f"{domain}{product.main_image.url}"
+    if not image:
+        return None
+    url = image.url if hasattr(image, 'url') else default_storage.url(image)
+    if url.startswith('http'):
+        return url
+    # اضافه کردن domain برای URL کامل
+    domain = getattr(settings, 'SITE_DOMAIN', 'http://localhost:8000')
+    return f"{domain}{url}"
+
+def get_product_data(product):
+    main_image_url = image_url(product.main_image)
     
     return {
         'id': product.id,
@@ -36,39 +42,47 @@ def get_product_data(product):
     }
 
 @receiver(post_save, sender=Product)
-def product_saved(sender, instance, created, **kwargs):
-    channel_layer = get_channel_layer()
-    
-    # اگر محصول غیرفعال شد، به همه اطلاع بده که حذفش کنند (برای کاربران عادی)
-    if not instance.is_active:
-        async_to_sync(channel_layer.group_send)(
-            'products',
-            {
-                'type': 'product_delete',
-                'product_id': instance.id
-            }
-        )
+def product_search_index_saved(sender, instance, raw=False, **kwargs):
+    # Index rows are removed by the FK cascade when a product is deleted
+    if raw:
         return
+    index_product(instance)
+    search_cache.clear()
 
-    action = 'created' if created else 'updated'
-    
-    async_to_sync(channel_layer.group_send)(
-        'products',
-        {
-            'type': 'product_update',
-            'action': action,
-            'product': get_product_data(instance)
-        }
-    )
+@receiver(post_delete, sender=Product)
+def product_search_cache_deleted(sender, instance, **kwargs):
+    search_cache.clear()
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_tree_changed(sender, **kwargs):
+    # After commit, so a rolled back change never lands in the cached tree
+    transaction.on_commit(invalidate_category_tree)
+
+@receiver(post_save, sender=Category)
+def category_search_index_saved(sender, instance, created, raw=False, **kwargs):
+    # Category names are indexed on their products; re-index after a rename
+    if created or raw:
+        return
+    from .models import ProductSearchToken
+    products = Product.objects.filter(category=instance).select_related('category')
+    ProductSearchToken.objects.filter(product__category=instance).delete()
+    index_products(products)
+    search_cache.clear()
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    # یک پیام برای هر محصول، پس از commit و فقط با فیلدهای تغییرکرده
+    if created:
+        queue_product_event(instance.id, 'created')
+    else:
+        changes = changed_fields(instance)
+        if changes:
+            queue_product_event(instance.id, 'updated', changes)
+    instance._broadcast_snapshot = snapshot(instance)
 
 @receiver(post_delete, sender=Product)
 def product_deleted(sender, instance, **kwargs):
-    channel_layer = get_channel_layer()
-    
-    async_to_sync(channel_layer.group_send)(
-        'products',
-        {
-            'type': 'product_delete',
-            'product_id': instance.id
-        }
-    )
+    queue_product_event(instance.id, 'deleted')
@@ -1,3 +1,459 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.core.files.base import ContentFile
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from apps.orders.models import Order, OrderItem
+from .consumers import SearchConsumer
+from .models import Category, Product, Comment, Favorite, ProductDownload
+from .search import rank_product_ids, search_cache, search_hits
+from .category_tree import get_category_tree, invalidate_category_tree
+from . import events
+
+User = get_user_model()
+
+
+class ProductListingTests(APITestCase):
+    """Product listing and detail must not issue per-row queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(mobile='09120000001', password='pass')
+        cls.other = User.objects.create_user(mobile='09120000002', password='pass')
+        cls.category = Category.objects.create(name='هوش مصنوعی', slug='ai')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_products(self, count):
+        order = Order.objects.create(user=self.user, status=Order.Status.PAID)
+        for i in range(count):
+            product = Product.objects.create(
+                category=self.category,
+                title=f'محصول {i}',
+                slug=f'product-{self.category.id}-{Product.objects.count()}',
+                description='توضیحات',
+                price=1000,
+                main_image='products/test.png',
+                product_type='file',
+                download_file='products/files/test.zip',
+            )
+            root = Comment.objects.create(product=product, user=self.other, content='نظر', is_approved=True)
+            Comment.objects.create(product=product, user=self.user, content='پاسخ', parent=root, is_approved=True)
+            Comment.objects.create(product=product, user=self.other, content='در انتظار', is_approved=False)
+            Favorite.objects.create(user=self.user, product=product)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=1000)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.data
+
+    def test_list_query_count_is_constant(self):
+        self.client.force_authenticate(self.user)
+        self.create_products(10)
+
+        small_count, small_data = self.count_queries('/api/products/?page_size=2')
+        large_count, large_data = self.count_queries('/api/products/?page_size=10')
+
+        self.assertEqual(len(small_data['results']), 2)
+        self.assertEqual(len(large_data['results']), 10)
+        self.assertEqual(small_count, large_count)
+        # products (+category JOIN) and the user's favorite IDs
+        self.assertEqual(large_count, 2)
+
+    def test_list_cursor_walks_every_product_once(self):
+        self.create_products(5)
+
+        seen = []
+        url = '/api/products/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(sorted(seen), sorted(Product.objects.values_list('id', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_list_cards_carry_favorite_and_category_name(self):
+        self.client.force_authenticate(self.user)
+        self.create_products(2)
+
+        response = self.client.get('/api/products/', {'page_size': 2})
+
+        cards = response.data['results']
+        self.assertTrue(all(card['is_favorite'] for card in cards))
+        self.assertTrue(all(card['category_name'] == self.category.name for card in cards))
+
+    def test_list_without_page_params_returns_every_product(self):
+        self.create_products(25)
+
+        response = self.client.get('/api/products/')
+
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 25)
+
+    def test_retrieve_payload_uses_prefetched_data(self):
+        self.client.force_authenticate(self.user)
+        self.create_products(1)
+        slug = Product.objects.get().slug
+
+        query_count, product = self.count_queries(f'/api/products/{slug}/')
+
+        self.assertTrue(product['is_favorite'])
+        self.assertTrue(product['can_download'])
+        self.assertEqual(product['category']['slug'], 'ai')
+        # Unapproved comment of another user is hidden, the reply is nested
+        self.assertEqual(len(product['comments']), 1)
+        self.assertEqual(len(product['comments'][0]['replies']), 1)
+        # product (+category JOIN), visible comments, favorite IDs, purchased IDs
+        self.assertEqual(query_count, 4)
+
+
+class ProductSearchIndexTests(APITestCase):
+    """Token index search with Persian normalization and ranking."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='هوش مصنوعی', slug='ai')
+        cls.in_title = cls.create_product('اکانت کاربردی ChatGPT', 'chatgpt', 'توضیحات')
+        cls.in_description = cls.create_product('اشتراک ویژه', 'special', 'همراه با ChatGPT و کتاب')
+        cls.inactive = cls.create_product('ChatGPT قدیمی', 'old', 'توضیحات', is_active=False)
+
+    @classmethod
+    def create_product(cls, title, slug, description, is_active=True):
+        return Product.objects.create(
+            category=cls.category, title=title, slug=slug, description=description,
+            price=1000, main_image='products/test.png', is_active=is_active,
+        )
+
+    def search(self, query):
+        response = self.client.get('/api/products/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data]
+
+    def test_prefix_match_ranks_title_first(self):
+        self.assertEqual(self.search('chat'), [self.in_title.id, self.in_description.id])
+
+    def test_arabic_letters_and_zwnj_are_folded(self):
+        # Arabic Kaf/Yeh and a missing ZWNJ still match «کاربردی» and «کتاب»
+        self.assertEqual(self.search('كاربردي'), [self.in_title.id])
+        self.assertEqual(self.search('كتاب'), [self.in_description.id])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search('اشتراک chat'), [self.in_description.id])
+        self.assertEqual(self.search('اشتراک ناموجود'), [])
+
+    def test_result_cap_applies_after_visibility_filter(self):
+        # The inactive product ranks first on its own and would take the only slot
+        self.assertEqual(rank_product_ids('chatgpt', limit=1), [self.inactive.id])
+        visible = Product.objects.filter(is_active=True)
+        self.assertEqual(rank_product_ids('chatgpt', limit=1, products=visible), [self.in_title.id])
+
+    def test_search_pages_follow_next(self):
+        url = '/api/products/?search=chat&page_size=1'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [self.in_title.id, self.in_description.id])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_category_rename_reindexes_products(self):
+        self.category.name = 'نرم‌افزار'
+        self.category.save()
+        self.assertEqual(sorted(self.search('نرم')), sorted([self.in_title.id, self.in_description.id]))
+
+    def test_index_follows_product_updates(self):
+        self.in_description.description = 'بدون کلمه کلیدی'
+        self.in_description.save()
+        self.assertEqual(self.search('chat'), [self.in_title.id])
+
+
+class SearchConsumerTests(TransactionTestCase):
+    """Websocket search: slim hits, shared cache and superseded queries."""
+
+    def setUp(self):
+        search_cache.clear()
+        category = Category.objects.create(name='هوش مصنوعی', slug='ai')
+        self.product = Product.objects.create(
+            category=category, title='اکانت ChatGPT', slug='chatgpt', description='توضیحات',
+            price=1000, main_image='products/test.png',
+        )
+
+    def test_search_hits_are_slim(self):
+        hit, = search_hits('chat')
+        self.assertEqual(set(hit), {
+            'id', 'title', 'slug', 'price', 'discount_price', 'main_image',
+            'category_name', 'category_slug',
+        })
+        self.assertEqual(hit['main_image'], '/media/products/test.png')
+
+    def test_product_save_invalidates_cache(self):
+        search_cache.set('chat', ['stale'])
+        self.product.save()
+        self.assertIsNone(search_cache.get('chat'))
+
+    def test_only_latest_query_is_answered(self):
+        async def run():
+            communicator = WebsocketCommunicator(SearchConsumer.as_asgi(), '/ws/search/')
+            await communicator.connect()
+            await communicator.send_json_to({'query': 'zzz'})
+            await communicator.send_json_to({'query': 'chat'})
+            response = await communicator.receive_json_from(timeout=5)
+            self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+            await communicator.disconnect()
+            return response
+
+        response = async_to_sync(run)()
+        self.assertEqual(response['query'], 'chat')
+        self.assertEqual([hit['id'] for hit in response['results']], [self.product.id])
+        self.assertIsNotNone(search_cache.get('CHAT'))
+
+
+class CategoryTreeTests(APITestCase):
+    """Category menu and filtering served from the materialized tree."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name='نرم‌افزار', slug='software')
+        cls.child = Category.objects.create(name='هوش مصنوعی', slug='ai', parent=cls.root)
+        cls.grandchild = Category.objects.create(name='چت‌بات', slug='chatbots', parent=cls.child)
+        cls.other = Category.objects.create(name='بازی', slug='games')
+        cls.products = {
+            category.slug: Product.objects.create(
+                category=category, title=category.name, slug=f'p-{category.slug}',
+                description='توضیحات', price=1000, main_image='products/test.png',
+            )
+            for category in (cls.root, cls.child, cls.grandchild, cls.other)
+        }
+
+    def setUp(self):
+        # setUpTestData never commits, so its on_commit invalidation never runs
+        invalidate_category_tree()
+
+    def test_filter_covers_all_descendant_levels(self):
+        response = self.client.get('/api/products/', {'category': 'software'})
+        ids = {item['id'] for item in response.data}
+        expected = {self.products[slug].id for slug in ('software', 'ai', 'chatbots')}
+        self.assertEqual(ids, expected)
+
+    def test_menu_is_served_from_memory(self):
+        get_category_tree()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/categories/')
+
+        software = next(item for item in response.data if item['slug'] == 'software')
+        self.assertEqual(software['children'][0]['slug'], 'ai')
+        self.assertEqual(software['children'][0]['children'][0]['slug'], 'chatbots')
+        self.assertEqual(software['children'][0]['parent_name'], 'نرم‌افزار')
+
+    def test_str_uses_cached_ancestors(self):
+        get_category_tree()
+        grandchild = Category.objects.get(pk=self.grandchild.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(grandchild), 'نرم‌افزار > هوش مصنوعی > چت‌بات')
+
+    def test_save_invalidates_tree_on_commit(self):
+        get_category_tree()
+        self.child.name = 'AI'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.child.save()
+        self.assertEqual(get_category_tree().path_names(self.grandchild.id), ['نرم‌افزار', 'AI', 'چت‌بات'])
+
+    def test_tree_expires_without_a_shared_version_bump(self):
+        # Another worker's save does not reach this process's LocMem cache
+        tree = get_category_tree()
+        Category.objects.filter(pk=self.child.pk).update(name='AI')
+        self.assertIs(get_category_tree(), tree)
+        with override_settings(CATEGORY_TREE_TTL=0):
+            self.assertEqual(get_category_tree().path_names(self.grandchild.id), ['نرم‌افزار', 'AI', 'چت‌بات'])
+
+
+class ProductDownloadTests(APITestCase):
+    """Streaming, range and sendfile handling of purchased product files."""
+
+    content = b'0123456789' * 1000
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(mobile='09120000003', password='pass')
+        category = Category.objects.create(name='فایل', slug='files')
+        self.product = Product.objects.create(
+            category=category, title='کتاب', slug='book', description='توضیحات',
+            price=1000, main_image='products/test.png', product_type='file',
+        )
+        self.product.download_file.save('book.pdf', ContentFile(self.content))
+        order = Order.objects.create(user=self.user, status=Order.Status.PAID)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=1000)
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/products/{self.product.slug}/download/'
+
+    def test_full_download_is_streamed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(ProductDownload.objects.get().download_count, 1)
+
+    def test_range_request_returns_partial_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        # Resuming does not count as a new download
+        self.assertFalse(ProductDownload.objects.exists())
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(PRODUCT_DOWNLOAD_SENDFILE='x-accel-redirect', PRODUCT_DOWNLOAD_ACCEL_PREFIX='/protected/')
+    def test_x_accel_redirect_mode(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.product.download_file.name}')
+        self.assertEqual(response.content, b'')
+
+    def test_requires_purchase(self):
+        self.client.force_authenticate(User.objects.create_user(mobile='09120000004', password='pass'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+
+class ProductEventTests(APITestCase):
+    """Product broadcasts are coalesced per transaction and sent as diffs."""
+
+    def setUp(self):
+        invalidate_category_tree()
+        # Flush the fixture's own events before recording
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(name='ابزار', slug='tools')
+            self.product = Product.objects.create(
+                category=self.category, title='ابزار', slug='tool', description='-',
+                price=1000, main_image='products/test.png',
+            )
+        patcher = mock.patch.object(events, 'broadcast')
+        self.broadcast = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent(self):
+        return [call.args[1] for call in self.broadcast.call_args_list]
+
+    def test_repeated_saves_send_one_diff(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 900
+            product.save()
+            product.stock = 4
+            product.save()
+            product.price = 800
+            product.save()
+
+        self.assertEqual(self.sent(), [{
+            'type': 'product_update',
+            'action': 'updated',
+            'partial': True,
+            'product': {'id': product.id, 'is_active': True, 'price': 800, 'stock': 4},
+        }])
+
+    def test_unchanged_save_sends_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(pk=self.product.pk).save()
+        self.assertEqual(self.sent(), [])
+
+    def test_created_and_deactivated_products(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            created = Product.objects.create(
+                category=self.category, title='جدید', slug='new', description='-',
+                price=500, main_image='products/test.png',
+            )
+            created.title = 'جدیدتر'
+            created.save()
+            self.product.is_active = False
+            self.product.save()
+
+        messages = {message['type']: message for message in self.sent()}
+        self.assertEqual(len(self.sent()), 2)
+        self.assertEqual(messages['product_delete']['product_id'], self.product.id)
+        update = messages['product_update']
+        self.assertEqual(update['action'], 'created')
+        self.assertEqual(update['product']['title'], 'جدیدتر')
+        self.assertEqual(update['product']['category']['slug'], 'tools')
+
+    def test_rolled_back_savepoint_after_outer_events_is_dropped(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.stock = 3
+            product.save()
+            try:
+                with transaction.atomic():
+                    inner = Product.objects.get(pk=product.pk)
+                    inner.price = 1
+                    inner.save()
+                    raise ValueError
+            except ValueError:
+                pass
+            with transaction.atomic():
+                product.title = 'ابزار ویژه'
+                product.save()
+
+        self.assertEqual(self.sent(), [{
+            'type': 'product_update',
+            'action': 'updated',
+            'partial': True,
+            'product': {'id': product.id, 'is_active': True, 'stock': 3, 'title': 'ابزار ویژه'},
+        }])
+
+    def test_rolled_back_changes_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.product.price = 1
+                    self.product.save()
+                    raise ValueError
+            except ValueError:
+                pass
+            product = Product.objects.get(pk=self.product.pk)
+            product.stock = 7
+            product.save()
+
+        self.assertEqual(self.sent(), [{
+            'type': 'product_update',
+            'action': 'updated',
+            'partial': True,
+            'product': {'id': product.id, 'is_active': True, 'stock': 7},
+        }])
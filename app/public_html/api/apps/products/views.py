@@ -1,15 +1,44 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Q, ProtectedError
-from django.http import HttpResponse, Http404
-from django.utils import timezone
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.db.models import Q, Prefetch, ProtectedError
+from django.http import Http404
 from .models import Product, Category, Comment, Favorite, ProductDownload
+from .search import search_products
+from .category_tree import get_category_tree
+from .downloads import serve_file
+from apps.orders.entitlements import has_purchased
 from .serializers import (
-    ProductSerializer, CategorySerializer, CreateProductSerializer, 
-    UpdateProductSerializer, CommentSerializer, FavoriteSerializer
+    ProductSerializer, ProductListSerializer, CategorySerializer, CreateProductSerializer, 
+    UpdateProductSerializer, CommentSerializer, FavoriteSerializer,
+    visible_comments_filter
 )
 
+# Query parameter that pages through ranked search results
+SEARCH_OFFSET_PARAM = 'offset'
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (created_at, id): each page is a range scan that
+    starts after the previous cursor, so deep pages cost the same as page one.
+    The storefront lists request `page_size` and follow `next`; it is only
+    applied when `cursor` or `page_size` is requested, so the admin table,
+    which expects a plain list, keeps getting every product.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        if self.cursor_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().get_page_size(request)
+
+
 class ProductViewSet(viewsets.ModelViewSet):
     """
     مدیریت کامل محصولات.
@@ -17,6 +46,7 @@ class ProductViewSet(viewsets.ModelViewSet):
     ادمین می‌تواند اضافه، ویرایش و حذف کند (POST, PATCH, DELETE).
     """
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
     lookup_field = 'slug'
     
     def get_object(self):
@@ -40,6 +70,8 @@ class ProductViewSet(viewsets.ModelViewSet):
             return CreateProductSerializer
         if self.action in ['update', 'partial_update']:
             return UpdateProductSerializer
+        if self.action in ['list', 'latest', 'hero_products']:
+            return ProductListSerializer
         return ProductSerializer
     
     def get_permissions(self):
@@ -47,39 +79,85 @@ class ProductViewSet(viewsets.ModelViewSet):
             return [permissions.AllowAny()]
         return [permissions.IsAdminUser()]
 
+    def with_listing_relations(self, queryset):
+        """
+        Attach everything ProductSerializer reads: the category via a JOIN
+        and the visible comments (roots and replies) in one prefetch.
+        """
+        comments = Comment.objects.filter(
+            visible_comments_filter(self.request.user)
+        ).select_related('user')
+        return queryset.select_related('category').prefetch_related(
+            Prefetch('comments', queryset=comments, to_attr='visible_comments')
+        )
+
     def get_queryset(self):
         if self.request.user.is_authenticated and self.request.user.is_staff:
             queryset = Product.objects.all()
         else:
             queryset = Product.objects.filter(is_active=True)
 
+        if self.action == 'retrieve':
+            queryset = self.with_listing_relations(queryset)
+        else:
+            queryset = queryset.select_related('category')
+
         category_slug = self.request.query_params.get('category')
         if category_slug:
-            try:
-                category = Category.objects.get(slug=category_slug)
-                children = category.children.all()
-                all_categories = [category] + list(children)
-                queryset = queryset.filter(category__in=all_categories)
-            except Category.DoesNotExist:
+            # The category and every sub-category below it, in one IN filter
+            tree = get_category_tree()
+            category_id = tree.id_for_slug(category_slug)
+            if category_id is None:
                 return queryset.none()
+            queryset = queryset.filter(category_id__in=tree.descendant_ids(category_id))
         
         search_query = self.request.query_params.get('search')
         if search_query:
-            queryset = queryset.filter(
-                Q(title__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(category__name__icontains=search_query)
-            )
+            # Ranked by relevance, see apps.products.search
+            return search_products(search_query, queryset)
         
         return queryset.order_by('-created_at')
 
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('search'):
+            return super().list(request, *args, **kwargs)
+
+        # Search results keep their relevance order, so they are paged by
+        # offset into the (MAX_RESULTS bounded) ranking instead of a cursor.
+        queryset = self.filter_queryset(self.get_queryset())
+        page_size = self.paginator.get_page_size(request)
+        if page_size is None:
+            return Response(self.get_serializer(queryset, many=True).data)
+
+        try:
+            offset = max(int(request.query_params.get(SEARCH_OFFSET_PARAM, 0)), 0)
+        except ValueError:
+            offset = 0
+        # One extra row tells whether there is a next page
+        products = list(queryset[offset:offset + page_size + 1])
+        url = request.build_absolute_uri()
+        next_url = None
+        if len(products) > page_size:
+            next_url = replace_query_param(url, SEARCH_OFFSET_PARAM, offset + page_size)
+        previous_url = None
+        if offset:
+            previous_offset = max(offset - page_size, 0)
+            previous_url = (
+                replace_query_param(url, SEARCH_OFFSET_PARAM, previous_offset) if previous_offset
+                else remove_query_param(url, SEARCH_OFFSET_PARAM)
+            )
+        serializer = self.get_serializer(products[:page_size], many=True)
+        return Response({'next': next_url, 'previous': previous_url, 'results': serializer.data})
+
     @action(detail=False, methods=['get'])
     def hero_products(self, request):
         """Fetch 5 latest products marked for hero slider."""
-        products = Product.objects.filter(is_active=True, show_in_hero=True).order_by('-created_at')[:5]
-        if not products.exists():
+        products = Product.objects.filter(
+            is_active=True, show_in_hero=True
+        ).select_related('category').order_by('-created_at')[:5]
+        if not products:
             # Fallback to latest 5 products if none marked for hero
-            products = Product.objects.filter(is_active=True).order_by('-created_at')[:5]
+            products = Product.objects.filter(is_active=True).select_related('category').order_by('-created_at')[:5]
         
         serializer = self.get_serializer(products, many=True)
         return Response(serializer.data)
@@ -87,7 +165,7 @@ class ProductViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def latest(self, request):
         """Fetch 5 latest products."""
-        products = Product.objects.filter(is_active=True).order_by('-created_at')[:5]
+        products = Product.objects.filter(is_active=True).select_related('category').order_by('-created_at')[:5]
         serializer = self.get_serializer(products, many=True)
         return Response(serializer.data)
 
@@ -101,33 +179,17 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({'error': 'این محصول فایل قابل دانلود ندارد.'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Check if user has purchased this product
-        from apps.orders.models import Order, OrderItem
-        has_purchased = OrderItem.objects.filter(
-            order__user=request.user,
-            order__status__in=[Order.Status.PAID, Order.Status.SENT],
-            product=product
-        ).exists()
-        
-        if not has_purchased:
+        if not has_purchased(request.user, product.id):
             return Response({'error': 'شما این محصول را خریداری نکرده‌اید.'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Track download
-        download_record, created = ProductDownload.objects.get_or_create(
-            user=request.user,
-            product=product,
-            defaults={'first_download_at': timezone.now()}
-        )
-        
-        download_record.download_count += 1
-        download_record.last_download_at = timezone.now()
-        download_record.save()
+        # Track download (resumed ranges of the same download are not counted again)
+        if 'HTTP_RANGE' not in request.META:
+            ProductDownload.record(request.user, product)
         
-        # Serve file
+        # Serve file (streamed, range-capable, or handed off to the web server)
         try:
-            response = HttpResponse(product.download_file.read(), content_type='application/octet-stream')
-            response['Content-Disposition'] = f'attachment; filename="{product.download_file.name.split("/")[-1]}"'
-            return response
-        except Exception as e:
+            return serve_file(request, product.download_file)
+        except OSError:
             return Response({'error': 'خطا در دانلود فایل.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def destroy(self, request, *args, **kwargs):
@@ -161,6 +223,16 @@ class CategoryViewSet(viewsets.ModelViewSet):
             return [permissions.AllowAny()]
         return [permissions.IsAdminUser()]
 
+    def list(self, request, *args, **kwargs):
+        """Mega menu / admin list, served from the in-memory category tree."""
+        tree = get_category_tree()
+        is_staff = request.user.is_authenticated and request.user.is_staff
+        if is_staff and request.query_params.get('flat') == 'true':
+            category_ids = list(tree.nodes)
+        else:
+            category_ids = tree.root_ids(active_only=not is_staff)
+        return Response([tree.serialize(category_id, request) for category_id in category_ids])
+
 class CommentViewSet(viewsets.ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
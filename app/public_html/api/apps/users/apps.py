@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.users'
-    label = 'users'  # <--- این خط خیلی مهم است
\ No newline at end of file
+    label = 'users'  # <--- این خط خیلی مهم است
+
+    def ready(self):
+        import apps.users.signals
@@ -0,0 +1,205 @@
+"""
+Shared, non-blocking websocket broadcast dispatcher.
+
+Signal receivers and the send_* helpers in apps.users.utils call
+`broadcast(group, message)`, which only enqueues the message and never waits
+for the channel layer. A daemon thread drains the bounded queue in batches and
+sends each batch with `group_send`; different groups are sent concurrently.
+When the ASGI server's event loop is known, the batch runs on that loop, because
+InMemoryChannelLayer queues belong to it. TokenAuthMiddleware binds the loop on
+the first websocket connection. Otherwise the thread uses its own loop.
+
+When the queue is full, BROADCAST_OVERFLOW decides what happens: 'drop_oldest'
+(the default) discards the oldest queued message, and 'drop_newest' discards the
+new one. With BROADCAST_SYNC (or when the worker thread cannot run), messages
+are sent inline as before, which keeps tests deterministic.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+SEND_TIMEOUT = 10
+
+
+class BroadcastDispatcher:
+    """Bounded queue of (group, message) pairs drained by a background thread."""
+
+    def __init__(self, maxsize=1000, batch_size=50, overflow=DROP_OLDEST):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._target_loop = None
+        self._metrics = {
+            'enqueued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'failed': 0,
+            'batches': 0,
+            'max_depth': 0,
+            'last_send_ms': 0.0,
+            'avg_send_ms': 0.0,
+        }
+
+    # -- public API ---------------------------------------------------------
+
+    def bind_loop(self, loop):
+        """Use the ASGI server's event loop for sends from now on."""
+        self._target_loop = loop
+
+    def dispatch(self, group, message):
+        if settings.BROADCAST_SYNC or not self._ensure_worker():
+            self._send_inline(group, message)
+            return
+
+        item = (group, message)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._overflow(item)
+        with self._lock:
+            self._metrics['enqueued'] += 1
+            self._metrics['max_depth'] = max(self._metrics['max_depth'], self._queue.qsize())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+        stats['depth'] = self._queue.qsize()
+        stats['capacity'] = self.maxsize
+        return stats
+
+    def flush(self, timeout=5):
+        """Block until everything queued so far has been handed to the channel layer."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return not self._queue.unfinished_tasks
+
+    # -- internals ----------------------------------------------------------
+
+    def _overflow(self, item):
+        if self.overflow == DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                pass
+        with self._lock:
+            self._metrics['dropped'] += 1
+            dropped = self._metrics['dropped']
+        if dropped == 1 or dropped % 100 == 0:
+            logger.warning('Broadcast queue full (%s messages); %s dropped so far', self.maxsize, dropped)
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return True
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                try:
+                    self._thread = threading.Thread(target=self._run, name='broadcast-dispatcher', daemon=True)
+                    self._thread.start()
+                except RuntimeError:
+                    # Interpreter shutting down; fall back to inline sends
+                    self._thread = None
+                    return False
+        return True
+
+    def _send_inline(self, group, message):
+        started = time.monotonic()
+        try:
+            async_to_sync(get_channel_layer().group_send)(group, message)
+        except Exception:
+            self._record(0, 1, started)
+            logger.exception('Broadcast to %s failed', group)
+        else:
+            self._record(1, 0, started)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    async def _send_batch(self, batch):
+        # Groups are sent concurrently; messages of one group keep their order
+        layer = get_channel_layer()
+        by_group = {}
+        for group, message in batch:
+            by_group.setdefault(group, []).append(message)
+
+        async def send_group(group, messages):
+            errors = []
+            for message in messages:
+                try:
+                    await layer.group_send(group, message)
+                except Exception as exc:
+                    errors.append(exc)
+            return errors
+
+        results = await asyncio.gather(*(send_group(group, messages) for group, messages in by_group.items()))
+        return [error for errors in results for error in errors]
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            try:
+                target = self._target_loop
+                if target is not None and target.is_running() and not target.is_closed():
+                    future = asyncio.run_coroutine_threadsafe(self._send_batch(batch), target)
+                    errors = future.result(timeout=SEND_TIMEOUT)
+                else:
+                    errors = self._loop.run_until_complete(self._send_batch(batch))
+            except Exception as exc:
+                errors = [exc] * len(batch)
+            for error in errors[:1]:
+                logger.warning('Broadcast batch had %s failed sends: %r', len(errors), error)
+            self._record(len(batch) - len(errors), len(errors), started, batch=True)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _record(self, sent, failed, started, batch=False):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            metrics = self._metrics
+            metrics['sent'] += sent
+            metrics['failed'] += failed
+            if batch:
+                metrics['batches'] += 1
+            metrics['last_send_ms'] = round(elapsed_ms, 2)
+            # Exponential moving average keeps the metric cheap and recent
+            metrics['avg_send_ms'] = round(metrics['avg_send_ms'] * 0.9 + elapsed_ms * 0.1, 2)
+
+
+dispatcher = BroadcastDispatcher(
+    maxsize=settings.BROADCAST_QUEUE_SIZE,
+    batch_size=settings.BROADCAST_BATCH_SIZE,
+    overflow=settings.BROADCAST_OVERFLOW,
+)
+
+
+def broadcast(group, message):
+    """Queue a channel-layer group_send without blocking the caller."""
+    dispatcher.dispatch(group, message)
@@ -2,15 +2,11 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .models import SiteStats
-import asyncio
-from django.utils import timezone
+from . import presence
+from .stats import request_stats_broadcast
 
-# Global variable to track online users (connection counts)
-# In production, use Redis for this
-online_user_connections = {}
-
-# آخرین زمان فعالیت هر کاربر
-last_activity = {}
+# با فاصله‌ی صفر، آمار همان لحظه با کوئری دیتابیس ساخته می‌شود
+request_stats_update = database_sync_to_async(request_stats_broadcast)
 
 class UserConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -56,18 +52,15 @@ class UserConsumer(AsyncWebsocketConsumer):
                 online_id = f"c_{self.channel_name}"
             
         self.online_id = online_id
+        # پاک‌سازی کاربران غیرفعال به صورت دوره‌ای انجام می‌شود، نه در هر اتصال
+        presence.ensure_sweeper(request_stats_update)
         
-        # فقط اگر این ID قبلاً وجود نداشت، اضافه می‌کنیم
-        # این باعث میشه چند تب از یک کاربر فقط یک نفر حساب بشه
-        if online_id not in online_user_connections:
-            online_user_connections[online_id] = 1
-            last_activity[online_id] = timezone.now()
-            # فقط وقتی کاربر جدیدی اضافه شد، آمار رو broadcast کن
+        # چند تب از یک کاربر فقط یک نفر حساب می‌شود
+        # فقط وقتی کاربر جدیدی اضافه شد، آمار رو broadcast کن
+        if await presence.call(presence.get_presence().connect, online_id):
+            # هر بازدیدکننده‌ی جدید یک بازدید حساب می‌شود (در حافظه، بدون قفل روی دیتابیس)
+            await self.increment_visit_count()
             await self.simple_broadcast_stats()
-        else:
-            # اگر قبلاً وجود داشت، فقط تعداد connection ها رو افزایش بده
-            online_user_connections[online_id] += 1
-            last_activity[online_id] = timezone.now()
 
     async def disconnect(self, close_code):
         # Remove from groups
@@ -82,22 +75,16 @@ class UserConsumer(AsyncWebsocketConsumer):
             await self.channel_layer.group_discard("admin_comments", self.channel_name)
             
         # کم کردن تعداد connection ها برای این کاربر
-        if hasattr(self, 'online_id') and self.online_id in online_user_connections:
-            online_user_connections[self.online_id] -= 1
-            
-            # اگر تمام connection های این کاربر بسته شد، اون رو از لیست حذف کن
-            if online_user_connections[self.online_id] <= 0:
-                del online_user_connections[self.online_id]
-                if self.online_id in last_activity:
-                    del last_activity[self.online_id]
-                # فقط وقتی کاربری کاملاً disconnect شد، آمار رو broadcast کن
+        # فقط وقتی تمام connection های کاربر بسته شد، آمار رو broadcast کن
+        if hasattr(self, 'online_id'):
+            if await presence.call(presence.get_presence().disconnect, self.online_id):
                 await self.simple_broadcast_stats()
 
     async def receive(self, text_data):
         """دریافت پیام از کلاینت و بروزرسانی آخرین فعالیت"""
-        # بروزرسانی آخرین فعالیت کاربر
-        if hasattr(self, 'online_id') and self.online_id in last_activity:
-            last_activity[self.online_id] = timezone.now()
+        # بروزرسانی آخرین فعالیت کاربر (heartbeat)
+        if hasattr(self, 'online_id'):
+            await presence.call(presence.get_presence().touch, self.online_id)
         
         # پردازش پیام (اگر نیاز باشد)
         try:
@@ -107,37 +94,8 @@ class UserConsumer(AsyncWebsocketConsumer):
             pass
 
     async def simple_broadcast_stats(self):
-        """Simple stats broadcast without database queries"""
-        # پاک کردن connection های قدیمی (بیشتر از 5 دقیقه غیرفعال)
-        await self.cleanup_old_connections()
-        
-        # Get actual stats from database
-        stats_data = await self.get_stats()
-        stats_data['online_users'] = len(online_user_connections)
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                "type": "stats_update",
-                "stats": stats_data
-            }
-        )
-
-    async def cleanup_old_connections(self):
-        """پاک کردن connection های قدیمی که بیشتر از 5 دقیقه غیرفعال هستند"""
-        now = timezone.now()
-        timeout_minutes = 5
-        
-        expired_connections = []
-        for online_id, last_time in last_activity.items():
-            if (now - last_time).total_seconds() > (timeout_minutes * 60):
-                expired_connections.append(online_id)
-        
-        for online_id in expired_connections:
-            if online_id in online_user_connections:
-                del online_user_connections[online_id]
-            if online_id in last_activity:
-                del last_activity[online_id]
+        """Ask for a coalesced stats_update; at most one is sent per interval."""
+        await request_stats_update()
 
     async def stats_update(self, event):
         await self.send(text_data=json.dumps({
@@ -177,20 +135,3 @@ class UserConsumer(AsyncWebsocketConsumer):
     def increment_visit_count(self):
         client_ip = self.scope.get('client', [None])[0]
         SiteStats.increment_visit(ip_address=client_ip)
-
-    @database_sync_to_async
-    def get_stats(self):
-        from .models import SiteStats, SatisfactionVote
-        stats, created = SiteStats.objects.get_or_create(id=1)
-        
-        total_votes = SatisfactionVote.objects.count()
-        satisfied_votes = SatisfactionVote.objects.filter(vote='satisfied').count()
-        rate = (satisfied_votes / total_votes * 100) if total_votes > 0 else 100
-        
-        return {
-            "total_visits": stats.total_visits,
-            "today_visits": stats.today_visits,
-            "total_satisfied": satisfied_votes,
-            "total_satisfied_customers": satisfied_votes,
-            "satisfaction_rate": round(rate, 1)
-        }
@@ -0,0 +1,163 @@
+"""
+Multiplexed websocket gateway (ws/gateway/).
+
+One socket per browser tab replaces the separate products, comments, orders,
+wallet and chat sockets. The client subscribes to topics:
+
+    {"action": "subscribe", "topic": "product_comments", "id": 12}
+    {"action": "unsubscribe", "topic": "product_comments", "id": 12}
+
+and gets {"type": "subscribed" | "unsubscribed", "topic", "id"} back, or
+{"type": "error", "topic", "id", "error"} when the topic is unknown or not
+allowed. Every topic maps to the channel-layer group that the dedicated
+consumer already uses, so server-side senders do not change. Group events are
+forwarded unchanged: the event dict itself, including its "type", is the JSON
+message.
+"""
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+
+def _anyone(user, object_id):
+    return True
+
+
+def _authenticated(user, object_id):
+    return bool(user and user.is_authenticated)
+
+
+def _chat_member(user, room_id):
+    from apps.chat.models import ChatRoom
+
+    if not _authenticated(user, room_id):
+        return False
+    owner = ChatRoom.objects.filter(pk=room_id).values_list('user_id', flat=True).first()
+    return user.is_staff or (owner is not None and owner == user.id)
+
+
+def _orders_group(user, object_id):
+    from apps.orders.consumers import orders_group_for
+
+    return orders_group_for(user)
+
+
+class Topic:
+    """
+    A subscribable topic and who may join it.
+
+    `group` is a group name pattern, or a callable (user, id) -> group name.
+    """
+
+    def __init__(self, group, requires_id=False, permission=_anyone):
+        self.group = group
+        self.requires_id = requires_id
+        self.permission = permission
+
+    def group_name(self, user, object_id):
+        if callable(self.group):
+            return self.group(user, object_id)
+        return self.group.format(id=object_id, user_id=getattr(user, 'id', None))
+
+
+TOPICS = {
+    'products': Topic('products'),
+    'site_stats': Topic('site_stats'),
+    'product_comments': Topic('product_{id}_comments', requires_id=True),
+    'article_comments': Topic('article_{id}_comments', requires_id=True),
+    'chat': Topic('chat_room_{id}', requires_id=True, permission=_chat_member),
+    # wallet_update, wallet_request_update و ticket_update همگی به این گروه ارسال می‌شوند
+    'wallet': Topic('user_{user_id}_wallet', permission=_authenticated),
+    # ادمین‌ها همه‌ی سفارش‌ها، کاربران فقط سفارش‌های خودشان
+    'orders': Topic(_orders_group, permission=_authenticated),
+}
+
+# Event types sent to the groups above by the existing senders
+FORWARDED_EVENTS = frozenset({
+    'product_update', 'product_delete', 'comment_update', 'chat_message', 'chat_message_saved',
+    'order_update', 'order_delete', 'wallet_update', 'wallet_request_update',
+    'ticket_update', 'stats_update', 'site_settings_update',
+})
+
+
+class GatewayConsumer(AsyncWebsocketConsumer):
+    max_subscriptions = 50
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+        # (topic, id) -> group name
+        self.subscriptions = {}
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for group in set(self.subscriptions.values()):
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.subscriptions = {}
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        if not isinstance(data, dict):
+            return
+        action = data.get('action')
+        if action == 'subscribe':
+            await self.subscribe(data.get('topic'), data.get('id'))
+        elif action == 'unsubscribe':
+            await self.unsubscribe(data.get('topic'), data.get('id'))
+        # پیام‌های دیگر (مثل heartbeat) پاسخی ندارند
+
+    async def subscribe(self, name, object_id):
+        topic = TOPICS.get(name)
+        if topic is None:
+            return await self.reply_error(name, object_id, 'unknown topic')
+        object_id = self.clean_id(topic, object_id)
+        if object_id is False:
+            return await self.reply_error(name, None, 'invalid id')
+        key = (name, object_id)
+        if key not in self.subscriptions:
+            if len(self.subscriptions) >= self.max_subscriptions:
+                return await self.reply_error(name, object_id, 'too many subscriptions')
+            allowed = await database_sync_to_async(topic.permission)(self.user, object_id)
+            if not allowed:
+                return await self.reply_error(name, object_id, 'forbidden')
+            group = topic.group_name(self.user, object_id)
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.subscriptions[key] = group
+        await self.send_json({'type': 'subscribed', 'topic': name, 'id': object_id})
+
+    async def unsubscribe(self, name, object_id):
+        topic = TOPICS.get(name)
+        if topic is None:
+            return await self.reply_error(name, object_id, 'unknown topic')
+        object_id = self.clean_id(topic, object_id)
+        group = self.subscriptions.pop((name, object_id), None)
+        if group is not None:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        await self.send_json({'type': 'unsubscribed', 'topic': name, 'id': object_id})
+
+    @staticmethod
+    def clean_id(topic, object_id):
+        """The numeric id for topics that need one, None otherwise, False if invalid."""
+        if not topic.requires_id:
+            return None
+        if isinstance(object_id, int) and not isinstance(object_id, bool) and object_id > 0:
+            return object_id
+        if isinstance(object_id, str) and object_id.isdigit():
+            return int(object_id)
+        return False
+
+    async def reply_error(self, name, object_id, error):
+        await self.send_json({'type': 'error', 'topic': name, 'id': object_id, 'error': error})
+
+    async def send_json(self, content):
+        await self.send(text_data=json.dumps(content))
+
+    async def dispatch(self, message):
+        # Group events are passed through as they are
+        if message.get('type') in FORWARDED_EVENTS:
+            await self.send_json(message)
+            return
+        await super().dispatch(message)
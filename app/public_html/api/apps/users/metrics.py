@@ -0,0 +1,141 @@
+"""
+Admin dashboard metrics.
+
+DailyMetric keeps one rollup row per day: new users, new orders and sales
+(the total of PAID/SENT orders). Each order and user counts on the local date
+it was created. Order and user signals apply deltas to these rows after
+commit with F() updates, so the dashboard never has to scan the Order or User
+tables:
+
+- `dashboard()` builds the AdminStatisticsView payload from the rollups plus a
+  few cheap counts, and is cached for ADMIN_STATS_CACHE_TTL seconds;
+- `timeseries(days)` returns the last `days` rollups joined with the daily
+  visit buckets.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+DASHBOARD_CACHE_KEY = 'users:admin_dashboard'
+
+METRIC_FIELDS = ('new_users', 'orders', 'sales')
+
+
+def _sales_statuses():
+    from apps.orders.models import Order
+
+    return (Order.Status.PAID, Order.Status.SENT)
+
+
+def add_to_day(date, **deltas):
+    """Add `deltas` (new_users/orders/sales) to the rollup row of `date`."""
+    from .models import DailyMetric
+
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if not DailyMetric.objects.filter(date=date).update(**updates):
+        try:
+            with transaction.atomic():
+                DailyMetric.objects.create(date=date, **deltas)
+        except IntegrityError:
+            # Another request created the row first
+            DailyMetric.objects.filter(date=date).update(**updates)
+
+
+def record_after_commit(date, **deltas):
+    deltas = {field: value for field, value in deltas.items() if value}
+    if deltas:
+        # robust: a failed rollup write is logged and must not fail the already committed request
+        transaction.on_commit(lambda: add_to_day(date, **deltas), robust=True)
+
+
+def order_snapshot(order):
+    """The (status, total_price) an order currently contributes to the rollups."""
+    return order.__dict__.get('status'), order.__dict__.get('total_price')
+
+
+def order_sales(snapshot):
+    status, total_price = snapshot
+    return (total_price or 0) if status in _sales_statuses() else 0
+
+
+def order_changed(order, created):
+    """Apply an order save: a new order and/or a change in its sales contribution."""
+    previous = getattr(order, '_metrics_snapshot', None)
+    current = order_snapshot(order)
+    order._metrics_snapshot = current
+    if not created and previous is None:
+        # Saved through an instance that was never loaded; nothing to compare with
+        return
+    sales = order_sales(current) - (order_sales(previous) if previous else 0)
+    record_after_commit(timezone.localdate(order.created_at), orders=1 if created else 0, sales=sales)
+
+
+def order_removed(order):
+    previous = getattr(order, '_metrics_snapshot', None) or order_snapshot(order)
+    record_after_commit(timezone.localdate(order.created_at), orders=-1, sales=-order_sales(previous))
+
+
+def dashboard():
+    """AdminStatisticsView payload, cached for ADMIN_STATS_CACHE_TTL seconds."""
+    data = cache.get(DASHBOARD_CACHE_KEY)
+    if data is None:
+        data = _build_dashboard()
+        cache.set(DASHBOARD_CACHE_KEY, data, settings.ADMIN_STATS_CACHE_TTL)
+    return data
+
+
+def _build_dashboard():
+    from apps.articles.models import Article
+    from apps.orders.models import Order
+    from apps.products.models import Product
+    from .models import DailyMetric
+    from .visits import visit_totals
+
+    today = timezone.localdate()
+    totals = DailyMetric.objects.aggregate(**{field: Sum(field) for field in METRIC_FIELDS})
+    today_row = DailyMetric.objects.filter(date=today).values(*METRIC_FIELDS).first() or {}
+    today_visits, total_visits = visit_totals()
+
+    return {
+        'total_users': totals['new_users'] or 0,
+        'new_users_today': today_row.get('new_users', 0),
+        'total_products': Product.objects.count(),
+        'total_articles': Article.objects.count(),
+        'total_orders': totals['orders'] or 0,
+        'pending_orders': Order.objects.filter(status=Order.Status.PENDING).count(),
+        'new_orders_today': today_row.get('orders', 0),
+        'total_sales': totals['sales'] or 0,
+        'sales_today': today_row.get('sales', 0),
+        'today_visits': today_visits,
+        'total_visits': total_visits,
+    }
+
+
+def timeseries(days):
+    """Daily orders, sales, new users and visits for the last `days` days, oldest first."""
+    from .models import DailyMetric, DailyVisitCount
+
+    today = timezone.localdate()
+    start = today - datetime.timedelta(days=days - 1)
+    rows = {
+        row['date']: row
+        for row in DailyMetric.objects.filter(date__gte=start).values('date', *METRIC_FIELDS)
+    }
+    visits = dict(DailyVisitCount.objects.filter(date__gte=start).values_list('date', 'visits'))
+
+    series = []
+    for offset in range(days):
+        date = start + datetime.timedelta(days=offset)
+        row = rows.get(date, {})
+        series.append({
+            'date': date.isoformat(),
+            'new_users': row.get('new_users', 0),
+            'orders': row.get('orders', 0),
+            'sales': row.get('sales', 0),
+            'visits': visits.get(date, 0),
+        })
+    return series
@@ -1,21 +1,178 @@
+"""
+Websocket authentication.
+
+TokenAuthMiddleware reads the access token from the `token` query parameter
+and puts a ScopeUser into scope['user']. A ScopeUser is a snapshot of the
+fields consumers check on every connect (id, is_staff, ...), so these checks
+need no database query. Code that needs the model instance calls `get_user()`
+or uses the id directly (`sender_id=...`).
+
+Verified snapshots are kept in an LRU keyed by the token's jti, for at most
+WS_AUTH_CACHE_TTL seconds and never past the token's expiry. A reconnect with
+the same token only verifies the signature. A miss loads the user with one
+query and checks the simplejwt token blacklist for the access token's jti.
+
+simplejwt itself only blacklists refresh tokens, so LogoutView also records
+the access token of the logout request with `revoke_access_token()`.
+Blacklisting a token or saving/deleting a user evicts the matching entries of
+this process (see apps.users.signals). Other processes may still accept a
+cached snapshot for up to WS_AUTH_CACHE_TTL seconds, and sockets that are
+already open stay open.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
 from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
-from .models import SiteStats
-from django.db.models import F
+from .broadcast import dispatcher
 
 User = get_user_model()
 
-@database_sync_to_async
-def get_user(token_key):
+SNAPSHOT_FIELDS = ('id', 'mobile', 'full_name', 'is_staff', 'is_superuser')
+
+
+class ScopeUser:
+    """Authenticated, active user as seen by websocket consumers."""
+
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+
+    def __init__(self, id, mobile='', full_name='', is_staff=False, is_superuser=False):
+        self.id = id
+        self.mobile = mobile
+        self.full_name = full_name
+        self.is_staff = is_staff
+        self.is_superuser = is_superuser
+
+    @property
+    def pk(self):
+        return self.id
+
+    def get_user(self):
+        """The User model instance (one query; call from sync code)."""
+        return User.objects.get(pk=self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, (ScopeUser, User)):
+            return self.id == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.full_name or self.mobile
+
+    def __repr__(self):
+        return f'<ScopeUser {self.id}>'
+
+
+class TokenUserCache:
+    """Thread-safe LRU of jti -> (ScopeUser, expires_at)."""
+
+    def __init__(self, size=1024, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, jti):
+        with self._lock:
+            entry = self._entries.get(jti)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[jti]
+                return None
+            self._entries.move_to_end(jti)
+            return entry[0]
+
+    def set(self, jti, user, token_exp=None):
+        if self.size <= 0 or self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._entries[jti] = (user, expires_at)
+            self._entries.move_to_end(jti)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, jti):
+        with self._lock:
+            self._entries.pop(jti, None)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            stale = [jti for jti, (user, _) in self._entries.items() if user.id == user_id]
+            for jti in stale:
+                del self._entries[jti]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_cache = TokenUserCache(settings.WS_AUTH_CACHE_SIZE, settings.WS_AUTH_CACHE_TTL)
+
+
+def load_scope_user(jti, user_id):
+    """ScopeUser for a verified token, or None if blacklisted or the user is gone/inactive."""
+    if BlacklistedToken.objects.filter(token__jti=jti).exists():
+        return None
+    row = (
+        User.objects.filter(pk=user_id, is_active=True)
+        .values(*SNAPSHOT_FIELDS)
+        .first()
+    )
+    return ScopeUser(**row) if row else None
+
+
+def revoke_access_token(token):
+    """Blacklist an access token so websocket auth rejects it (see LogoutView)."""
+    outstanding, _ = OutstandingToken.objects.get_or_create(
+        jti=token[api_settings.JTI_CLAIM],
+        defaults={
+            'user_id': token.get(api_settings.USER_ID_CLAIM),
+            'token': str(token),
+            'expires_at': datetime_from_epoch(token['exp']),
+        },
+    )
+    BlacklistedToken.objects.get_or_create(token=outstanding)
+
+
+async def get_user(token_key):
     try:
-        access_token = AccessToken(token_key)
-        user_id = access_token['user_id']
-        return User.objects.get(id=user_id)
-    except Exception:
+        token = AccessToken(token_key)
+        jti = token[api_settings.JTI_CLAIM]
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
         return AnonymousUser()
 
+    user = token_cache.get(jti)
+    if user is None:
+        user = await database_sync_to_async(load_scope_user)(jti, user_id)
+        if user is None:
+            return AnonymousUser()
+        token_cache.set(jti, user, token.get('exp'))
+    return user
+
+
 class TokenAuthMiddleware:
     """
     Custom middleware that takes a token from the query string and authenticates the user.
@@ -24,18 +181,16 @@ class TokenAuthMiddleware:
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
-        query_string = scope.get('query_string', b'').decode()
-        token = None
-        for param in query_string.split('&'):
-            if param.startswith('token='):
-                token = param.split('=')[1]
-                break
-        
+        # صف ارسال‌ها روی همان event loop سرور ASGI اجرا شود
+        dispatcher.bind_loop(asyncio.get_running_loop())
+        params = parse_qs(scope.get('query_string', b'').decode())
+        token = params.get('token', [None])[0]
+
         if token:
             scope['user'] = await get_user(token)
         else:
             scope['user'] = AnonymousUser()
-            
+
         return await self.inner(scope, receive, send)
 
 class SiteStatsMiddleware:
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.11 on 2026-10-17 23:06
+
+import datetime
+
+from django.db import migrations, models
+
+
+def seed_from_site_stats(apps, schema_editor):
+    """Carry the SiteStats counters over into day buckets so totals stay the same."""
+    SiteStats = apps.get_model('users', 'SiteStats')
+    DailyVisitCount = apps.get_model('users', 'DailyVisitCount')
+    stats = SiteStats.objects.filter(pk=1).first()
+    if stats is None or not stats.total_visits:
+        return
+
+    today_visits = min(stats.today_visits, stats.total_visits)
+    earlier_visits = stats.total_visits - today_visits
+    if today_visits:
+        DailyVisitCount.objects.create(date=stats.last_visit_date, visits=today_visits)
+    if earlier_visits:
+        # Older visits have no per-day history; they go on the day before
+        DailyVisitCount.objects.create(
+            date=stats.last_visit_date - datetime.timedelta(days=1), visits=earlier_visits,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_user_is_online_user_last_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyVisitCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='تاریخ')),
+                ('visits', models.PositiveBigIntegerField(default=0, verbose_name='بازدید')),
+            ],
+            options={
+                'verbose_name': 'بازدید روزانه',
+                'verbose_name_plural': 'بازدیدهای روزانه',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.RunPython(seed_from_site_stats, migrations.RunPython.noop),
+    ]
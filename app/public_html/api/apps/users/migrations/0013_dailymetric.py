@@ -0,0 +1,54 @@
+# Generated by Django 4.2.11 on 2026-10-17 23:24
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def build_rollups(apps, schema_editor):
+    """Fill DailyMetric from the existing users and orders."""
+    User = apps.get_model('users', 'User')
+    Order = apps.get_model('orders', 'Order')
+    DailyMetric = apps.get_model('users', 'DailyMetric')
+
+    days = defaultdict(lambda: {'new_users': 0, 'orders': 0, 'sales': 0})
+    for joined in User.objects.values_list('date_joined', flat=True).iterator():
+        days[timezone.localdate(joined)]['new_users'] += 1
+    for created_at, status, total_price in Order.objects.values_list('created_at', 'status', 'total_price').iterator():
+        day = days[timezone.localdate(created_at)]
+        day['orders'] += 1
+        if status in ('PAID', 'SENT'):
+            day['sales'] += total_price
+
+    DailyMetric.objects.bulk_create(
+        [DailyMetric(date=date, **values) for date, values in days.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_dailyvisitcount'),
+        ('orders', '0003_order_payment_method'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='تاریخ')),
+                ('new_users', models.IntegerField(default=0, verbose_name='کاربران جدید')),
+                ('orders', models.IntegerField(default=0, verbose_name='سفارش‌ها')),
+                ('sales', models.BigIntegerField(default=0, verbose_name='فروش (تومان)')),
+            ],
+            options={
+                'verbose_name': 'آمار روزانه',
+                'verbose_name_plural': 'آمار روزانه',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -138,6 +138,13 @@ class SatisfactionVote(models.Model):
     class Meta:
         unique_together = ['user', 'session_id']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # رأی بارگذاری‌شده برای بروزرسانی تدریجی شمارنده‌ها در سیگنال‌ها
+        instance._loaded_vote = instance.__dict__.get('vote')
+        return instance
+
 class SiteSettings(models.Model):
     """تنظیمات عمومی سایت"""
     site_name = models.CharField(max_length=100, default='مرکزتک')
@@ -187,26 +194,49 @@ class SiteStats(models.Model):
     
     @classmethod
     def get_stats(cls):
-        """دریافت آمار سایت"""
-        stats, created = cls.objects.get_or_create(pk=1)
-        
-        # بررسی تاریخ و ریست کردن آمار روزانه
-        today = timezone.now().date()
-        if stats.last_visit_date != today:
-            stats.today_visits = 0
-            stats.last_visit_date = today
-            stats.save()
-        
+        """دریافت آمار سایت (بازدیدها از DailyVisitCount خوانده می‌شوند و چیزی ذخیره نمی‌شود)"""
+        from .visits import visit_totals
+
+        stats = cls.objects.filter(pk=1).first() or cls(pk=1)
+        stats.today_visits, stats.total_visits = visit_totals()
+        stats.last_visit_date = timezone.localdate()
         return stats
     
     @classmethod
     def increment_visit(cls, ip_address=None):
-        """افزایش تعداد بازدید"""
-        stats = cls.get_stats()
-        stats.total_visits += 1
-        stats.today_visits += 1
-        stats.save()
-        return stats
+        """افزایش تعداد بازدید (در حافظه جمع و به صورت دوره‌ای ذخیره می‌شود)"""
+        from .visits import record_visit
+
+        record_visit()
+
+
+class DailyVisitCount(models.Model):
+    """تعداد بازدید هر روز؛ کل بازدیدها مجموع همین ردیف‌هاست"""
+    date = models.DateField(unique=True, verbose_name='تاریخ')
+    visits = models.PositiveBigIntegerField(default=0, verbose_name='بازدید')
+
+    class Meta:
+        verbose_name = 'بازدید روزانه'
+        verbose_name_plural = 'بازدیدهای روزانه'
+        ordering = ['-date']
+
+    def __str__(self):
+        return f'{self.date}: {self.visits}'
+
+class DailyMetric(models.Model):
+    """آمار تجمیعی هر روز برای داشبورد ادمین (apps.users.metrics)"""
+    date = models.DateField(unique=True, verbose_name='تاریخ')
+    new_users = models.IntegerField(default=0, verbose_name='کاربران جدید')
+    orders = models.IntegerField(default=0, verbose_name='سفارش‌ها')
+    sales = models.BigIntegerField(default=0, verbose_name='فروش (تومان)')
+
+    class Meta:
+        verbose_name = 'آمار روزانه'
+        verbose_name_plural = 'آمار روزانه'
+        ordering = ['-date']
+
+    def __str__(self):
+        return str(self.date)
 
 class SatisfactionSurvey(models.Model):
     """مدل موقت برای سازگاری"""
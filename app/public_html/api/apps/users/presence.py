@@ -0,0 +1,180 @@
+"""
+Online presence tracking for the site_stats websocket.
+
+Each visitor is identified by an online id (u_<user id>, s_<session key>,
+ip_<address> or c_<channel name>). Several tabs of one visitor count as one
+online user. Every connection and heartbeat message refreshes the visitor's
+heartbeat. Visitors without a heartbeat for PRESENCE_TIMEOUT seconds are no
+longer counted, and a periodic sweeper removes them; connect and disconnect
+never scan the whole table.
+
+The backend comes from PRESENCE_BACKEND:
+
+- MemoryPresence (the default) keeps the state in this process. It is only
+  correct with a single ASGI worker.
+- RedisPresence keeps a hash of connection counts and a sorted set of
+  heartbeat timestamps. Counts are therefore shared by every worker. It needs
+  the `redis` package and PRESENCE_REDIS_URL.
+
+Backend methods are synchronous. Async callers run them through the `call`
+helper.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryPresence:
+    """Process-local presence state."""
+
+    def __init__(self, timeout=300):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._heartbeats = {}
+
+    def connect(self, online_id):
+        """Register a connection; True when the visitor just came online."""
+        with self._lock:
+            count = self._connections.get(online_id, 0) + 1
+            self._connections[online_id] = count
+            self._heartbeats[online_id] = time.time()
+        return count == 1
+
+    def disconnect(self, online_id):
+        """Drop a connection; True when the visitor's last connection closed."""
+        with self._lock:
+            count = self._connections.get(online_id)
+            if count is None:
+                return False
+            if count > 1:
+                self._connections[online_id] = count - 1
+                return False
+            del self._connections[online_id]
+            self._heartbeats.pop(online_id, None)
+        return True
+
+    def touch(self, online_id):
+        with self._lock:
+            if online_id in self._heartbeats:
+                self._heartbeats[online_id] = time.time()
+
+    def count(self):
+        with self._lock:
+            return len(self._connections)
+
+    def sweep(self):
+        """Forget visitors whose heartbeat expired; returns how many were removed."""
+        cutoff = time.time() - self.timeout
+        with self._lock:
+            expired = [online_id for online_id, beat in self._heartbeats.items() if beat < cutoff]
+            for online_id in expired:
+                del self._heartbeats[online_id]
+                self._connections.pop(online_id, None)
+        return len(expired)
+
+
+class RedisPresence:
+    """Presence state shared through Redis by all worker processes."""
+
+    CONNECTIONS_KEY = 'presence:connections'
+    HEARTBEATS_KEY = 'presence:heartbeats'
+
+    def __init__(self, timeout=300, url=None):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisPresence requires the "redis" package')
+        self.timeout = timeout
+        self.client = redis.Redis.from_url(url or settings.PRESENCE_REDIS_URL)
+
+    def connect(self, online_id):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.CONNECTIONS_KEY, online_id, 1)
+        pipe.zadd(self.HEARTBEATS_KEY, {online_id: time.time()})
+        count, _ = pipe.execute()
+        return count == 1
+
+    def disconnect(self, online_id):
+        count = self.client.hincrby(self.CONNECTIONS_KEY, online_id, -1)
+        if count > 0:
+            return False
+        pipe = self.client.pipeline()
+        pipe.hdel(self.CONNECTIONS_KEY, online_id)
+        pipe.zrem(self.HEARTBEATS_KEY, online_id)
+        pipe.execute()
+        # A negative count means the entry had already been swept
+        return count == 0
+
+    def touch(self, online_id):
+        self.client.zadd(self.HEARTBEATS_KEY, {online_id: time.time()}, xx=True)
+
+    def count(self):
+        # Stale heartbeats are excluded even before the sweeper removes them
+        return self.client.zcount(self.HEARTBEATS_KEY, time.time() - self.timeout, '+inf')
+
+    def sweep(self):
+        cutoff = time.time() - self.timeout
+        expired = self.client.zrangebyscore(self.HEARTBEATS_KEY, '-inf', cutoff)
+        if not expired:
+            return 0
+        pipe = self.client.pipeline()
+        pipe.zrem(self.HEARTBEATS_KEY, *expired)
+        pipe.hdel(self.CONNECTIONS_KEY, *expired)
+        pipe.execute()
+        return len(expired)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_sweepers = weakref.WeakKeyDictionary()
+
+
+def get_presence():
+    """The configured presence backend (created on first use)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(settings.PRESENCE_BACKEND)
+                _backend = backend_class(timeout=settings.PRESENCE_TIMEOUT)
+    return _backend
+
+
+async def call(method, *args):
+    """Run a presence backend method without blocking the event loop."""
+    return await sync_to_async(method, thread_sensitive=False)(*args)
+
+
+async def _sweep_forever(on_expired):
+    presence = get_presence()
+    while True:
+        await asyncio.sleep(settings.PRESENCE_SWEEP_INTERVAL)
+        try:
+            expired = await call(presence.sweep)
+            if expired:
+                await on_expired()
+        except Exception:
+            logger.exception('Presence sweep failed')
+
+
+def ensure_sweeper(on_expired):
+    """
+    Start the periodic sweeper on the running event loop, once per loop.
+
+    `on_expired` is awaited after a sweep that removed someone, for example to
+    broadcast the new online count.
+    """
+    loop = asyncio.get_running_loop()
+    task = _sweepers.get(loop)
+    if task is None or task.done():
+        _sweepers[loop] = loop.create_task(_sweep_forever(on_expired))
@@ -1,6 +1,7 @@
 from django.urls import re_path
-from . import consumers
+from . import consumers, gateway
 
 websocket_urlpatterns = [
     re_path(r'(?:api/)?ws/user/$', consumers.UserConsumer.as_asgi()),
+    re_path(r'(?:api/)?ws/gateway/$', gateway.GatewayConsumer.as_asgi()),
 ]
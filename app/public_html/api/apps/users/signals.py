@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from .metrics import record_after_commit
+from .middleware import token_cache
+from .models import SatisfactionVote, User
+from .stats import adjust_vote_totals, request_stats_broadcast
+
+
+def _satisfied(vote):
+    return 1 if vote == 'satisfied' else 0
+
+
+def _after_commit(total, satisfied):
+    def apply():
+        adjust_vote_totals(total, satisfied)
+        request_stats_broadcast()
+    transaction.on_commit(apply)
+
+
+@receiver(post_save, sender=SatisfactionVote)
+def satisfaction_vote_saved(sender, instance, created, **kwargs):
+    """Keep the cached vote totals in step with inserts and changed votes."""
+    previous = getattr(instance, '_loaded_vote', None)
+    instance._loaded_vote = instance.vote
+    if created:
+        _after_commit(1, _satisfied(instance.vote))
+    elif previous is not None and previous != instance.vote:
+        _after_commit(0, _satisfied(instance.vote) - _satisfied(previous))
+
+
+@receiver(post_delete, sender=SatisfactionVote)
+def satisfaction_vote_deleted(sender, instance, **kwargs):
+    _after_commit(-1, -_satisfied(getattr(instance, '_loaded_vote', instance.vote)))
+
+
+@receiver(post_save, sender=User)
+def user_metrics_saved(sender, instance, created, **kwargs):
+    if created:
+        record_after_commit(timezone.localdate(instance.date_joined), new_users=1)
+
+
+@receiver(post_delete, sender=User)
+def user_metrics_deleted(sender, instance, **kwargs):
+    record_after_commit(timezone.localdate(instance.date_joined), new_users=-1)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def blacklisted_token_saved(sender, instance, **kwargs):
+    """A blacklisted token must not keep authenticating websockets from the cache."""
+    token_cache.discard(instance.token.jti)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_token_cache_evict(sender, instance, **kwargs):
+    # نقش، فعال بودن یا نام کاربر ممکن است تغییر کرده باشد
+    token_cache.discard_user(instance.pk)
@@ -0,0 +1,128 @@
+"""
+Aggregated, throttled site statistics.
+
+`stats_snapshot()` builds the site_stats payload. Satisfaction totals come from
+two cache counters. These counters are computed with one aggregate query when
+missing, and after that they are adjusted incrementally by the SatisfactionVote
+signals. The default cache is per process, so the signals only adjust the
+counters of the process that saved the vote. The counters therefore expire
+after SATISFACTION_TOTALS_TTL seconds and every process recounts them at that
+interval. The online count comes from the presence backend.
+
+`request_stats_broadcast()` does not send anything itself. It marks the
+statistics as changed. At most one `stats_update` is then sent per
+STATS_BROADCAST_INTERVAL seconds, carrying a snapshot taken when it is sent.
+Bursts of connects, disconnects and votes therefore collapse into one message.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, Q
+
+logger = logging.getLogger(__name__)
+
+VOTES_TOTAL_KEY = 'users:satisfaction:total'
+VOTES_SATISFIED_KEY = 'users:satisfaction:satisfied'
+
+
+def get_vote_totals():
+    """(total votes, satisfied votes), from the cache counters when present."""
+    totals = cache.get_many([VOTES_TOTAL_KEY, VOTES_SATISFIED_KEY])
+    if len(totals) == 2:
+        return totals[VOTES_TOTAL_KEY], totals[VOTES_SATISFIED_KEY]
+
+    from .models import SatisfactionVote
+
+    counts = SatisfactionVote.objects.aggregate(
+        total=Count('id'), satisfied=Count('id', filter=Q(vote='satisfied')),
+    )
+    cache.set_many(
+        {VOTES_TOTAL_KEY: counts['total'], VOTES_SATISFIED_KEY: counts['satisfied']},
+        settings.SATISFACTION_TOTALS_TTL,
+    )
+    return counts['total'], counts['satisfied']
+
+
+def adjust_vote_totals(total=0, satisfied=0):
+    """Apply a vote insert/change/delete to the counters without recounting."""
+    try:
+        if total:
+            cache.incr(VOTES_TOTAL_KEY, total)
+        if satisfied:
+            cache.incr(VOTES_SATISFIED_KEY, satisfied)
+    except ValueError:
+        # A counter is missing (evicted or never loaded); recount on next read
+        cache.delete_many([VOTES_TOTAL_KEY, VOTES_SATISFIED_KEY])
+
+
+def stats_snapshot():
+    """Current site_stats payload."""
+    from .presence import get_presence
+    from .visits import visit_totals
+
+    today_visits, total_visits = visit_totals()
+    total_votes, satisfied_votes = get_vote_totals()
+    rate = (satisfied_votes / total_votes * 100) if total_votes > 0 else 100
+    return {
+        'total_visits': total_visits,
+        'today_visits': today_visits,
+        'online_users': get_presence().count(),
+        'total_satisfied': satisfied_votes,
+        'total_satisfied_customers': satisfied_votes,
+        'satisfaction_rate': round(rate, 1),
+        'total_votes': total_votes,
+    }
+
+
+class StatsBroadcastThrottle:
+    """Coalesce stats broadcast requests into at most one send per interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._timer = None
+        self._last_sent = None
+
+    def request(self):
+        if self.interval <= 0:
+            self._send()
+            return
+        with self._lock:
+            if self._timer is not None:
+                # A send is already scheduled and will carry this change too
+                return
+            delay = 0
+            if self._last_sent is not None:
+                delay = max(0, self._last_sent + self.interval - time.monotonic())
+            self._timer = threading.Timer(delay, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        with self._lock:
+            self._timer = None
+            self._last_sent = time.monotonic()
+        try:
+            self._send()
+        finally:
+            connections.close_all()
+
+    def _send(self):
+        from .utils import broadcast_site_stats
+
+        try:
+            broadcast_site_stats()
+        except Exception:
+            logger.exception('Site stats broadcast failed')
+
+
+throttle = StatsBroadcastThrottle(settings.STATS_BROADCAST_INTERVAL)
+
+
+def request_stats_broadcast():
+    """Ask for a site_stats update; sends are coalesced per interval."""
+    throttle.request()
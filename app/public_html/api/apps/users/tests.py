@@ -1,3 +1,381 @@
-from django.test import TestCase
+import datetime
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import broadcast as broadcast_module
+from .broadcast import BroadcastDispatcher, DROP_NEWEST, DROP_OLDEST
+from . import visits
+from .gateway import GatewayConsumer
+from .middleware import ScopeUser, get_user, token_cache
+from .models import DailyVisitCount, SatisfactionVote
+from .presence import MemoryPresence
+from .stats import StatsBroadcastThrottle, get_vote_totals
+
+
+@override_settings(BROADCAST_SYNC=False)
+class BroadcastDispatcherTests(SimpleTestCase):
+    """broadcast() queues group_send calls and drains them off the caller's thread."""
+
+    def setUp(self):
+        self.sent = []
+        self.release = threading.Event()
+        self.release.set()
+        layer = mock.Mock()
+
+        async def group_send(group, message):
+            self.release.wait(5)
+            self.sent.append((group, message))
+
+        layer.group_send = group_send
+        patcher = mock.patch.object(broadcast_module, 'get_channel_layer', return_value=layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(BROADCAST_SYNC=True)
+    def test_sync_mode_sends_inline(self):
+        dispatcher = BroadcastDispatcher()
+        dispatcher.dispatch('orders', {'type': 'order_update'})
+
+        self.assertEqual(self.sent, [('orders', {'type': 'order_update'})])
+        self.assertIsNone(dispatcher._thread)
+        self.assertEqual(dispatcher.stats()['sent'], 1)
+
+    def test_messages_are_delivered_in_order_per_group(self):
+        dispatcher = BroadcastDispatcher(batch_size=3)
+        for i in range(10):
+            dispatcher.dispatch('a', {'n': i})
+            dispatcher.dispatch('b', {'n': i})
+
+        self.assertTrue(dispatcher.flush())
+        for group in ('a', 'b'):
+            self.assertEqual([m['n'] for g, m in self.sent if g == group], list(range(10)))
+        stats = dispatcher.stats()
+        self.assertEqual(stats['sent'], 20)
+        self.assertEqual(stats['depth'], 0)
+
+    def test_full_queue_drops_oldest(self):
+        dispatcher = BroadcastDispatcher(maxsize=2, batch_size=1, overflow=DROP_OLDEST)
+        self.release.clear()
+        dispatcher.dispatch('g', {'n': 0})
+        # Wait until the worker is blocked sending the first message
+        while dispatcher._queue.qsize():
+            time.sleep(0.001)
+        for i in range(1, 5):
+            dispatcher.dispatch('g', {'n': i})
+        self.release.set()
+
+        self.assertTrue(dispatcher.flush())
+        self.assertEqual([m['n'] for _, m in self.sent], [0, 3, 4])
+        self.assertEqual(dispatcher.stats()['dropped'], 2)
+
+    def test_full_queue_drops_newest(self):
+        dispatcher = BroadcastDispatcher(maxsize=2, batch_size=1, overflow=DROP_NEWEST)
+        self.release.clear()
+        dispatcher.dispatch('g', {'n': 0})
+        while dispatcher._queue.qsize():
+            time.sleep(0.001)
+        for i in range(1, 5):
+            dispatcher.dispatch('g', {'n': i})
+        self.release.set()
+
+        self.assertTrue(dispatcher.flush())
+        self.assertEqual([m['n'] for _, m in self.sent], [0, 1, 2])
+        self.assertEqual(dispatcher.stats()['dropped'], 2)
+
+
+class MemoryPresenceTests(SimpleTestCase):
+    def test_tabs_of_one_visitor_count_once(self):
+        presence = MemoryPresence()
+        self.assertTrue(presence.connect('u_1'))
+        self.assertFalse(presence.connect('u_1'))
+        self.assertTrue(presence.connect('s_abc'))
+        self.assertEqual(presence.count(), 2)
+
+        self.assertFalse(presence.disconnect('u_1'))
+        self.assertTrue(presence.disconnect('u_1'))
+        self.assertEqual(presence.count(), 1)
+
+    def test_sweep_expires_silent_visitors(self):
+        presence = MemoryPresence(timeout=60)
+        with mock.patch('apps.users.presence.time.time', return_value=1000):
+            presence.connect('u_1')
+            presence.connect('u_2')
+        with mock.patch('apps.users.presence.time.time', return_value=1050):
+            presence.touch('u_2')
+        with mock.patch('apps.users.presence.time.time', return_value=1070):
+            self.assertEqual(presence.sweep(), 1)
+        self.assertEqual(presence.count(), 1)
+        # Closing a swept connection later is harmless
+        self.assertFalse(presence.disconnect('u_1'))
+
+
+class SatisfactionTotalsTests(TestCase):
+    """Vote totals are cached and adjusted on insert/change/delete instead of recounted."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('apps.users.signals.request_stats_broadcast')
+        self.request_broadcast = patcher.start()
+        self.addCleanup(patcher.stop)
+        User = get_user_model()
+        self.users = [User.objects.create_user(mobile=f'0912000000{i}', password='pass') for i in range(3)]
+
+    def test_counters_follow_votes(self):
+        self.assertEqual(get_vote_totals(), (0, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            for user, vote in zip(self.users, ['satisfied', 'satisfied', 'dissatisfied']):
+                SatisfactionVote.objects.create(user=user, vote=vote)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_vote_totals(), (3, 2))
+
+        vote = SatisfactionVote.objects.get(user=self.users[2])
+        with self.captureOnCommitCallbacks(execute=True):
+            vote.vote = 'satisfied'
+            vote.save()
+        self.assertEqual(get_vote_totals(), (3, 3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SatisfactionVote.objects.get(user=self.users[0]).delete()
+        self.assertEqual(get_vote_totals(), (2, 2))
+        self.assertTrue(self.request_broadcast.called)
+
+    def test_missing_counters_are_recounted(self):
+        SatisfactionVote.objects.create(user=self.users[0], vote='satisfied')
+        cache.clear()
+        self.assertEqual(get_vote_totals(), (1, 1))
+
+    def test_counters_expire_and_are_recounted(self):
+        self.assertEqual(get_vote_totals(), (0, 0))
+        # A vote saved by another process never adjusts this process's counters
+        SatisfactionVote.objects.bulk_create([SatisfactionVote(user=self.users[0], vote='satisfied')])
+        self.assertEqual(get_vote_totals(), (0, 0))
+        later = time.time() + settings.SATISFACTION_TOTALS_TTL + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(get_vote_totals(), (1, 1))
+
+
+class StatsBroadcastThrottleTests(SimpleTestCase):
+    def test_requests_are_coalesced_per_interval(self):
+        throttle = StatsBroadcastThrottle(interval=0.2)
+        sent = threading.Event()
+        with mock.patch.object(throttle, '_send', side_effect=sent.set) as send:
+            for _ in range(20):
+                throttle.request()
+            self.assertTrue(sent.wait(1))
+            self.assertEqual(send.call_count, 1)
+
+            # The next request waits for the rest of the interval
+            sent.clear()
+            throttle.request()
+            throttle.request()
+            self.assertFalse(sent.wait(0.05))
+            self.assertTrue(sent.wait(1))
+            self.assertEqual(send.call_count, 2)
+
+
+class VisitBufferTests(TestCase):
+    """Visits are counted in memory and written to day buckets with F() updates."""
+
+    def setUp(self):
+        self.buffer = visits.VisitBuffer(interval=60)
+        patcher = mock.patch.object(self.buffer, '_ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_visits_are_buffered_until_flush(self):
+        with self.assertNumQueries(0):
+            for _ in range(25):
+                self.buffer.add()
+        self.assertEqual(self.buffer.flush(), 25)
+        self.buffer.add(5)
+        self.buffer.flush()
+
+        bucket = DailyVisitCount.objects.get()
+        self.assertEqual((bucket.date, bucket.visits), (timezone.localdate(), 30))
+        self.assertEqual(self.buffer.pending(), 0)
+
+    def test_totals_include_buckets_and_unflushed_visits(self):
+        today = timezone.localdate()
+        DailyVisitCount.objects.create(date=today - datetime.timedelta(days=1), visits=100)
+        DailyVisitCount.objects.create(date=today, visits=7)
+        self.buffer.add(3)
+        with mock.patch.object(visits, 'buffer', self.buffer):
+            self.assertEqual(visits.visit_totals(), (10, 110))
+
+
+class AdminDashboardMetricsTests(TestCase):
+    """The admin dashboard reads daily rollups kept current by order/user signals."""
+
+    def setUp(self):
+        from apps.orders.models import Order
+
+        cache.clear()
+        self.Order = Order
+        User = get_user_model()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin = User.objects.create_superuser(mobile='09120000009', password='pass')
+            self.customer = User.objects.create_user(mobile='09120000008', password='pass')
+        patcher = mock.patch('apps.orders.signals.schedule_invoice_render')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rollups_follow_order_lifecycle(self):
+        from . import metrics
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = self.Order.objects.create(user=self.customer, total_price=3000)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = self.Order.objects.get(pk=order.pk)
+            order.status = self.Order.Status.PAID
+            order.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.Order.objects.create(user=self.customer, total_price=500, status=self.Order.Status.PAID)
+
+        data = metrics._build_dashboard()
+        self.assertEqual((data['total_users'], data['new_users_today']), (2, 2))
+        self.assertEqual((data['total_orders'], data['new_orders_today']), (2, 2))
+        self.assertEqual((data['total_sales'], data['sales_today']), (3500, 3500))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.Order.objects.get(pk=order.pk).delete()
+        data = metrics._build_dashboard()
+        self.assertEqual((data['total_orders'], data['total_sales']), (1, 500))
+
+    def test_statistics_endpoint_is_cached(self):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get('/api/users/admin/statistics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_users'], 2)
+        with self.assertNumQueries(0):
+            client.get('/api/users/admin/statistics/')
+
+    def test_timeseries_covers_requested_days(self):
+        from rest_framework.test import APIClient
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.Order.objects.create(user=self.customer, total_price=700, status=self.Order.Status.SENT)
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get('/api/users/admin/statistics/timeseries/', {'days': 7})
+        series = response.data['series']
+        self.assertEqual(len(series), 7)
+        self.assertEqual(series[-1]['date'], timezone.localdate().isoformat())
+        self.assertEqual((series[-1]['orders'], series[-1]['sales'], series[-1]['new_users']), (1, 700, 2))
+        self.assertEqual(series[0]['orders'], 0)
+
+
+class GatewayConsumerTests(TransactionTestCase):
+    """One socket subscribes to several existing groups, with per-topic checks."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(mobile='09120000007', password='pass')
+
+    def run_session(self, user, steps):
+        async def run():
+            communicator = WebsocketCommunicator(GatewayConsumer.as_asgi(), '/ws/gateway/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            try:
+                await steps(communicator, get_channel_layer())
+            finally:
+                await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_events_of_subscribed_groups_are_forwarded(self):
+        async def steps(communicator, layer):
+            await communicator.send_json_to({'action': 'subscribe', 'topic': 'products'})
+            await communicator.send_json_to({'action': 'subscribe', 'topic': 'product_comments', 'id': '7'})
+            await communicator.send_json_to({'action': 'subscribe', 'topic': 'wallet'})
+            replies = [await communicator.receive_json_from() for _ in range(3)]
+            self.assertEqual([r['type'] for r in replies], ['subscribed'] * 3)
+            self.assertEqual(replies[1]['id'], 7)
+
+            await layer.group_send('product_7_comments', {'type': 'comment_update', 'comment': {'id': 1}, 'status': 'new'})
+            await layer.group_send(f'user_{self.user.id}_wallet', {'type': 'wallet_update', 'balance': 10})
+            self.assertEqual((await communicator.receive_json_from())['comment'], {'id': 1})
+            self.assertEqual((await communicator.receive_json_from())['balance'], 10)
+
+            await communicator.send_json_to({'action': 'unsubscribe', 'topic': 'products'})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'unsubscribed')
+            await layer.group_send('products', {'type': 'product_delete', 'product_id': 1})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+
+        self.run_session(self.user, steps)
+
+    def test_topics_are_authorized(self):
+        async def steps(communicator, layer):
+            for message in (
+                {'action': 'subscribe', 'topic': 'wallet'},
+                {'action': 'subscribe', 'topic': 'orders'},
+                {'action': 'subscribe', 'topic': 'chat', 'id': 1},
+                {'action': 'subscribe', 'topic': 'nope'},
+                {'action': 'subscribe', 'topic': 'article_comments', 'id': 'x'},
+            ):
+                await communicator.send_json_to(message)
+            errors = [(await communicator.receive_json_from())['error'] for _ in range(5)]
+            self.assertEqual(errors, ['forbidden', 'forbidden', 'forbidden', 'unknown topic', 'invalid id'])
+
+        self.run_session(AnonymousUser(), steps)
+
+
+class TokenAuthCacheTests(TransactionTestCase):
+    """Websocket tokens resolve to cached ScopeUser snapshots."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(mobile='09120000008', password='pass', is_staff=True)
+        self.token = AccessToken.for_user(self.user)
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def resolve(self, token):
+        return async_to_sync(get_user)(str(token))
+
+    def test_snapshot_is_cached_by_jti(self):
+        user = self.resolve(self.token)
+        self.assertIsInstance(user, ScopeUser)
+        self.assertEqual((user.id, user.is_staff, user.is_authenticated), (self.user.id, True, True))
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve(self.token).id, self.user.id)
+
+    def test_invalid_token_is_anonymous(self):
+        self.assertFalse(self.resolve('not-a-token').is_authenticated)
+
+    def test_logout_revokes_the_websocket_token(self):
+        tokens = self.client.post('/api/users/login/', {'mobile': '09120000008', 'password': 'pass'}).data
+        self.assertTrue(self.resolve(tokens['access']).is_authenticated)
+
+        response = self.client.post(
+            '/api/users/logout/', {'refresh': tokens['refresh']},
+            HTTP_AUTHORIZATION=f"Bearer {tokens['access']}",
+        )
+        self.assertEqual(response.status_code, 205)
+        self.assertFalse(self.resolve(tokens['access']).is_authenticated)
+        # A cold cache (another worker) checks the blacklist as well
+        token_cache.clear()
+        self.assertFalse(self.resolve(tokens['access']).is_authenticated)
+
+    def test_user_changes_evict_snapshots(self):
+        self.resolve(self.token)
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertFalse(self.resolve(self.token).is_authenticated)
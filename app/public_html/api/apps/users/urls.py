@@ -3,7 +3,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, ProfileViewSet, CustomTokenObtainPairView, UserRegistrationView,
-    WalletChargeRequestViewSet, AdminWalletAdjustmentView, AdminStatisticsView, LogoutView,
+    WalletChargeRequestViewSet, AdminWalletAdjustmentView, AdminStatisticsView, AdminStatisticsTimeseriesView, LogoutView,
     TicketViewSet, SiteStatsView, SatisfactionVoteViewSet, SiteSettingsView
 )
 from rest_framework_simplejwt.views import TokenRefreshView
@@ -31,6 +31,7 @@ urlpatterns = [
     # Admin endpoints
     path('wallet/adjust/', AdminWalletAdjustmentView.as_view(), name='admin-wallet-adjust'),
     path('admin/statistics/', AdminStatisticsView.as_view(), name='admin-statistics'),
+    path('admin/statistics/timeseries/', AdminStatisticsTimeseriesView.as_view(), name='admin-statistics-timeseries'),
     
     # Router URLs
     path('', include(router.urls)),
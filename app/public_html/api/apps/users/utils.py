@@ -1,7 +1,6 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 import jdatetime
 import datetime
+from .broadcast import broadcast
 
 def jalali_relative_time(dt):
     """Returns a human-readable relative time in Jalali (e.g., 5 دقیقه پیش)."""
@@ -31,29 +30,13 @@ def jalali_full_date(dt):
 
 def broadcast_site_stats():
     """Broadcasts current site statistics via WebSocket."""
-    from .models import SiteStats, SatisfactionVote
-    stats, created = SiteStats.objects.get_or_create(id=1)
-    
-    total_votes = SatisfactionVote.objects.count()
-    satisfied_votes = SatisfactionVote.objects.filter(vote='satisfied').count()
-    rate = (satisfied_votes / total_votes * 100) if total_votes > 0 else 100
-    
-    from .consumers import online_user_connections
-    
-    stats_data = {
-        "total_visits": stats.total_visits,
-        "total_satisfied": satisfied_votes,
-        "total_satisfied_customers": satisfied_votes,  # Added for HeroSection consistency
-        "satisfaction_rate": round(rate, 1),
-        "online_users": len(online_user_connections)
-    }
-    
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
+    from .stats import stats_snapshot
+
+    broadcast(
         "site_stats",
         {
             "type": "stats_update",
-            "stats": stats_data
+            "stats": stats_snapshot()
         }
     )
 
@@ -64,7 +47,6 @@ def send_comment_update(comment):
     from apps.products.models import Comment as ProductComment
     from apps.articles.models import ArticleComment
     
-    channel_layer = get_channel_layer()
     
     if isinstance(comment, ProductComment):
         group_name = f"product_{comment.product.id}_comments"
@@ -75,7 +57,7 @@ def send_comment_update(comment):
     else:
         return
 
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         group_name,
         {
             "type": "comment_update",
@@ -85,7 +67,7 @@ def send_comment_update(comment):
     )
     
     # Also send to admin comments group
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         "admin_comments",
         {
             "type": "comment_update",
@@ -94,26 +76,10 @@ def send_comment_update(comment):
         }
     )
 
-def send_product_update(product, action="update"):
-    """Sends a product update to the products group."""
-    from apps.products.serializers import ProductSerializer
-    
-    channel_layer = get_channel_layer()
-    serializer = ProductSerializer(product)
-    async_to_sync(channel_layer.group_send)(
-        "products",
-        {
-            "type": "product_update",
-            "action": action,
-            "product": serializer.data
-        }
-    )
-
 def send_wallet_update(user):
     """Sends a wallet balance update to the user's group."""
-    channel_layer = get_channel_layer()
     group_name = f"user_{user.id}_wallet"
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         group_name,
         {
             "type": "wallet_update",
@@ -123,11 +89,10 @@ def send_wallet_update(user):
 
 def send_wallet_request_update(user, request_id, status, admin_note=None):
     """Sends a wallet request status update message."""
-    channel_layer = get_channel_layer()
     
     # Send to user's personal wallet group
     user_group_name = f"user_{user.id}_wallet"
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         user_group_name,
         {
             "type": "wallet_request_update",
@@ -138,7 +103,7 @@ def send_wallet_request_update(user, request_id, status, admin_note=None):
     )
     
     # Also send to admin notifications group for real-time admin panel updates
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         "admin_notifications",
         {
             "type": "wallet_request_update",
@@ -151,10 +116,9 @@ def send_wallet_request_update(user, request_id, status, admin_note=None):
 
 def send_ticket_update(ticket):
     """Sends a ticket update to the user and admins."""
-    channel_layer = get_channel_layer()
     # Send to user
     user_group = f"user_{ticket.user.id}_tickets"
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         user_group,
         {
             "type": "ticket_update",
@@ -163,7 +127,7 @@ def send_ticket_update(ticket):
         }
     )
     # Send to admins group
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         "admin_notifications",
         {
             "type": "ticket_update",
@@ -175,8 +139,7 @@ def send_ticket_update(ticket):
 
 def broadcast_site_settings_update(settings_data):
     """Broadcasts site settings update to all connected clients."""
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
+    broadcast(
         "site_stats",  # Using existing group for site-wide updates
         {
             "type": "site_settings_update",
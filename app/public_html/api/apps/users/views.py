@@ -1,4 +1,6 @@
 # backend/apps/users/views.py
+import logging
+
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
@@ -16,30 +18,27 @@ from .serializers import (
     SiteSettingsSerializer
 )
 from .models import WalletChargeRequest, Ticket, TicketMessage, SiteStats, SatisfactionVote, SiteSettings
+from . import metrics
+from .stats import stats_snapshot
+from config.tracing import trace
+
+logger = logging.getLogger(__name__)
 
 class SiteStatsView(APIView):
     """View for site-wide statistics."""
     permission_classes = [permissions.AllowAny]
     
     def get(self, request):
-        stats, created = SiteStats.objects.get_or_create(id=1)
-        
-        # Calculate satisfaction stats
-        total_votes = SatisfactionVote.objects.count()
-        satisfied_votes = SatisfactionVote.objects.filter(vote='satisfied').count()
-        satisfaction_rate = (satisfied_votes / total_votes * 100) if total_votes > 0 else 100
-        
-        # Get online users count
-        from .consumers import online_user_connections
-        online_users = len(online_user_connections)
+        # شمارنده‌های رأی از کش خوانده می‌شوند
+        snapshot = stats_snapshot()
         
         return Response({
-            'total_visits': stats.total_visits,
-            'today_visits': stats.today_visits,
-            'online_users': online_users,
-            'total_satisfied_customers': satisfied_votes,
-            'satisfaction_rate': round(satisfaction_rate, 1),
-            'total_votes': total_votes
+            'total_visits': snapshot['total_visits'],
+            'today_visits': snapshot['today_visits'],
+            'online_users': snapshot['online_users'],
+            'total_satisfied_customers': snapshot['total_satisfied_customers'],
+            'satisfaction_rate': snapshot['satisfaction_rate'],
+            'total_votes': snapshot['total_votes']
         })
 
 class SiteSettingsView(APIView):
@@ -53,12 +52,8 @@ class SiteSettingsView(APIView):
     
     def put(self, request):
         """Update site settings (Admin only)."""
-        print(f"DEBUG: Site settings PUT request received")
-        print(f"DEBUG: User: {request.user}")
-        print(f"DEBUG: Is staff: {request.user.is_staff}")
-        print(f"DEBUG: Request data: {request.data}")
-        print(f"DEBUG: Request files: {request.FILES}")
-        
+        logger.debug('Site settings update by user %s (fields: %s, files: %s)', request.user.pk, request.data.keys(), request.FILES.keys())
+
         if not request.user.is_staff:
             return Response({'error': 'فقط مدیران مجاز به تغییر تنظیمات هستند.'}, status=status.HTTP_403_FORBIDDEN)
         
@@ -66,17 +61,16 @@ class SiteSettingsView(APIView):
         serializer = SiteSettingsSerializer(settings, data=request.data, partial=True, context={'request': request})
         
         if serializer.is_valid():
-            print(f"DEBUG: Serializer is valid, saving...")
-            serializer.save()
-            
-            # Broadcast settings update to all connected clients
-            from .utils import broadcast_site_settings_update
-            broadcast_site_settings_update(serializer.data)
-            
-            print(f"DEBUG: Settings saved successfully")
+            with trace(logger, 'site settings update'):
+                serializer.save()
+
+                # Broadcast settings update to all connected clients
+                from .utils import broadcast_site_settings_update
+                broadcast_site_settings_update(serializer.data)
+
             return Response(serializer.data)
         else:
-            print(f"DEBUG: Serializer errors: {serializer.errors}")
+            logger.debug('Site settings update rejected: %s', serializer.errors)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class SatisfactionVoteViewSet(viewsets.ModelViewSet):
@@ -94,9 +88,8 @@ class SatisfactionVoteViewSet(viewsets.ModelViewSet):
             from rest_framework.exceptions import ValidationError
             raise ValidationError("فقط کاربرانی که خرید انجام داده‌اند می‌توانند در نظرسنجی شرکت کنند.")
             
+        # شمارنده‌ها و ارسال آمار در سیگنال SatisfactionVote بروزرسانی می‌شوند
         serializer.save(user=self.request.user)
-        # from .utils import broadcast_site_stats
-        # broadcast_site_stats()
 
     @action(detail=False, methods=['get'])
     def my_vote(self, request):
@@ -104,13 +97,15 @@ class SatisfactionVoteViewSet(viewsets.ModelViewSet):
         if vote:
             return Response(SatisfactionVoteSerializer(vote).data)
         return Response({'vote': None})
+from .broadcast import dispatcher
 from .utils import send_wallet_update, send_wallet_request_update, send_ticket_update
 
 
 User = get_user_model()
 
 
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from .middleware import revoke_access_token
 
 class LogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -121,6 +116,9 @@ class LogoutView(APIView):
             if refresh_token:
                 token = RefreshToken(refresh_token)
                 token.blacklist()
+            # توکن دسترسی همین درخواست هم باطل می‌شود تا اتصال وب‌سوکت با آن پذیرفته نشود
+            if isinstance(request.auth, AccessToken):
+                revoke_access_token(request.auth)
             return Response({"message": "خروج با موفقیت انجام شد"}, status=status.HTTP_205_RESET_CONTENT)
         except Exception:
             return Response({"error": "توکن نامعتبر است"}, status=status.HTTP_400_BAD_REQUEST)
@@ -129,54 +127,24 @@ class AdminStatisticsView(APIView):
     permission_classes = [permissions.IsAdminUser]
     
     def get(self, request):
-        from apps.orders.models import Order
-        from apps.products.models import Product
-        from apps.articles.models import Article
-        from django.utils import timezone
-        from django.db.models import Sum
-        import datetime
-        
-        # Get visit stats
-        stats, created = SiteStats.objects.get_or_create(id=1)
-        
-        # Today's start
-        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        total_users = User.objects.count()
-        total_products = Product.objects.count()
-        total_articles = Article.objects.count()
-        
-        # Orders stats
-        total_orders = Order.objects.count()
-        pending_orders = Order.objects.filter(status=Order.Status.PENDING).count()
-        new_orders_today = Order.objects.filter(created_at__gte=today).count()
-        
-        # Sales stats
-        total_sales = Order.objects.filter(
-            status__in=[Order.Status.PAID, Order.Status.SENT]
-        ).aggregate(total=Sum('total_price'))['total'] or 0
-        
-        sales_today = Order.objects.filter(
-            status__in=[Order.Status.PAID, Order.Status.SENT],
-            created_at__gte=today
-        ).aggregate(total=Sum('total_price'))['total'] or 0
-        
-        # User stats
-        new_users_today = User.objects.filter(date_joined__gte=today).count()
-        
-        return Response({
-            'total_users': total_users,
-            'new_users_today': new_users_today,
-            'total_products': total_products,
-            'total_articles': total_articles,
-            'total_orders': total_orders,
-            'pending_orders': pending_orders,
-            'new_orders_today': new_orders_today,
-            'total_sales': total_sales,
-            'sales_today': sales_today,
-            'today_visits': stats.today_visits,
-            'total_visits': stats.total_visits,
-        })
+        # آمار از جدول‌های تجمیعی روزانه ساخته و برای چند ثانیه کش می‌شود
+        data = dict(metrics.dashboard())
+        data['broadcast_queue'] = dispatcher.stats()
+        return Response(data)
+
+
+class AdminStatisticsTimeseriesView(APIView):
+    """Daily orders, sales, new users and visits for the last `days` days (default 30)."""
+    permission_classes = [permissions.IsAdminUser]
+    max_days = 365
+
+    def get(self, request):
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            return Response({'error': 'days باید عدد باشد'}, status=status.HTTP_400_BAD_REQUEST)
+        days = max(1, min(days, self.max_days))
+        return Response({'days': days, 'series': metrics.timeseries(days)})
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):
@@ -242,20 +210,15 @@ class ProfileViewSet(viewsets.ViewSet):
             return Response(serializer.data)
         
         elif request.method == 'PATCH':
-            print(f"DEBUG: Received PATCH request")
-            print(f"DEBUG: request.data = {request.data}")
-            print(f"DEBUG: request.FILES = {request.FILES}")
-            
+            logger.debug('Profile update by user %s (fields: %s, files: %s)', user.pk, request.data.keys(), request.FILES.keys())
+
             serializer = UserSerializer(user, data=request.data, partial=True, context={'request': request})
-            print(f"DEBUG: Serializer is_valid = {serializer.is_valid()}")
-            
             if serializer.is_valid():
-                print(f"DEBUG: Validated data = {serializer.validated_data}")
                 serializer.save()
                 updated_serializer = UserSerializer(user, context={'request': request})
                 return Response(updated_serializer.data)
             else:
-                print(f"DEBUG: Serializer errors = {serializer.errors}")
+                logger.debug('Profile update of user %s rejected: %s', user.pk, serializer.errors)
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -294,7 +257,6 @@ class WalletChargeRequestViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
     def approve(self, request, pk=None):
         wallet_request = self.get_object()
-        print(f"Approving wallet request {pk}, current status: {wallet_request.status}")
         
         if wallet_request.status != 'pending':
             return Response({'error': 'این درخواست قبلاً بررسی شده است.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -303,13 +265,12 @@ class WalletChargeRequestViewSet(viewsets.ModelViewSet):
             wallet_request.status = 'approved'
             wallet_request.admin_note = request.data.get('admin_note', '')
             wallet_request.save()
-            print(f"Wallet request {pk} status updated to: {wallet_request.status}")
             
             user = wallet_request.user
             old_balance = user.wallet_balance
             user.wallet_balance += wallet_request.amount
             user.save()
-            print(f"User {user.id} balance updated from {old_balance} to {user.wallet_balance}")
+            logger.info('Wallet request %s approved: user %s balance %s -> %s', pk, user.pk, old_balance, user.wallet_balance)
             
             transaction.on_commit(lambda: send_wallet_update(user))
             transaction.on_commit(lambda: send_wallet_request_update(user, wallet_request.id, 'approved', wallet_request.admin_note))
@@ -323,7 +284,6 @@ class WalletChargeRequestViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
     def reject(self, request, pk=None):
         wallet_request = self.get_object()
-        print(f"Rejecting wallet request {pk}, current status: {wallet_request.status}")
         
         if wallet_request.status != 'pending':
             return Response({'error': 'این درخواست قبلاً بررسی شده است.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -331,7 +291,7 @@ class WalletChargeRequestViewSet(viewsets.ModelViewSet):
         wallet_request.status = 'rejected'
         wallet_request.admin_note = request.data.get('admin_note', 'درخواست توسط ادمین رد شد.')
         wallet_request.save()
-        print(f"Wallet request {pk} status updated to: {wallet_request.status}")
+        logger.info('Wallet request %s rejected', pk)
         
         send_wallet_request_update(wallet_request.user, wallet_request.id, 'rejected', wallet_request.admin_note)
         return Response({
@@ -0,0 +1,117 @@
+"""
+Buffered visit counting.
+
+`record_visit()` only increments an in-process counter keyed by the local
+date; it never touches the database. A daemon thread writes the pending counts
+every VISIT_FLUSH_INTERVAL seconds with one `F('visits') + n` UPDATE per day
+bucket of DailyVisitCount (creating the bucket on the first visit of a day),
+and flushes once more at interpreter exit. With an interval of 0 every visit
+is written immediately.
+
+Today's and total visits are derived from the buckets plus whatever this
+process has not flushed yet, so there is no singleton row to reset or lock.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class VisitBuffer:
+    """Visits counted in this process and not yet written, per date."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._thread = None
+
+    def add(self, count=1):
+        with self._lock:
+            self._pending[timezone.localdate()] += count
+        if self.interval > 0:
+            self._ensure_flusher()
+        else:
+            self.flush()
+
+    def pending(self, date=None):
+        with self._lock:
+            if date is None:
+                return sum(self._pending.values())
+            return self._pending.get(date, 0)
+
+    def flush(self):
+        """Write pending counts to DailyVisitCount; returns the number of visits written."""
+        from .models import DailyVisitCount
+
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        written = 0
+        try:
+            for date, count in sorted(pending.items()):
+                self._write(DailyVisitCount, date, count)
+                del pending[date]
+                written += count
+        finally:
+            if pending:
+                # Put back what could not be written; the next flush retries it
+                with self._lock:
+                    self._pending.update(pending)
+        return written
+
+    @staticmethod
+    def _write(model, date, count):
+        if model.objects.filter(date=date).update(visits=F('visits') + count):
+            return
+        try:
+            with transaction.atomic():
+                model.objects.create(date=date, visits=count)
+        except IntegrityError:
+            # Another process created today's bucket first
+            model.objects.filter(date=date).update(visits=F('visits') + count)
+
+    def _ensure_flusher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='visit-flusher', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing visit counts failed')
+            finally:
+                connections.close_all()
+
+
+buffer = VisitBuffer(settings.VISIT_FLUSH_INTERVAL)
+
+
+def record_visit(count=1):
+    """Count a visit without touching the database."""
+    buffer.add(count)
+
+
+def visit_totals():
+    """(today's visits, total visits), including this process's unflushed visits."""
+    from .models import DailyVisitCount
+
+    today = timezone.localdate()
+    totals = DailyVisitCount.objects.aggregate(
+        total=Sum('visits'), today=Sum('visits', filter=Q(date=today)),
+    )
+    return (totals['today'] or 0) + buffer.pending(today), (totals['total'] or 0) + buffer.pending()
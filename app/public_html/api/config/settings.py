@@ -89,6 +89,43 @@ CHANNEL_LAYERS = {
     },
 }
 
+# صف ارسال پیام‌های WebSocket (apps.users.broadcast)
+# BROADCAST_SYNC: ارسال همزمان و بدون صف (برای تست‌ها)
+BROADCAST_SYNC = config('BROADCAST_SYNC', default=False, cast=bool)
+BROADCAST_QUEUE_SIZE = config('BROADCAST_QUEUE_SIZE', default=1000, cast=int)
+BROADCAST_BATCH_SIZE = config('BROADCAST_BATCH_SIZE', default=50, cast=int)
+# رفتار هنگام پر بودن صف: 'drop_oldest' یا 'drop_newest'
+BROADCAST_OVERFLOW = config('BROADCAST_OVERFLOW', default='drop_oldest')
+
+# کاربران آنلاین (apps.users.presence)
+# با بیش از یک worker از apps.users.presence.RedisPresence استفاده کنید
+PRESENCE_BACKEND = config('PRESENCE_BACKEND', default='apps.users.presence.MemoryPresence')
+PRESENCE_REDIS_URL = config('PRESENCE_REDIS_URL', default='redis://127.0.0.1:6379/0')
+# کاربری که این مدت (ثانیه) heartbeat نفرستد آنلاین حساب نمی‌شود
+PRESENCE_TIMEOUT = config('PRESENCE_TIMEOUT', default=300, cast=int)
+PRESENCE_SWEEP_INTERVAL = config('PRESENCE_SWEEP_INTERVAL', default=60, cast=int)
+# حداکثر یک پیام stats_update در هر بازه (ثانیه)؛ 0 یعنی ارسال فوری
+STATS_BROADCAST_INTERVAL = config('STATS_BROADCAST_INTERVAL', default=5, cast=float)
+# شمارنده‌های رضایت در کش هر پردازه پس از این مدت (ثانیه) دوباره از دیتابیس شمرده می‌شوند
+SATISFACTION_TOTALS_TTL = config('SATISFACTION_TOTALS_TTL', default=60, cast=int)
+# بازدیدها در حافظه جمع و هر چند ثانیه یک بار در DailyVisitCount ذخیره می‌شوند؛ 0 یعنی ذخیره‌ی فوری
+VISIT_FLUSH_INTERVAL = config('VISIT_FLUSH_INTERVAL', default=10, cast=float)
+# مدت کش آمار داشبورد ادمین (ثانیه)
+ADMIN_STATS_CACHE_TTL = config('ADMIN_STATS_CACHE_TTL', default=30, cast=int)
+# درخت دسته‌بندی هر پردازه حداکثر این مدت (ثانیه) بدون بازسازی استفاده می‌شود (کش LocMem بین پردازه‌ها مشترک نیست)
+CATEGORY_TREE_TTL = config('CATEGORY_TREE_TTL', default=60, cast=float)
+# کش کاربران احراز شده‌ی وب‌سوکت (بر اساس jti توکن)؛ TTL صفر یعنی بدون کش
+WS_AUTH_CACHE_TTL = config('WS_AUTH_CACHE_TTL', default=60, cast=int)
+WS_AUTH_CACHE_SIZE = config('WS_AUTH_CACHE_SIZE', default=1024, cast=int)
+# ذخیره‌ی تأخیری پیام‌های چت (apps.chat.buffer): پیام فوراً ارسال و دسته‌ای با bulk_create ذخیره می‌شود
+CHAT_WRITE_BEHIND = config('CHAT_WRITE_BEHIND', default=False, cast=bool)
+CHAT_FLUSH_INTERVAL = config('CHAT_FLUSH_INTERVAL', default=1, cast=float)
+# حداکثر پیام در صف؛ با پر شدن صف، ذخیره در همان درخواست انجام می‌شود
+CHAT_BUFFER_SIZE = config('CHAT_BUFFER_SIZE', default=5000, cast=int)
+CHAT_FLUSH_BATCH = config('CHAT_FLUSH_BATCH', default=500, cast=int)
+# دسته‌ای که این تعداد بار ناموفق باشد پیام به پیام ذخیره و پیام‌های خراب کنار گذاشته می‌شوند
+CHAT_FLUSH_MAX_ATTEMPTS = config('CHAT_FLUSH_MAX_ATTEMPTS', default=3, cast=int)
+
 
 # Database
 DB_ENGINE = config('DB_ENGINE', default='django.db.backends.mysql')
@@ -163,6 +200,23 @@ MEDIA_ROOT = config('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'media'))
 DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024  # 100MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024  # 100MB
 
+# دانلود فایل محصولات: '' (استریم توسط جنگو)، 'x-accel-redirect' (nginx) یا 'x-sendfile' (Apache)
+PRODUCT_DOWNLOAD_SENDFILE = config('PRODUCT_DOWNLOAD_SENDFILE', default='')
+# مسیر internal در nginx که به MEDIA_ROOT اشاره می‌کند (فقط برای x-accel-redirect)
+PRODUCT_DOWNLOAD_ACCEL_PREFIX = config('PRODUCT_DOWNLOAD_ACCEL_PREFIX', default='/protected-media/')
+
+# تعداد thread های ساخت فاکتور PDF در پس‌زمینه
+INVOICE_RENDER_WORKERS = config('INVOICE_RENDER_WORKERS', default=2, cast=int)
+# False: بدون ساخت در پس‌زمینه؛ فاکتور هنگام دانلود ساخته می‌شود (برای تست‌ها)
+INVOICE_RENDER_BACKGROUND = config('INVOICE_RENDER_BACKGROUND', default=True, cast=bool)
+# فاکتورهای ساخته‌شده (خارج از MEDIA_ROOT تا عمومی نباشد)
+INVOICE_DIR = config('INVOICE_DIR', default=os.path.join(BASE_DIR, 'private', 'invoices'))
+# خروجی گروهی فاکتورها (خارج از MEDIA_ROOT تا عمومی نباشد) و تعداد پردازه‌های ساخت آن؛ 0 یعنی بدون پردازه جدا
+INVOICE_EXPORT_DIR = config('INVOICE_EXPORT_DIR', default=os.path.join(BASE_DIR, 'private', 'invoice-exports'))
+INVOICE_EXPORT_PROCESSES = config('INVOICE_EXPORT_PROCESSES', default=2, cast=int)
+# حداکثر تعداد سفارش در یک PDF ادغام‌شده؛ کل سند تا پایان در حافظه می‌ماند (برای بیشتر از آن zip)
+INVOICE_EXPORT_MERGED_MAX_ORDERS = config('INVOICE_EXPORT_MERGED_MAX_ORDERS', default=200, cast=int)
+
 # مدل کاربر شخصی سازی شده
 AUTH_USER_MODEL = 'users.User'
 
@@ -276,14 +330,18 @@ TINYMCE_DEFAULT_CONFIG = {
 # Logging configuration (handles missing logs/ directory gracefully)
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 LOG_FILE = os.path.join(LOG_DIR, 'django.log')
+# APP_LOG_LEVEL=DEBUG لاگ‌های جزئی اپ‌ها را فعال می‌کند؛ LOG_SAMPLE_RATE سهم نگه‌داشته‌شده از آن‌هاست
+APP_LOG_LEVEL = config('APP_LOG_LEVEL', default='INFO')
+LOG_SAMPLE_RATE = config('LOG_SAMPLE_RATE', default=1.0, cast=float)
 file_handler = None
 try:
     os.makedirs(LOG_DIR, exist_ok=True)
     file_handler = {
-        'level': 'INFO',
+        'level': 'DEBUG',
         'class': 'logging.FileHandler',
         'filename': LOG_FILE,
         'formatter': 'verbose',
+        'filters': ['sampled'],
     }
 except Exception:
     file_handler = None
@@ -301,11 +359,18 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        'sampled': {
+            '()': 'config.tracing.SampledFilter',
+            'rate': LOG_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'console': {
-            'level': 'INFO',
+            'level': 'DEBUG',
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
+            'filters': ['sampled'],
         },
     },
     'root': {
@@ -318,6 +383,9 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'apps': {
+            'level': APP_LOG_LEVEL,
+        },
     },
 }
 
@@ -0,0 +1,47 @@
+"""
+Level-gated logging helpers for hot request paths.
+
+Code on hot paths logs through `logging.getLogger(__name__)` with %-style
+arguments. The message is therefore only formatted when a handler actually
+emits the record. The 'apps' logger level (APP_LOG_LEVEL) decides whether
+DEBUG records are created at all.
+
+SampledFilter is attached to the handlers. It keeps every INFO-and-above
+record and only a LOG_SAMPLE_RATE fraction of DEBUG records, so enabling debug
+logging under load does not flood the output.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+
+class SampledFilter(logging.Filter):
+    """Pass records at `min_level` and above; sample the ones below at `rate`."""
+
+    def __init__(self, rate=1.0, min_level='INFO'):
+        super().__init__()
+        self.rate = float(rate)
+        self.min_level = logging.getLevelName(min_level) if isinstance(min_level, str) else min_level
+
+    def filter(self, record):
+        if record.levelno >= self.min_level or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+@contextmanager
+def trace(logger, operation, level=logging.DEBUG, **fields):
+    """
+    Log how long the block took at `level`, together with `fields`.
+
+    Nothing is measured or formatted when `logger` has `level` disabled.
+    """
+    if not logger.isEnabledFor(level):
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        logger.log(level, '%s took %.1f ms %s', operation, (time.perf_counter() - started) * 1000, fields)
@@ -87,7 +87,7 @@ export default function AdminProductsPage() {
                             </td>
                             <td className="px-6 py-3">
                                 <span className="bg-primary/10 text-primary px-2 py-1 rounded-md text-xs font-bold">
-                                    {product.category?.name}
+                                    {product.category_name || product.category?.name}
                                 </span>
                             </td>
                               <td className="px-6 py-3 font-bold text-foreground">
@@ -139,7 +139,7 @@ export default function AdminProductsPage() {
                 <h3 className="font-bold text-foreground truncate">{product.title}</h3>
                 <p className="text-primary font-bold text-sm">{formatPrice(product.price)}</p>
                 <span className="inline-block bg-primary/10 text-primary px-2 py-0.5 rounded text-xs font-bold mt-1">
-                  {product.category?.name}
+                  {product.category_name || product.category?.name}
                 </span>
               </div>
             </div>
@@ -103,7 +103,7 @@ export default function CartPage() {
                                 {/* اطلاعات */}
                                 <div className="flex-1">
                                     <h3 className="font-bold text-foreground mb-1">{item.title}</h3>
-                                    <p className="text-sm text-foreground-muted mb-2">{item.category?.name || item.category}</p>
+                                    <p className="text-sm text-foreground-muted mb-2">{item.category_name || item.category?.name || item.category}</p>
                                     <div className="text-primary font-bold">
                                         {(() => {
                                             const finalPrice = item.discount_price !== null && item.discount_price !== undefined 
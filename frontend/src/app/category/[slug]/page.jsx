@@ -3,7 +3,7 @@
 
 import { useEffect, useState, useCallback } from "react";
 import { useParams } from "next/navigation";
-import api from "@/lib/axios";
+import { fetchProductPage } from "@/lib/productPages";
 import { useProductWebSocket } from "@/lib/useProductWebSocket";
 import ProductCard from "@/components/ProductCard";
 import { useLoading } from "@/context/LoadingContext";
@@ -13,6 +13,8 @@ export default function CategoryPage() {
   const { slug } = useParams();
   const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextParams, setNextParams] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [sortOrder, setSortOrder] = useState("newest");
   const [error, setError] = useState(null);
   const { showLoading, hideLoading } = useLoading();
@@ -32,7 +34,8 @@ export default function CategoryPage() {
           return prev.map(p => {
             if (p.id === data.product.id) {
               // اگر محصول غیرفعال شده یا دسته‌اش تغییر کرده، آن را حذف کن
-              if (!data.product.is_active || data.product.category?.slug !== categorySlug) {
+              // در پیام‌های partial دسته فقط در صورت تغییر ارسال می‌شود
+              if (!data.product.is_active || (data.product.category && data.product.category.slug !== categorySlug)) {
                 return null;
               }
               // بروزرسانی محصول با داده‌های جدید
@@ -63,33 +66,14 @@ useEffect(() => {
       showLoading(); // Global loading
       
       try {
-        console.log("Fetching products for category:", categorySlug); // دیباگ
-        const apiUrl = `/products/?category=${encodeURIComponent(categorySlug)}&_t=${Date.now()}`;
-        console.log("API URL:", apiUrl); // دیباگ
-        const response = await api.get(apiUrl);
-        console.log("API Response:", response.data); // دیباگ
-        
-        // Handle different response structures
-        let fetchedProducts = [];
-        if (response.data) {
-          if (Array.isArray(response.data)) {
-            fetchedProducts = response.data;
-          } else if (response.data.results && Array.isArray(response.data.results)) {
-            fetchedProducts = response.data.results;
-          } else if (response.data.value && Array.isArray(response.data.value)) {
-            fetchedProducts = response.data.value;
-          } else if (typeof response.data === 'object' && response.data.id) {
-            // Single object response
-            fetchedProducts = [response.data];
-          }
-        }
-        
-        console.log("Fetched products:", fetchedProducts); // دیباگ
-        setProducts(fetchedProducts);
+        const page = await fetchProductPage({ category: categorySlug });
+        setProducts(page.products);
+        setNextParams(page.nextParams);
       } catch (error) {
         console.error("Error fetching category products:", error);
         setError(error.message);
         setProducts([]); // تنظیم آرایه خالی در صورت خطا
+        setNextParams(null);
       } finally {
         setLoading(false);
         hideLoading(); // Hide global loading
@@ -104,6 +88,24 @@ useEffect(() => {
     }
   }, [categorySlug]);
   
+  const loadMore = async () => {
+    if (!nextParams || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await fetchProductPage(nextParams);
+      // محصولاتی که از طریق وب‌سوکت اضافه شده‌اند دوباره اضافه نشوند
+      setProducts(prev => {
+        const seen = new Set(prev.map(p => p.id));
+        return [...prev, ...page.products.filter(p => !seen.has(p.id))];
+      });
+      setNextParams(page.nextParams);
+    } catch (error) {
+      console.error("Error fetching more category products:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // منطق مرتب‌سازی (Client-Side Sorting)
   const sortedProducts = [...products].sort((a, b) => {
     switch (sortOrder) {
@@ -189,6 +191,18 @@ useEffect(() => {
             )}
           </div>
         )}
+
+        {!loading && nextParams && (
+          <div className="flex justify-center mt-8">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="px-6 py-3 bg-secondary text-foreground rounded-xl font-medium hover:bg-secondary/80 transition-all disabled:opacity-50"
+            >
+              {loadingMore ? "در حال بارگذاری..." : "نمایش محصولات بیشتر"}
+            </button>
+          </div>
+        )}
         
       </div>
     </div>
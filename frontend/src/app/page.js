@@ -1,13 +1,16 @@
 "use client";
 
 import { useEffect, useState, useCallback } from "react";
-import api from "@/lib/axios";
+import { fetchProductPage } from "@/lib/productPages";
 import { useProductWebSocket } from "@/lib/useProductWebSocket";
 import HeroSection from "@/components/HeroSection";
 import ProductCard from "@/components/ProductCard";
 import SatisfactionSurvey from "@/components/SatisfactionSurvey";
 import { Sparkles, Shield, Zap, Clock, HeadphonesIcon, CreditCard } from "lucide-react";
 
+// تعداد محصولات بخش «جدیدترین محصولات»
+const HOME_PRODUCTS_COUNT = 8;
+
 export default function Home() {
   const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -29,7 +32,8 @@ export default function Home() {
             }
             return prev.map(p => p.id === data.product.id ? { ...p, ...data.product } : p);
           } else {
-            if (data.product.is_active) {
+            // پیام‌های partial فقط فیلدهای تغییرکرده را دارند و برای افزودن کارت کافی نیستند
+            if (data.product.is_active && !data.partial) {
               return [data.product, ...prev];
             }
           }
@@ -46,20 +50,9 @@ export default function Home() {
   useEffect(() => {
     const fetchProducts = async () => {
       try {
-        const response = await api.get("/products/");
-        let fetchedProducts = [];
-        if (response.data) {
-          if (Array.isArray(response.data)) {
-            fetchedProducts = response.data;
-          } else if (response.data.results && Array.isArray(response.data.results)) {
-            fetchedProducts = response.data.results;
-          } else if (response.data.value && Array.isArray(response.data.value)) {
-            fetchedProducts = response.data.value;
-          } else if (typeof response.data === 'object' && response.data.id) {
-            fetchedProducts = [response.data];
-          }
-        }
-        setProducts(fetchedProducts);
+        // فقط صفحه اول؛ لیست کامل در /products است
+        const page = await fetchProductPage({ page_size: HOME_PRODUCTS_COUNT });
+        setProducts(page.products);
       } catch (error) {
         console.error("خطا در دریافت محصولات:", error);
       } finally {
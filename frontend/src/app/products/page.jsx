@@ -3,6 +3,7 @@
 import { useEffect, useState, Suspense, useCallback } from "react";
 import { useSearchParams, useRouter } from "next/navigation";
 import api from "@/lib/axios";
+import { fetchProductPage } from "@/lib/productPages";
 import { useProductWebSocket } from "@/lib/useProductWebSocket";
 import ProductCard from "@/components/ProductCard";
 import { Search, SlidersHorizontal, ArrowDownWideNarrow, ArrowUpNarrowWide, Clock, Grid3X3, LayoutGrid, X, Filter, Package, Sparkles } from "lucide-react";
@@ -16,6 +17,8 @@ function ProductsContent() {
   const [products, setProducts] = useState([]);
   const [categories, setCategories] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextParams, setNextParams] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [sortOrder, setSortOrder] = useState("newest");
   const [selectedCategory, setSelectedCategory] = useState(categoryParam);
   const [priceRange, setPriceRange] = useState({ min: '', max: '' });
@@ -39,7 +42,8 @@ function ProductsContent() {
             }
             return prev.map(p => p.id === data.product.id ? { ...p, ...data.product } : p);
           } else {
-            if (data.product.is_active) {
+            // پیام‌های partial فقط فیلدهای تغییرکرده را دارند و برای افزودن کارت کافی نیستند
+            if (data.product.is_active && !data.partial) {
               return [data.product, ...prev];
             }
           }
@@ -69,37 +73,21 @@ function ProductsContent() {
     const fetchProducts = async () => {
       setLoading(true);
       try {
-        let url = `/products/`;
-        const params = new URLSearchParams();
-        
+        const params = {};
         if (query.trim()) {
-          params.append('search', query);
+          params.search = query;
         }
         if (selectedCategory) {
-          params.append('category', selectedCategory);
+          params.category = selectedCategory;
         }
-        
-        if (params.toString()) {
-          url += `?${params.toString()}`;
-        }
-        
-        const response = await api.get(url);
-        let fetchedProducts = [];
-        if (response.data) {
-          if (Array.isArray(response.data)) {
-            fetchedProducts = response.data;
-          } else if (response.data.results && Array.isArray(response.data.results)) {
-            fetchedProducts = response.data.results;
-          } else if (response.data.value && Array.isArray(response.data.value)) {
-            fetchedProducts = response.data.value;
-          } else if (typeof response.data === 'object' && response.data.id) {
-            fetchedProducts = [response.data];
-          }
-        }
-        setProducts(fetchedProducts);
+
+        const page = await fetchProductPage(params);
+        setProducts(page.products);
+        setNextParams(page.nextParams);
       } catch (error) {
         console.error("Error fetching products:", error);
         setProducts([]);
+        setNextParams(null);
       } finally {
         setLoading(false);
       }
@@ -108,6 +96,24 @@ function ProductsContent() {
     fetchProducts();
   }, [query, selectedCategory]);
 
+  const loadMore = async () => {
+    if (!nextParams || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await fetchProductPage(nextParams);
+      // محصولاتی که از طریق وب‌سوکت اضافه شده‌اند دوباره اضافه نشوند
+      setProducts(prev => {
+        const seen = new Set(prev.map(p => p.id));
+        return [...prev, ...page.products.filter(p => !seen.has(p.id))];
+      });
+      setNextParams(page.nextParams);
+    } catch (error) {
+      console.error("Error fetching more products:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const filteredProducts = products.filter(product => {
     const price = product.discount_price !== null ? product.discount_price : product.price;
     const minOk = !priceRange.min || price >= Number(priceRange.min);
@@ -329,6 +335,17 @@ function ProductsContent() {
                     <ProductCard product={product} />
                   </div>
                 ))}
+                {nextParams && (
+                  <div className="col-span-full flex justify-center pt-2">
+                    <button
+                      onClick={loadMore}
+                      disabled={loadingMore}
+                      className="px-6 py-3 bg-secondary text-foreground rounded-xl font-medium hover:bg-secondary/80 transition-all disabled:opacity-50"
+                    >
+                      {loadingMore ? "در حال بارگذاری..." : "نمایش محصولات بیشتر"}
+                    </button>
+                  </div>
+                )}
               </div>
             ) : (
               <div className="bg-card border border-border rounded-2xl p-12 text-center">
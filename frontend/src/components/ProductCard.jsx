@@ -98,9 +98,11 @@ export default function ProductCard({ product }) {
         <div className="p-4 flex flex-col flex-1">
           <div className="flex items-center justify-between mb-2">
               <span className="text-xs text-foreground-muted bg-secondary px-2 py-1 rounded-md">
-                  {product.category && typeof product.category === 'object' 
-                    ? (product.category.name || 'بدون دسته') 
-                    : (product.category || 'بدون دسته')}
+                  {product.category_name
+                    || (product.category && typeof product.category === 'object'
+                      ? product.category.name
+                      : product.category)
+                    || 'بدون دسته'}
               </span>
                 {product.stock > 3 && (
                   <span className="text-[10px] text-green-500 bg-green-500/10 px-2 py-0.5 rounded-full font-medium">
@@ -167,6 +167,9 @@ export default function AdminChat() {
           
           // بروزرسانی لیست اتاق‌ها
           mutate();
+        } else if (data.type === 'chat_message_saved' && data.message_id) {
+          // جایگزینی شناسه‌ی موقت پس از ذخیره‌ی پیام
+          setMessages(prev => prev.map(msg => msg.id === data.temp_id ? { ...msg, id: data.message_id } : msg));
         }
       } catch (error) {
         console.error('❌ Error parsing Admin Chat WebSocket message:', error);
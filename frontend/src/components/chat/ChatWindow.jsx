@@ -312,6 +312,9 @@ export default function ChatWindow({ onClose, onlineAdmins, onUnreadCountChange
               }
             }, 500);
           }
+        } else if (data.type === 'chat_message_saved' && data.message_id) {
+          // جایگزینی شناسه‌ی موقت پس از ذخیره‌ی پیام
+          setMessages(prev => prev.map(msg => msg.id === data.temp_id ? { ...msg, id: data.message_id } : msg));
         }
       } catch (error) {
         console.error('❌ Error parsing Chat WebSocket message:', error);
@@ -2,6 +2,7 @@
 import axios from 'axios';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8001/api";
+const MAX_RENDER_POLLS = 10;
 
 // تابع برای دانلود PDF از بک‌اند Django
 export const downloadOrderPDF = async (order) => {
@@ -19,7 +20,7 @@ export const downloadOrderPDF = async (order) => {
   const token = typeof window !== 'undefined' ? localStorage.getItem('accessToken') : null;
 
   try {
-    const response = await axios({
+    const requestPDF = () => axios({
       method: 'GET',
       url: `${API_BASE_URL}/orders/${order.id}/download_pdf/`,
       responseType: 'blob',
@@ -29,6 +30,17 @@ export const downloadOrderPDF = async (order) => {
       timeout: 60000,
     });
 
+    // فاکتور در پس‌زمینه ساخته می‌شود؛ تا آماده شدن (پاسخ 202) دوباره تلاش می‌کنیم
+    let response = await requestPDF();
+    for (let attempt = 0; response.status === 202 && attempt < MAX_RENDER_POLLS; attempt++) {
+      const retryAfter = Number(response.headers['retry-after']) || 2;
+      await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+      response = await requestPDF();
+    }
+    if (response.status === 202) {
+      throw new Error('فاکتور در حال آماده‌سازی است. لطفا چند لحظه دیگر دوباره تلاش کنید.');
+    }
+
     // بررسی نوع پاسخ
     const contentType = response.headers['content-type'];
     
@@ -0,0 +1,27 @@
+// مسیر: src/lib/productPages.js
+import api from "@/lib/axios";
+
+// تعداد محصول در هر صفحه از لیست‌های فروشگاه
+export const PRODUCTS_PAGE_SIZE = 24;
+
+// پارامترهای صفحه بعد (cursor یا offset جستجو) را از لینک next بیرون می‌کشد
+// تا درخواست بعدی هم از baseURL همین کلاینت برود
+export const nextPageParams = (next) => {
+  if (!next) return null;
+  return Object.fromEntries(new URL(next).searchParams.entries());
+};
+
+// یک صفحه از /products/ را می‌گیرد؛ خروجی: { products, nextParams }
+export const fetchProductPage = async (params) => {
+  const response = await api.get("/products/", {
+    params: { page_size: PRODUCTS_PAGE_SIZE, ...params },
+  });
+  const data = response.data || {};
+  if (Array.isArray(data)) {
+    return { products: data, nextParams: null };
+  }
+  return {
+    products: Array.isArray(data.results) ? data.results : [],
+    nextParams: nextPageParams(data.next),
+  };
+};
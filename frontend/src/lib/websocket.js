@@ -57,9 +57,13 @@ class OrderWebSocket {
     }
     if (this.ws?.readyState === WebSocket.OPEN) return;
 
+    // سوکت سفارش‌ها فقط برای کاربران واردشده باز می‌شود
+    const token = localStorage.getItem("accessToken");
+    if (!token) return;
+
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     const host = window.location.host;
-    const wsUrl = `${protocol}//${host}/api/ws/orders/`;
+    const wsUrl = `${protocol}//${host}/api/ws/orders/?token=${encodeURIComponent(token)}`;
     
     this.ws = new WebSocket(wsUrl);
     